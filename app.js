@@ -521,6 +521,32 @@ class RomDownloaderApp {
             const card = this.createRomCard(rom);
             resultsContainer.appendChild(card);
         });
+        
+        this.markLocalDownloads();
+    }
+    
+    async markLocalDownloads() {
+        // One /check-files request for the whole result list instead of one per ROM
+        if (window.location.hostname.includes('github.io') || this.romResults.length === 0) {
+            return;
+        }
+        
+        const roms = this.romResults;
+        const found = await this.checkLocalDownloads(roms.map(rom => rom.displayName));
+        if (roms !== this.romResults) {
+            return; // A newer search replaced the list meanwhile
+        }
+        
+        const cards = document.getElementById('romList').children;
+        roms.forEach((rom, index) => {
+            const uploadBtn = cards[index]?.querySelector('.upload');
+            const filePath = found.get(rom.displayName);
+            // Only the exact file counts; an extracted copy can't be uploaded under this name
+            if (uploadBtn && filePath) {
+                uploadBtn.classList.add('local');
+                uploadBtn.title = `Upload to Device (found at ${filePath})`;
+            }
+        });
     }
     
     createRomCard(rom) {
@@ -673,8 +699,7 @@ class RomDownloaderApp {
     }
     
     async checkLocalDownload(fileName) {
-        // Check if file exists in Downloads folder (this is a simplified check)
-        // In a real implementation, you'd maintain a registry of downloaded files
+        // Exact matches only: the path is uploaded under this file name
         try {
             const response = await fetch('http://localhost:8002/check-file', {
                 method: 'POST',
@@ -691,6 +716,31 @@ class RomDownloaderApp {
         }
     }
     
+    async checkLocalDownloads(fileNames) {
+        // Look the names up in the transfer service's index of the local ROM
+        // library (Downloads and any --library-dir, subfolders included).
+        // Returns a Map of file name -> local path for the exact files found.
+        const found = new Map();
+        try {
+            const response = await fetch('http://localhost:8002/check-files', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ fileNames: fileNames, variants: false })
+            });
+            const result = await response.json();
+            for (const item of result.results || []) {
+                if (item.exists && item.match === 'exact') {
+                    found.set(item.fileName, item.filePath);
+                }
+            }
+        } catch (error) {
+            console.error('File check error:', error);
+        }
+        return found;
+    }
+    
     async downloadAndTransferRom(rom) {
         // Check if we're running on GitHub Pages (no backend services)
         if (window.location.hostname.includes('github.io')) {
@@ -739,6 +789,7 @@ class RomDownloaderApp {
                     romUrl: rom.downloadUrl,
                     romName: rom.displayName,
                     platform: rom.platform?.label?.toLowerCase() || 'roms',
+                    size: rom.size,
                     hostConfig: hostConfig
                 })
             });
@@ -769,6 +820,38 @@ class RomDownloaderApp {
         }
     }
     
+    watchJobProgress(jobId, onProgress) {
+        // Resolves once the transfer service reports the job as finished
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(`http://localhost:8002/progress?job=${jobId}`);
+            events.addEventListener('progress', (event) => {
+                const data = JSON.parse(event.data);
+                if (data.jobs.length > 0) {
+                    onProgress(data.jobs[0], data.transfers);
+                }
+            });
+            events.addEventListener('done', () => {
+                events.close();
+                resolve();
+            });
+            events.onerror = () => {
+                events.close();
+                reject(new Error('Lost connection to transfer service'));
+            };
+        });
+    }
+    
+    formatBytes(bytes) {
+        const units = ['B', 'KB', 'MB', 'GB'];
+        let value = bytes || 0;
+        let unit = 0;
+        while (value >= 1024 && unit < units.length - 1) {
+            value /= 1024;
+            unit++;
+        }
+        return `${value.toFixed(unit === 0 ? 0 : 1)} ${units[unit]}`;
+    }
+    
     resetComboButton(comboBtn) {
         if (comboBtn) {
             comboBtn.disabled = false;
@@ -807,59 +890,60 @@ class RomDownloaderApp {
         
         try {
             const total = this.romResults.length;
-            const successful = [];
-            const failed = [];
             
             this.showNotification(`📡 Starting bulk stream transfer of ${total} ROMs to ${this.selectedHost.ip}`, 'info');
             
-            // Stream each ROM directly to device
-            for (let i = 0; i < total; i++) {
-                const rom = this.romResults[i];
-                
-                // Update progress UI
-                const percentage = (i / total) * 100;
-                progressFill.style.width = `${percentage}%`;
-                progressText.textContent = `Streaming ${rom.displayName} (${i + 1}/${total})`;
-                
-                try {
-                    // Stream ROM directly from source to device
-                    const response = await fetch('http://localhost:8002/', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({
-                            romUrl: rom.downloadUrl,
-                            romName: rom.displayName,
-                            platform: rom.platform?.label?.toLowerCase() || 'roms',
-                            hostConfig: hostConfig
-                        })
-                    });
-                    
-                    const result = await response.json();
-                    
-                    if (result.success) {
-                        successful.push(rom.displayName);
-                        console.log(`✅ Streamed successfully: ${rom.displayName}`);
-                    } else {
-                        failed.push({ name: rom.displayName, error: result.error });
-                        console.log(`❌ Stream failed: ${rom.displayName} - ${result.error}`);
-                    }
-                    
-                } catch (error) {
-                    failed.push({ name: rom.displayName, error: error.message });
-                    console.error(`❌ Stream error for ${rom.displayName}:`, error);
-                }
+            // Hand the whole batch to the transfer service; it runs the
+            // downloads and uploads in parallel on its own worker pool
+            const response = await fetch('http://localhost:8002/jobs', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    roms: this.romResults.map(rom => ({
+                        romUrl: rom.downloadUrl,
+                        romName: rom.displayName,
+                        platform: rom.platform?.label?.toLowerCase() || 'roms',
+                        // Known sizes spare the service a HEAD per ROM when ordering the queue
+                        size: rom.size
+                    })),
+                    hostConfig: hostConfig
+                })
+            });
+            
+            let job = await response.json();
+            if (!job.success) {
+                throw new Error(job.error || 'Could not start transfer job');
+            }
+            
+            // Follow byte-level progress until every ROM has finished
+            await this.watchJobProgress(job.jobId, (jobProgress, transfers) => {
+                const done = total - (jobProgress.counts.queued || 0) - (jobProgress.counts.running || 0);
+                const active = transfers.filter(t => !['done', 'failed', 'skipped'].includes(t.phase));
+                // Finished files count fully; in-flight ones by bytes sent
+                const partial = active.reduce((sum, t) => sum + (t.totalBytes ? t.uploadedBytes / t.totalBytes : 0), 0);
+                progressFill.style.width = `${((done + partial) / total) * 100}%`;
                 
-                // Brief pause between transfers to prevent overwhelming
-                if (i < total - 1) {
-                    await new Promise(resolve => setTimeout(resolve, 500));
-                }
+                const eta = Math.max(0, ...active.map(t => t.eta || 0));
+                progressText.textContent = `Streaming ROMs (${done}/${total} done, ${active.length} in progress) · ` +
+                    `${this.formatBytes(jobProgress.uploadRate)}/s` + (eta ? ` · ~${Math.ceil(eta)}s left` : '');
+            });
+            
+            const statusResponse = await fetch(`http://localhost:8002/jobs/${job.jobId}`);
+            job = await statusResponse.json();
+            if (!job.success) {
+                throw new Error(job.error || 'Lost track of transfer job');
             }
             
+            const successful = job.items.filter(item => item.status === 'completed').map(item => item.romName);
+            const skipped = job.items.filter(item => item.status === 'skipped').map(item => item.romName);
+            const failed = job.items.filter(item => item.status !== 'completed' && item.status !== 'skipped')
+                .map(item => ({ name: item.romName, error: item.error || item.status }));
+            
             // Final progress update
             progressFill.style.width = '100%';
-            progressText.textContent = `Completed ${successful.length}/${total} transfers`;
+            progressText.textContent = `Completed ${successful.length + skipped.length}/${total} transfers`;
             
             // Wait a moment then hide progress
             setTimeout(() => {
@@ -870,17 +954,18 @@ class RomDownloaderApp {
             // Show comprehensive results
             const successCount = successful.length;
             const failedCount = failed.length;
+            const skippedNote = skipped.length > 0 ? ` (${skipped.length} already on device)` : '';
             
             if (failedCount === 0) {
-                this.showNotification(`🎉 All ${successCount} ROMs streamed successfully to device!`, 'success');
-            } else if (successCount === 0) {
+                this.showNotification(`🎉 All ${successCount + skipped.length} ROMs are on the device${skippedNote}!`, 'success');
+            } else if (successCount === 0 && skipped.length === 0) {
                 this.showNotification(`❌ All ${failedCount} ROM streams failed!`, 'error');
             } else {
-                this.showNotification(`⚠️ Bulk stream completed: ${successCount} successful, ${failedCount} failed out of ${total}`, 'warning');
+                this.showNotification(`⚠️ Bulk stream completed: ${successCount} successful, ${failedCount} failed out of ${total}${skippedNote}`, 'warning');
             }
             
             // Log detailed results
-            console.log('Bulk stream results:', { successful, failed, total });
+            console.log('Bulk stream results:', { successful, skipped, failed, total });
             
         } catch (error) {
             console.error('Bulk stream error:', error);
@@ -1094,28 +1179,40 @@ class RomDownloaderApp {
         scanBtn.textContent = 'Scanning...';
         scanBtn.disabled = true;
         
-        // Simulate network scan
+        // Ask the transfer service to scan the LAN; devices stream in as they answer
         this.discoveredHosts = [];
         this.updateHostsList();
         
-        setTimeout(() => {
-            // Simulate finding some hosts
-            const mockHosts = ['192.168.0.100', '192.168.0.150', '192.168.1.101'];
-            this.discoveredHosts = mockHosts.map(ip => ({ ip }));
+        const finishScan = (message, type) => {
+            source.close();
+            this.isScanning = false;
+            scanBtn.textContent = originalText;
+            scanBtn.disabled = false;
+            this.showNotification(message, type);
+        };
+        
+        const source = new EventSource('http://localhost:8002/discover');
+        source.addEventListener('host', event => {
+            const found = JSON.parse(event.data);
+            if (this.discoveredHosts.some(host => host.ip === found.ip)) return;
             
-            if (this.discoveredHosts.length > 0) {
+            this.discoveredHosts.push({ ip: found.ip, port: found.port, device: found.device });
+            if (!this.selectedHost) {
                 this.selectedHost = this.discoveredHosts[0];
             }
-            
             this.updateHostsList();
             this.updateBulkControls();
-            
-            this.isScanning = false;
-            scanBtn.textContent = originalText;
-            scanBtn.disabled = false;
-            
-            this.showNotification(`Found ${this.discoveredHosts.length} hosts`, 'success');
-        }, 2000);
+        });
+        source.addEventListener('done', event => {
+            const summary = JSON.parse(event.data);
+            finishScan(`Found ${summary.found} hosts on ${summary.cidr} in ${summary.elapsed}s`, 'success');
+        });
+        source.onerror = () => {
+            // The service closes the stream after "done"; anything else is a failure
+            if (this.isScanning) {
+                finishScan('Network scan failed - is the transfer service running?', 'error');
+            }
+        };
     }
     
     testConnection(buttonId = null) {
@@ -1198,7 +1295,7 @@ class RomDownloaderApp {
             }
             
             hostItem.innerHTML = `
-                <div class="host-ip">${host.ip}</div>
+                <div class="host-ip">${host.ip}${host.device && host.device !== 'unknown' ? ` • ${host.device === 'muos' ? 'muOS' : 'Rocknix'}` : ''}</div>
                 <button class="host-select ${this.selectedHost?.ip === host.ip ? 'selected' : ''}">
                     ${this.selectedHost?.ip === host.ip ? 'Selected' : 'Select'}
                 </button>
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Bandwidth scheduling for the transfer service
+Token buckets cap the byte rate of all device uploads, of each device on
+its own and of archive downloads; the copy loops report every chunk and
+sleep for as long as the buckets say. Each device also gets an adaptive
+concurrency limit: while it is kept busy, its write speed is measured over
+short windows and the number of parallel uploads is raised as long as that
+buys throughput, backed off when it plateaus and halved when it drops.
+"""
+
+import itertools
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import Counter, Gauge
+
+RATE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+THROTTLED_SECONDS = Counter('romnix_bandwidth_throttled_seconds_total',
+                            "Time copy loops slept to stay under a bandwidth cap", ('direction',))
+DEVICE_CONCURRENCY = Gauge('romnix_device_upload_concurrency',
+                           "Parallel uploads currently allowed per device", ('device',))
+DEVICE_WRITE_RATE = Gauge('romnix_device_write_bytes_per_second',
+                          "Upload throughput per device over the last measuring window", ('device',))
+
+
+def parse_rate(text):
+    """Bytes per second for a rate like 0, 512K or 20M"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"not a rate: {text!r}")
+    return int(float(match.group(1)) * RATE_SUFFIXES[match.group(2).upper()])
+
+
+def device_key(host_config):
+    return host_config.get('hostIp'), int(host_config.get('port') or 22)
+
+
+class TokenBucket:
+    """Byte-rate limiter shared by any number of threads.
+
+    reserve() takes the bytes right away, going into debt if needed, and
+    returns how long the caller has to wait; later callers queue behind
+    that debt, so parallel streams share the rate fairly.
+    """
+
+    def __init__(self, rate, burst=None):
+        # Bytes per second; 0 means unlimited
+        self.rate = rate
+        self.burst = burst or max(rate // 4, 256 * 1024)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, count):
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class AdaptiveLimit:
+    """Concurrency cap for one device that follows its measured write speed.
+
+    Used as a context manager to wait for one of the device's slots, first
+    come first served, or with try_acquire()/release() by schedulers that
+    must not block; those set on_free to hear when a slot opens up. Wrap the
+    work itself in running() once any other slots it needs are held. Only windows in which every allowed slot was running
+    say anything about the device, so idle stretches never change the limit.
+    """
+
+    def __init__(self, name, initial=2, minimum=1, maximum=6, adaptive=True, window=5.0, gain=0.1, hold=3):
+        self.name = name
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.adaptive = adaptive
+        # Seconds per measurement, and the relative change that counts as better or worse
+        self.window = window
+        self.gain = gain
+        # Windows to stay put after backing off before probing upwards again
+        self.hold = hold
+        self.condition = threading.Condition()
+        self.active = 0
+        self.uploading = 0
+        self.tickets = itertools.count()
+        self.waiting = deque()
+        self.window_started = self.ticked = time.monotonic()
+        self.window_bytes = 0
+        self.busy = 0.0             # slot-seconds in use during the current window
+        self.previous_rate = None   # bytes/s of the last saturated window
+        self.last_step = 0
+        self.holding = 0
+        # Called without the lock held after a slot is released or the limit goes up
+        self.on_free = None
+        DEVICE_CONCURRENCY.set(self.limit, device=name)
+
+    def __enter__(self):
+        with self.condition:
+            ticket = next(self.tickets)
+            self.waiting.append(ticket)
+            while self.active >= self.limit or self.waiting[0] != ticket:
+                self.condition.wait()
+            self.waiting.popleft()
+            self.active += 1
+            # The next in line may fit as well
+            self.condition.notify_all()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def try_acquire(self):
+        """Take a slot if one is free right now; returns False instead of waiting"""
+        with self.condition:
+            if self.waiting or self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+        if self.on_free:
+            self.on_free()
+
+    @contextmanager
+    def running(self):
+        """Counts an upload towards the device's utilisation while it moves data"""
+        with self.condition:
+            self._tick()
+            self.uploading += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self._tick()
+                self.uploading -= 1
+
+    def record(self, count):
+        """Count uploaded bytes; closes the measuring window once it is over"""
+        with self.condition:
+            self.window_bytes += count
+            now = self._tick()
+            elapsed = now - self.window_started
+            if elapsed < self.window:
+                return
+            rate = self.window_bytes / elapsed
+            saturated = self.busy / elapsed >= self.limit - 0.5
+            self.window_started, self.window_bytes, self.busy = now, 0, 0.0
+            DEVICE_WRITE_RATE.set(round(rate), device=self.name)
+            if not self.adaptive:
+                return
+            limit = self.limit
+            self._adjust(rate, saturated)
+            raised = self.limit > limit
+        if raised and self.on_free:
+            self.on_free()
+
+    def _tick(self):
+        now = time.monotonic()
+        self.busy += self.uploading * (now - self.ticked)
+        self.ticked = now
+        return now
+
+    def _adjust(self, rate, saturated):
+        previous, last_step = self.previous_rate, self.last_step
+        self.last_step = 0
+        if not saturated:
+            # Fewer uploads than allowed: the limit isn't what's holding the device back
+            self.previous_rate = None
+            return
+        self.previous_rate = rate
+        if previous is None:
+            step = 1
+        elif rate < previous * (1 - self.gain) and last_step <= 0:
+            # Slower at the same or lower concurrency: the device is struggling
+            self._set_limit(self.limit // 2)
+            self.holding = self.hold
+            return
+        elif last_step > 0:
+            # The last slot we added has to pay for itself
+            if rate >= previous * (1 + self.gain):
+                step = 1
+            else:
+                self._set_limit(self.limit - 1)
+                self.holding = self.hold
+                return
+        elif self.holding:
+            self.holding -= 1
+            return
+        else:
+            step = 1
+        if self.limit < self.maximum:
+            self._set_limit(self.limit + step)
+            self.last_step = step
+
+    def _set_limit(self, limit):
+        limit = max(self.minimum, min(limit, self.maximum))
+        if limit != self.limit:
+            print(f"🎚️  {self.name}: {self.limit} -> {limit} parallel uploads")
+            self.limit = limit
+            DEVICE_CONCURRENCY.set(limit, device=self.name)
+            self.condition.notify_all()
+
+
+class BandwidthScheduler:
+    """Global and per-device rate caps plus per-device upload concurrency"""
+
+    def __init__(self, upload_rate=0, device_upload_rate=0, download_rate=0,
+                 device_concurrency=2, max_device_concurrency=6, adaptive=True):
+        self.uploads = TokenBucket(upload_rate)
+        self.downloads = TokenBucket(download_rate)
+        self.device_upload_rate = device_upload_rate
+        self.device_concurrency = device_concurrency
+        self.max_device_concurrency = max(device_concurrency, max_device_concurrency)
+        self.adaptive = adaptive
+        self.lock = threading.Lock()
+        self.devices = {}   # (host, port) -> (TokenBucket, AdaptiveLimit)
+
+    def _device(self, host_config):
+        key = device_key(host_config)
+        with self.lock:
+            device = self.devices.get(key)
+            if device is None:
+                name = f"{key[0]}:{key[1]}"
+                device = (TokenBucket(self.device_upload_rate),
+                          AdaptiveLimit(name, self.device_concurrency, maximum=self.max_device_concurrency,
+                                        adaptive=self.adaptive))
+                self.devices[key] = device
+            return device
+
+    def device_slot(self, host_config):
+        """The device's AdaptiveLimit: one slot per transfer in flight to it"""
+        return self._device(host_config)[1]
+
+    def upload_meter(self, host_config, on_sent):
+        """Per-chunk upload callback: calls on_sent, feeds the device's measurements and throttles"""
+        bucket, limit = self._device(host_config)
+
+        def sent(count):
+            on_sent(count)
+            limit.record(count)
+            self._wait(max(bucket.reserve(count), self.uploads.reserve(count)), 'upload')
+        return sent
+
+    def download_meter(self, on_read):
+        """Per-chunk download callback: calls on_read (if given) and throttles"""
+        def read(count):
+            if on_read:
+                on_read(count)
+            self._wait(self.downloads.reserve(count), 'download')
+        return read
+
+    def _wait(self, seconds, direction):
+        if seconds > 0:
+            THROTTLED_SECONDS.inc(seconds, direction=direction)
+            time.sleep(seconds)
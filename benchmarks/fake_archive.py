@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Synthetic ROM archive host for benchmarks
+Serves Apache-style directory listings and ROM files whose bytes are
+generated from their names, so nothing has to exist on disk. Latency and a
+per-connection bandwidth cap can be injected to imitate a distant archive.
+HEAD, Range/If-Range, ETag and Last-Modified behave like the real hosts so
+the services take the same code paths as in production.
+"""
+
+import argparse
+import email.utils
+import hashlib
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATTERN_SIZE = 64 * 1024
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+LISTING_MTIME = 1700000000
+
+
+def parse_size(text):
+    """Bytes for a size like 512, 64K or 4M"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*', text, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"not a size: {text!r}")
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2).upper()])
+
+
+class ArchiveLayout:
+    """Platforms and their ROM files: name -> size"""
+
+    def __init__(self, platforms=('nes', 'snes', 'genesis'), roms_per_platform=50, sizes=(256 * 1024,)):
+        self.platforms = {}
+        for platform in platforms:
+            files = {}
+            for index in range(roms_per_platform):
+                size = sizes[index % len(sizes)]
+                files[f"Bench Game {index:04d} ({platform.upper()}).zip"] = size
+            self.platforms[platform] = files
+
+    def roms(self, platform=None):
+        """[(platform, name, size)] for one platform or all of them"""
+        platforms = [platform] if platform else list(self.platforms)
+        return [(p, name, size) for p in platforms for name, size in self.platforms[p].items()]
+
+
+def rom_pattern(name):
+    """The repeating block a ROM's bytes are cut from"""
+    seed = hashlib.sha256(name.encode('utf-8')).digest()
+    return (seed * (PATTERN_SIZE // len(seed) + 1))[:PATTERN_SIZE]
+
+
+def rom_etag(name, size):
+    return '"' + hashlib.sha1(f"{name}:{size}".encode('utf-8')).hexdigest()[:16] + '"'
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    layout = None
+    # Seconds added before every response
+    latency = 0.0
+    # Bytes per second per connection; 0 means unlimited
+    bandwidth = 0
+    write_size = 16 * 1024
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def respond(self, head):
+        if self.latency:
+            time.sleep(self.latency)
+        parts = [urllib.parse.unquote(part) for part in urllib.parse.urlparse(self.path).path.split('/') if part]
+        if not parts or parts[0] != 'roms' or len(parts) > 3:
+            self.send_error(404)
+        elif len(parts) == 1:
+            self.send_listing(list(self.layout.platforms), {}, head)
+        elif parts[1] not in self.layout.platforms:
+            self.send_error(404)
+        elif len(parts) == 2:
+            if not self.path.endswith('/'):
+                self.send_response(301)
+                self.send_header('Location', self.path + '/')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_listing([], self.layout.platforms[parts[1]], head)
+        elif parts[2] in self.layout.platforms[parts[1]]:
+            self.send_rom(parts[2], self.layout.platforms[parts[1]][parts[2]], head)
+        else:
+            self.send_error(404)
+
+    def send_listing(self, directories, files, head):
+        date = time.strftime('%d-%b-%Y %H:%M', time.gmtime(LISTING_MTIME))
+        rows = [f'<tr><td><a href="{urllib.parse.quote(name)}/">{name}/</a></td><td>{date}</td><td>-</td></tr>'
+                for name in directories]
+        rows += [f'<tr><td><a href="{urllib.parse.quote(name)}">{name}</a></td><td>{date}</td><td>{size}</td></tr>'
+                 for name, size in files.items()]
+        body = ('<html><head><title>Index</title></head><body><table>\n'
+                '<tr><th>Name</th><th>Last modified</th><th>Size</th></tr>\n'
+                + '\n'.join(rows) + '\n</table></body></html>\n').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', email.utils.formatdate(LISTING_MTIME, usegmt=True))
+        self.end_headers()
+        if not head:
+            self.write_throttled(body)
+
+    def send_rom(self, name, size, head):
+        etag = rom_etag(name, size)
+        start, end = 0, size - 1
+        byte_range = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        partial = False
+        if byte_range and (not if_range or if_range == etag):
+            match = re.fullmatch(r'bytes=(\d+)-(\d*)', byte_range.strip())
+            if match and int(match.group(1)) < size:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                partial = True
+            elif match:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        self.send_response(206 if partial else 200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(LISTING_MTIME, usegmt=True))
+        if partial:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head:
+            return
+        pattern = rom_pattern(name)
+        position = start
+        while position <= end:
+            offset = position % PATTERN_SIZE
+            count = min(PATTERN_SIZE - offset, end - position + 1, self.write_size)
+            self.write_throttled(pattern[offset:offset + count])
+            position += count
+
+    def write_throttled(self, data):
+        if not self.bandwidth:
+            self.wfile.write(data)
+            return
+        view = memoryview(data)
+        for index in range(0, len(view), self.write_size):
+            chunk = view[index:index + self.write_size]
+            started = time.monotonic()
+            self.wfile.write(chunk)
+            pause = len(chunk) / self.bandwidth - (time.monotonic() - started)
+            if pause > 0:
+                time.sleep(pause)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeArchive:
+    """Runs the archive host on a background thread"""
+
+    def __init__(self, layout, latency=0.0, bandwidth=0, host='127.0.0.1', port=0):
+        handler = type('BoundArchiveHandler', (ArchiveHandler,),
+                       {'layout': layout, 'latency': latency, 'bandwidth': bandwidth})
+        self.layout = layout
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='fake-archive')
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/roms/"
+
+    def rom_url(self, platform, name):
+        return f"{self.base_url}{platform}/{urllib.parse.quote(name)}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_layout_arguments(parser):
+    parser.add_argument('--platforms', default='nes,snes,genesis',
+                        help="comma-separated platform directories to serve")
+    parser.add_argument('--roms-per-platform', type=int, default=50)
+    parser.add_argument('--rom-sizes', default='256K',
+                        help="comma-separated ROM sizes, cycled through each platform (e.g. 16K,1M,32M)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds of delay added to every archive response")
+    parser.add_argument('--bandwidth', type=parse_size, default=0,
+                        help="per-connection archive bandwidth cap in bytes/s, e.g. 2M (0 = unlimited)")
+
+
+def layout_from_args(args):
+    sizes = [parse_size(size) for size in args.rom_sizes.split(',') if size.strip()]
+    platforms = [name.strip() for name in args.platforms.split(',') if name.strip()]
+    return ArchiveLayout(platforms, args.roms_per_platform, sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic ROM archive host for benchmarks")
+    parser.add_argument('--port', type=int, default=9000)
+    add_layout_arguments(parser)
+    args = parser.parse_args()
+
+    archive = FakeArchive(layout_from_args(args), args.latency, args.bandwidth, port=args.port)
+    print(f"🗄️  Fake archive serving {len(archive.layout.roms())} ROMs at {archive.base_url}")
+    try:
+        archive.server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Fake archive stopped")
+
+
+if __name__ == '__main__':
+    main()
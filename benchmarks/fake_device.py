@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Local OpenSSH server standing in for a handheld
+Generates throwaway host and client keys in a temp directory and runs sshd
+as the current user on a loopback port, with the ROM tree in the same
+directory. A non-root sshd can't check passwords, so the transfer service
+reaches it with hostConfig.identityFile.
+"""
+
+import getpass
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+
+def sshd_binary():
+    """Path of sshd, or None if OpenSSH server isn't installed"""
+    return shutil.which('sshd') or next(
+        (path for path in ('/usr/sbin/sshd', '/usr/local/sbin/sshd') if os.path.exists(path)), None)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+class FakeDevice:
+    """An sshd process plus the hostConfig that reaches it"""
+
+    def __init__(self, directory=None, port=None):
+        self.directory = directory or tempfile.mkdtemp(prefix='romnix-device-')
+        self.port = port or free_port()
+        self.roms_dir = os.path.join(self.directory, 'ROMS')
+        self.client_key = os.path.join(self.directory, 'client_key')
+        self.process = None
+
+    def start(self, timeout=10):
+        sshd = sshd_binary()
+        if sshd is None:
+            raise RuntimeError("sshd not found; install openssh-server to benchmark device transfers")
+        os.makedirs(self.roms_dir, exist_ok=True)
+        host_key = os.path.join(self.directory, 'host_key')
+        for key in (host_key, self.client_key):
+            if not os.path.exists(key):
+                subprocess.run(['ssh-keygen', '-q', '-t', 'ed25519', '-N', '', '-f', key], check=True)
+        shutil.copyfile(self.client_key + '.pub', os.path.join(self.directory, 'authorized_keys'))
+        config = os.path.join(self.directory, 'sshd_config')
+        with open(config, 'w', encoding='utf-8') as f:
+            f.write('\n'.join([
+                f"Port {self.port}",
+                "ListenAddress 127.0.0.1",
+                f"HostKey {host_key}",
+                f"PidFile {os.path.join(self.directory, 'sshd.pid')}",
+                f"AuthorizedKeysFile {os.path.join(self.directory, 'authorized_keys')}",
+                "PubkeyAuthentication yes",
+                "PasswordAuthentication no",
+                "KbdInteractiveAuthentication no",
+                "UsePAM no",
+                "StrictModes no",
+                # The transfer service multiplexes every upload over one connection
+                "MaxSessions 256",
+                "MaxStartups 256",
+                "LogLevel ERROR",
+            ]) + '\n')
+        # sshd insists on being started by absolute path
+        self.process = subprocess.Popen([os.path.abspath(sshd), '-D', '-e', '-f', config],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"sshd exited: {self.process.stderr.read().decode(errors='replace').strip()}")
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError(f"sshd didn't start listening on port {self.port}")
+
+    def host_config(self):
+        return {
+            'hostIp': '127.0.0.1',
+            'port': self.port,
+            'username': getpass.getuser(),
+            'identityFile': self.client_key,
+            'remoteBasePath': self.roms_dir,
+        }
+
+    def clear(self):
+        """Delete every uploaded ROM so the next run starts from an empty device"""
+        shutil.rmtree(self.roms_dir, ignore_errors=True)
+        os.makedirs(self.roms_dir, exist_ok=True)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the CORS proxy and the transfer service
+Starts the synthetic archive host, a local sshd standing in for a device,
+and both services as separate processes with a throwaway HOME (so caches
+start empty), then drives each scenario and prints a JSON report:
+throughput, p50/p99 latency, peak RSS of every service and the number of
+ssh processes the transfer service spawned. Run it twice on the same box
+and diff the reports to compare changes.
+
+Scenarios:
+  proxy-listing-cold   platform listings through the proxy, nothing cached
+  proxy-listing-warm   the same listings again, from the response cache
+  proxy-rom            ROM downloads through the proxy
+  check-file           POST /check-file for present and missing files
+  transfer-stream      POST / - download from the archive, upload to the device
+  transfer-cached      POST / for the same ROMs, served from the ROM cache
+  transfer-local       POST /transfer with files already on local disk
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fake_archive import FakeArchive, add_layout_arguments, layout_from_args, rom_pattern, PATTERN_SIZE
+from fake_device import FakeDevice, sshd_binary, free_port
+from start_services import wait_for_port
+
+DEVICE_SCENARIOS = ('transfer-stream', 'transfer-cached', 'transfer-local')
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def ssh_process_count(metrics_text):
+    """Total of romnix_ssh_processes_total in a /metrics page"""
+    return sum(int(float(line.rsplit(' ', 1)[1])) for line in metrics_text.splitlines()
+               if line.startswith('romnix_ssh_processes_total'))
+
+
+def write_rom(path, name, size):
+    """Write the same bytes the fake archive serves for name"""
+    pattern = rom_pattern(name)
+    with open(path, 'wb') as f:
+        for offset in range(0, size, PATTERN_SIZE):
+            f.write(pattern[:min(PATTERN_SIZE, size - offset)])
+
+
+class Service:
+    """One of the services, started as its own process"""
+
+    def __init__(self, name, script, args, env, log_dir):
+        self.name = name
+        self.script = script
+        self.port = free_port()
+        self.args = args
+        self.env = env
+        self.log_path = os.path.join(log_dir, f"{name}.log")
+        self.process = None
+
+    @property
+    def url(self):
+        return f"http://localhost:{self.port}/"
+
+    def start(self):
+        log = open(self.log_path, 'w')
+        self.process = subprocess.Popen([sys.executable, self.script, '--port', str(self.port), *self.args],
+                                        cwd=REPO_DIR, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+        if not wait_for_port(self.port, self.process, timeout=30):
+            raise RuntimeError(f"{self.name} didn't start, see {self.log_path}")
+        return self
+
+    def peak_rss_kb(self):
+        """High-water mark of the process's resident memory (Linux only)"""
+        try:
+            with open(f"/proc/{self.process.pid}/status", encoding='ascii') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    def metrics(self):
+        with urllib.request.urlopen(self.url + 'metrics', timeout=10) as response:
+            return response.read().decode('utf-8')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def send(request, timeout):
+    """Perform one request; returns (seconds, response bytes, error or None)"""
+    method, url, body = request
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    started = time.perf_counter()
+    try:
+        http_request = urllib.request.Request(url, data=data, method=method,
+                                              headers={'Content-Type': 'application/json'} if data else {})
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            received = 0
+            while True:
+                chunk = response.read(256 * 1024)
+                if not chunk:
+                    break
+                received += len(chunk)
+        error = None
+    except urllib.error.HTTPError as e:
+        received, error = 0, f"HTTP {e.code}"
+    except (OSError, urllib.error.URLError) as e:
+        received, error = 0, str(e)
+    return time.perf_counter() - started, received, error
+
+
+def run_scenario(requests, concurrency, timeout, payload_bytes=None):
+    """Run requests on a thread pool; payload_bytes counts what was moved (default: response bytes)"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda request: send(request, timeout), requests))
+    elapsed = time.perf_counter() - started
+    latencies = [seconds for seconds, _, error in results if error is None]
+    errors = [error for _, _, error in results if error is not None]
+    moved = payload_bytes if payload_bytes is not None else sum(received for _, received, _ in results)
+    return {
+        'requests': len(requests),
+        'errors': len(errors),
+        'firstError': errors[0] if errors else None,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 4),
+        'requestsPerSecond': round(len(requests) / elapsed, 2) if elapsed else None,
+        'bytes': moved,
+        'mbPerSecond': round(moved / elapsed / 1024 ** 2, 3) if elapsed else None,
+        'latencyMs': {
+            'p50': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p99': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            'max': round(max(latencies) * 1000, 2) if latencies else None,
+        },
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the ROM Downloader proxy and transfer service")
+    add_layout_arguments(parser)
+    parser.add_argument('--requests', type=int, default=60,
+                        help="ROMs per scenario (capped at the number of ROMs served)")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="requests in flight at once")
+    parser.add_argument('--timeout', type=float, default=300,
+                        help="seconds before a single request counts as failed")
+    parser.add_argument('--scenarios',
+                        help="comma-separated subset of scenarios to run (default: all)")
+    parser.add_argument('--device-config', metavar='FILE',
+                        help="JSON hostConfig of an existing device to use instead of a local sshd")
+    parser.add_argument('--no-device', action='store_true',
+                        help="skip the scenarios that upload to a device")
+    parser.add_argument('--proxy-arg', action='append', default=[], metavar='ARG',
+                        help="extra argument for proxy_server.py (repeatable), e.g. --proxy-arg=--buffered")
+    parser.add_argument('--transfer-arg', action='append', default=[], metavar='ARG',
+                        help="extra argument for transfer_service.py (repeatable), e.g. --transfer-arg=--staged")
+    parser.add_argument('--label', help="free-form label stored in the report")
+    parser.add_argument('--keep', action='store_true',
+                        help="keep the temporary HOME with service logs and caches")
+    parser.add_argument('--output', metavar='FILE', help="write the JSON report here instead of stdout")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    wanted = set(args.scenarios.split(',')) if args.scenarios else None
+    home = tempfile.mkdtemp(prefix='romnix-bench-')
+    downloads = os.path.join(home, 'Downloads')
+    os.makedirs(downloads)
+    env = dict(os.environ, HOME=home, PYTHONUNBUFFERED='1')
+
+    report = {
+        'label': args.label,
+        'startedAt': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                 'cpus': os.cpu_count()},
+        'commit': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                 capture_output=True, text=True).stdout.strip() or None,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'label')},
+        'scenarios': {},
+        'skipped': {},
+    }
+
+    layout = layout_from_args(args)
+    archive = FakeArchive(layout, args.latency, args.bandwidth).start()
+    roms = layout.roms()[:args.requests]
+    services, device = [], None
+    try:
+        host_config, device_error = None, None
+        if args.no_device:
+            device_error = "--no-device"
+        elif args.device_config:
+            with open(args.device_config, encoding='utf-8') as f:
+                host_config = json.load(f)
+        elif sshd_binary() is None:
+            device_error = "sshd not found; install openssh-server or pass --device-config"
+        else:
+            device = FakeDevice().start()
+            host_config = device.host_config()
+
+        proxy = Service('proxy', 'proxy_server.py', args.proxy_arg, env, home).start()
+        transfer = Service('transfer', 'transfer_service.py', args.transfer_arg, env, home).start()
+        services = [proxy, transfer]
+
+        def proxied(url):
+            return ('GET', f"{proxy.url}?url={urllib.parse.quote(url, safe='')}", None)
+
+        def transfer_body(platform_name, name, **extra):
+            return {'romName': name, 'platform': platform_name, 'hostConfig': host_config,
+                    'skipExisting': False, **extra}
+
+        listings = [proxied(f"{archive.base_url}{name}/") for name in layout.platforms]
+        local_roms = []
+        for platform_name, name, size in roms:
+            path = os.path.join(downloads, name)
+            write_rom(path, name, size)
+            local_roms.append((platform_name, name, size, path))
+        total_size = sum(size for _, _, size in roms)
+
+        scenarios = [
+            ('proxy-listing-cold', listings, None),
+            ('proxy-listing-warm', listings * 10, None),
+            ('proxy-rom', [proxied(archive.rom_url(p, name)) for p, name, _ in roms], None),
+            ('check-file', [('POST', transfer.url + 'check-file', {'fileName': name if index % 2 else 'missing.zip'})
+                            for index, (_, name, _) in enumerate(roms)], None),
+            ('transfer-stream', [('POST', transfer.url, transfer_body(p, name, romUrl=archive.rom_url(p, name)))
+                                 for p, name, _ in roms], total_size),
+            ('transfer-cached', [('POST', transfer.url, transfer_body(p, name, romUrl=archive.rom_url(p, name)))
+                                 for p, name, _ in roms], total_size),
+            ('transfer-local', [('POST', transfer.url + 'transfer', transfer_body(p, name, localFilePath=path))
+                                for p, name, _, path in local_roms], total_size),
+        ]
+        for name, requests, payload_bytes in scenarios:
+            if wanted is not None and name not in wanted:
+                continue
+            if name in DEVICE_SCENARIOS and host_config is None:
+                report['skipped'][name] = device_error
+                continue
+            if device and name in DEVICE_SCENARIOS:
+                device.clear()
+            spawned = ssh_process_count(transfer.metrics())
+            print(f"⏱️  {name}: {len(requests)} requests...", file=sys.stderr)
+            result = run_scenario(requests, args.concurrency, args.timeout, payload_bytes)
+            result['sshProcesses'] = ssh_process_count(transfer.metrics()) - spawned
+            report['scenarios'][name] = result
+            print(f"   {result['requestsPerSecond']} req/s, {result['mbPerSecond']} MB/s, "
+                  f"p50 {result['latencyMs']['p50']} ms, p99 {result['latencyMs']['p99']} ms, "
+                  f"{result['errors']} errors", file=sys.stderr)
+
+        report['processes'] = {service.name: {'peakRssKb': service.peak_rss_kb()} for service in services}
+        report['sshProcessesTotal'] = ssh_process_count(transfer.metrics())
+    finally:
+        for service in services:
+            service.stop()
+        if device:
+            device.stop()
+        archive.stop()
+        if args.keep:
+            print(f"📁 Logs and caches kept in {home}", file=sys.stderr)
+        else:
+            shutil.rmtree(home, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
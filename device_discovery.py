@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+LAN discovery of muOS/Rocknix handhelds
+Every address in a CIDR is probed for an open SSH port with asyncio
+connects, hundreds at a time with short timeouts, so a /24 takes about as
+long as the slowest timeout rather than 254 of them. The SSH banner tells
+the firmware apart: muOS ships Dropbear, Rocknix ships OpenSSH. Results,
+including closed addresses, are cached so a repeat scan only re-probes
+addresses whose entry has gone stale.
+"""
+
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+
+# Larger networks than this are refused rather than scanned for minutes
+MAX_SCAN_ADDRESSES = 4096
+
+BANNER_DEVICES = (
+    ('dropbear', 'muos'),
+    ('openssh', 'rocknix'),
+)
+
+
+def classify_banner(banner):
+    """Device type guessed from an SSH identification string"""
+    lowered = banner.lower()
+    for marker, device in BANNER_DEVICES:
+        if marker in lowered:
+            return device
+    return 'unknown'
+
+
+def local_network(prefix=24):
+    """CIDR of the network this machine reaches the LAN through"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        # Connecting a UDP socket picks the outgoing interface without sending anything
+        probe.connect(('192.0.2.1', 9))
+        address = probe.getsockname()[0]
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+class DeviceDiscovery:
+    """Scans networks for SSH servers, caching what each address answered"""
+
+    def __init__(self, ttl=300, concurrency=256, connect_timeout=0.6, banner_timeout=1.0):
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.connect_timeout = connect_timeout
+        self.banner_timeout = banner_timeout
+        self.lock = threading.Lock()
+        # (ip, port) -> (host dict or None if nothing answered, probed_at)
+        self.cache = {}
+
+    def addresses(self, cidr):
+        network = ipaddress.ip_network(cidr, strict=False)
+        if network.num_addresses > MAX_SCAN_ADDRESSES:
+            raise ValueError(f"{cidr} has {network.num_addresses} addresses; scan at most {MAX_SCAN_ADDRESSES}")
+        hosts = list(network.hosts())
+        return [str(address) for address in hosts or [network.network_address]]
+
+    def scan(self, cidr, port=22, on_found=None, refresh=False):
+        """Probe every address in cidr; returns the hosts with SSH open.
+
+        on_found is called with each host as soon as it is known, cached
+        hosts first. Blocks the calling thread, which runs its own event
+        loop.
+        """
+        addresses = self.addresses(cidr)
+        now = time.time()
+        found, stale = [], []
+        with self.lock:
+            for ip in addresses:
+                host, probed_at = self.cache.get((ip, port), (None, 0))
+                if refresh or now - probed_at >= self.ttl:
+                    stale.append(ip)
+                elif host:
+                    found.append(dict(host, cached=True))
+        for host in found:
+            if on_found:
+                on_found(host)
+
+        if stale:
+            found.extend(asyncio.run(self._probe_all(stale, port, on_found)))
+        return found
+
+    async def _probe_all(self, addresses, port, on_found):
+        slots = asyncio.Semaphore(self.concurrency)
+        found = []
+
+        async def probe(ip):
+            async with slots:
+                host = await self._probe(ip, port)
+            with self.lock:
+                self.cache[(ip, port)] = (host, time.time())
+            if host:
+                found.append(host)
+                if on_found:
+                    on_found(dict(host, cached=False))
+
+        await asyncio.gather(*(probe(ip) for ip in addresses))
+        return found
+
+    async def _probe(self, ip, port):
+        """Host dict if ip accepts connections on port, else None"""
+        started = time.monotonic()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), self.connect_timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        latency = time.monotonic() - started
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.banner_timeout)
+            banner = line.decode('utf-8', errors='replace').strip()
+        except (OSError, asyncio.TimeoutError):
+            banner = ''
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        return {
+            'ip': ip,
+            'port': port,
+            'banner': banner,
+            'device': classify_banner(banner) if banner.startswith('SSH-') else 'unknown',
+            'latencyMs': round(latency * 1000, 1),
+        }
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Cached inventory of ROM directories on devices
+Lists a remote directory (names, sizes, mtimes) with a single SSH command
+and keeps the result per device, so a re-sync only has to upload files
+that are missing or differ. Remote MD5s are computed on demand and cached
+until the file's size or mtime changes.
+"""
+
+import shlex
+import threading
+import time
+
+from device_ssh import SSHSessionPool
+
+# One stat for every file in the directory; '/' can't appear in a file name
+LIST_COMMAND = "cd {dir} 2>/dev/null || exit 0; stat -c '%s/%Y/%F/%n' -- * 2>/dev/null; exit 0"
+
+
+def parse_listing(output):
+    """Map file name -> {size, mtime} from LIST_COMMAND output"""
+    files = {}
+    for line in output.splitlines():
+        parts = line.split('/', 3)
+        if len(parts) != 4 or not parts[2].startswith('regular'):
+            continue
+        size, mtime, _, name = parts
+        if size.isdigit():
+            files[name] = {'size': int(size), 'mtime': int(mtime) if mtime.isdigit() else None, 'md5': None}
+    return files
+
+
+class DeviceInventory:
+    """Per-device cache of remote directory listings"""
+
+    def __init__(self, ssh_pool, ttl=600):
+        self.ssh_pool = ssh_pool
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.listings = {}      # (device key, remote dir) -> {'listed_at', 'files'}
+        self.list_locks = {}
+
+    def _key(self, host_config, remote_dir):
+        return SSHSessionPool.key_for(host_config), remote_dir.rstrip('/')
+
+    def files(self, host_config, remote_dir, refresh=False):
+        """Files in remote_dir, listing the device only if the cache is stale"""
+        key = self._key(host_config, remote_dir)
+        with self.lock:
+            list_lock = self.list_locks.setdefault(key, threading.Lock())
+
+        # Parallel transfers into the same directory share one listing
+        with list_lock:
+            with self.lock:
+                listing = self.listings.get(key)
+            if listing and not refresh and time.monotonic() - listing['listed_at'] < self.ttl:
+                return listing['files']
+
+            with self.ssh_pool.session(host_config) as session:
+                result = session.run(LIST_COMMAND.format(dir=shlex.quote(key[1])))
+            if result.returncode != 0:
+                raise OSError(result.stderr.strip() or f"listing {key[1]} failed")
+            files = parse_listing(result.stdout)
+
+            if listing:
+                # Keep checksums of files that haven't changed since last time
+                for name, entry in files.items():
+                    old = listing['files'].get(name)
+                    if old and (old['size'], old['mtime']) == (entry['size'], entry['mtime']):
+                        entry['md5'] = old['md5']
+            with self.lock:
+                self.listings[key] = {'listed_at': time.monotonic(), 'files': files}
+            print(f"📋 Listed {len(files)} files in {key[0][0]}:{key[1]}")
+            return files
+
+    def lookup(self, host_config, remote_dir, name):
+        return self.files(host_config, remote_dir).get(name)
+
+    def remote_md5(self, host_config, remote_dir, name):
+        """MD5 of a remote file, cached alongside its listing entry"""
+        entry = self.lookup(host_config, remote_dir, name)
+        if entry is None:
+            return None
+        if entry['md5'] is None:
+            path = f"{remote_dir.rstrip('/')}/{name}"
+            with self.ssh_pool.session(host_config) as session:
+                result = session.run(f"md5sum -- {shlex.quote(path)}", timeout=300)
+            if result.returncode != 0 or not result.stdout:
+                return None
+            entry['md5'] = result.stdout.split()[0].lower()
+        return entry['md5']
+
+    def record(self, host_config, remote_dir, name, size, md5=None):
+        """Note a file we just uploaded so the next sync sees it without relisting"""
+        key = self._key(host_config, remote_dir)
+        with self.lock:
+            listing = self.listings.get(key)
+            if listing is not None:
+                listing['files'][name] = {'size': size, 'mtime': None, 'md5': md5}
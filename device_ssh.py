@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Persistent SSH sessions to muOS/Rocknix devices
+Each (host, port, user) gets one authenticated OpenSSH ControlMaster
+connection that later commands are multiplexed over, so bulk transfers pay
+the TCP connect, key exchange and password auth once instead of per file.
+Idle sessions are closed after a timeout and dead ones are reopened.
+
+The password that worked for a device is remembered for a while, so a
+reconnect tries it first instead of walking the alternatives again, and a
+failed connect is remembered briefly so the rest of a batch fails at once
+instead of probing the device per ROM.
+
+A hostConfig with identityFile logs in with that private key instead of a
+password; sshpass isn't needed then.
+"""
+
+import hashlib
+import shlex
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import Counter, Histogram
+
+ALT_PASSWORDS = ['root', '', 'admin']
+
+COMMON_SSH_OPTIONS = [
+    '-o', 'StrictHostKeyChecking=no',
+    '-o', 'UserKnownHostsFile=/dev/null',
+    '-o', 'LogLevel=ERROR',
+]
+
+# sshpass exits with 5 when the password was rejected
+SSHPASS_BAD_PASSWORD = 5
+
+# ssh error text meaning the device itself can't be reached
+# "Connection closed" is left out: sshd also says that when MaxStartups or a
+# preauth failure turns a connection away, and another password may still work
+UNREACHABLE_ERRORS = (
+    'connection refused', 'no route to host', 'network is unreachable', 'host is down',
+    'timed out', 'could not resolve hostname', 'name or service not known',
+)
+
+
+SSH_CONNECT_SECONDS = Histogram('romnix_ssh_connect_seconds',
+                                "Time to open an authenticated device session, password retries included",
+                                ('result',))
+SSH_PROCESSES = Counter('romnix_ssh_processes_total', "ssh/sshpass processes started, by purpose",
+                        ('kind',))
+
+
+class SSHConnectError(Exception):
+    """Raised when no authenticated session to a device could be opened"""
+
+
+class SSHUnreachableError(SSHConnectError):
+    """The device didn't answer at all, so other passwords are not worth trying"""
+
+
+def classify_ssh_failure(returncode, stderr):
+    """'auth', 'unreachable' or 'other' for a failed ssh/sshpass run"""
+    message = stderr.lower()
+    if returncode == SSHPASS_BAD_PASSWORD or 'permission denied' in message:
+        return 'auth'
+    if any(text in message for text in UNREACHABLE_ERRORS):
+        return 'unreachable'
+    return 'other'
+
+
+class DeviceSession:
+    """One authenticated ControlMaster connection to a device"""
+
+    def __init__(self, key, control_path, connect_timeout=10, identity_file=None):
+        self.host, self.port, self.username = key
+        self.key = key
+        self.control_path = control_path
+        self.connect_timeout = connect_timeout
+        # Private key to log in with; None means password auth through sshpass
+        self.identity_file = identity_file
+        self.master = None
+        self.password = None
+        self.last_used = time.monotonic()
+        self.last_checked = 0
+        self.active = 0
+
+    @property
+    def target(self):
+        return f"{self.username}@{self.host}"
+
+    def open(self, passwords):
+        """Start the master connection, trying each password in turn.
+
+        Only a rejected password moves on to the next candidate; if the
+        device can't be reached, SSHUnreachableError is raised right away.
+        """
+        errors = []
+        for password in passwords:
+            if password != passwords[0]:
+                print(f"🔄 Trying alternative password: '{password}'")
+            error, kind = self._start_master(password)
+            if error is None:
+                self.password = password
+                self.last_checked = time.monotonic()
+                return
+            credential = f"key {self.identity_file}" if self.identity_file else f"password '{password}'"
+            print(f"❌ SSH failed with {credential}: {error}")
+            if kind == 'unreachable':
+                raise SSHUnreachableError(f"Could not reach {self.target}: {error}")
+            errors.append(f"{credential}: {error}")
+        raise SSHConnectError(f"Could not connect to {self.target}: " + '; '.join(errors))
+
+    def _start_master(self, password):
+        if self.identity_file:
+            auth = ['ssh', '-i', self.identity_file, '-o', 'IdentitiesOnly=yes', '-o', 'BatchMode=yes']
+        else:
+            # A wrong password fails on the first prompt instead of three
+            auth = ['sshpass', '-p', password, 'ssh', '-o', 'NumberOfPasswordPrompts=1']
+        command = [
+            *auth, *COMMON_SSH_OPTIONS,
+            '-o', f'ConnectTimeout={self.connect_timeout}',
+            '-o', 'ServerAliveInterval=15',
+            '-o', 'ControlMaster=yes',
+            '-o', f'ControlPath={self.control_path}',
+            '-o', 'ControlPersist=no',
+            '-p', str(self.port),
+            '-N', self.target
+        ]
+        SSH_PROCESSES.inc(kind='master')
+        self.master = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + self.connect_timeout + 5
+        while time.monotonic() < deadline:
+            if self.master.poll() is not None:
+                stderr = self.master.stderr.read().decode('utf-8', errors='replace').strip()
+                error = stderr or f"ssh exited with status {self.master.returncode}"
+                return error, classify_ssh_failure(self.master.returncode, stderr)
+            if self.check():
+                return None, None
+            time.sleep(0.1)
+        self.close()
+        return "timed out waiting for the SSH connection", 'unreachable'
+
+    def check(self):
+        """True if the master connection is up and accepting sessions"""
+        if self.master is None or self.master.poll() is not None:
+            return False
+        SSH_PROCESSES.inc(kind='check')
+        result = subprocess.run(['ssh', '-o', f'ControlPath={self.control_path}', '-O', 'check', self.target],
+                                capture_output=True)
+        return result.returncode == 0
+
+    def command(self, remote_cmd):
+        """ssh argv for running remote_cmd over the shared connection"""
+        return [
+            'ssh', *COMMON_SSH_OPTIONS,
+            '-o', 'BatchMode=yes',
+            '-o', 'ControlMaster=no',
+            '-o', f'ControlPath={self.control_path}',
+            '-p', str(self.port),
+            self.target,
+            remote_cmd
+        ]
+
+    def run(self, remote_cmd, timeout=60, input=None):
+        self.last_used = time.monotonic()
+        SSH_PROCESSES.inc(kind='command')
+        return subprocess.run(self.command(remote_cmd), capture_output=True, text=True, timeout=timeout,
+                              input=input)
+
+    def popen(self, remote_cmd, **kwargs):
+        self.last_used = time.monotonic()
+        SSH_PROCESSES.inc(kind='command')
+        return subprocess.Popen(self.command(remote_cmd), **kwargs)
+
+    def remote_size(self, path):
+        """Size of a remote file in bytes, or None if it doesn't exist"""
+        result = self.run(f"stat -c %s -- {shlex.quote(path)} 2>/dev/null")
+        output = result.stdout.strip()
+        return int(output) if result.returncode == 0 and output.isdigit() else None
+
+    def upload_stream(self, source, remote_dir, name, chunk_size=256 * 1024, on_sent=None,
+                      offset=0, expected_size=None, md5=None):
+        """Copy a readable binary stream to remote_dir/name.
+
+        Data is written to a .part file which is only renamed into place by
+        a second command once the whole stream was sent, so an aborted
+        upload never leaves a truncated ROM behind. With offset > 0 the
+        stream is appended to an existing .part file of that size instead.
+        Before the rename the .part file is checked against expected_size
+        and md5 (when given) and deleted if it doesn't match. on_sent, if
+        given, is called with the size of each chunk written. Returns
+        (success, bytes_sent, error_message).
+        """
+        final_path = f"{remote_dir}/{name}"
+        part_path = f"{final_path}.part"
+        redirect = '>>' if offset else '>'
+        remote_cmd = f"mkdir -p {shlex.quote(remote_dir)} && cat {redirect} {shlex.quote(part_path)}"
+
+        process = self.popen(remote_cmd, stdin=subprocess.PIPE,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        sent = 0
+        try:
+            buffer = bytearray(chunk_size)
+            view = memoryview(buffer)
+            while True:
+                count = source.readinto(buffer)
+                if not count:
+                    break
+                process.stdin.write(view[:count])
+                sent += count
+                if on_sent:
+                    on_sent(count)
+        except BrokenPipeError:
+            pass  # The remote side failed; its stderr says why
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        stderr = process.stderr.read().decode('utf-8', errors='replace').strip()
+        process.wait()
+        if process.returncode != 0:
+            return False, sent, stderr or f"remote write exited with status {process.returncode}"
+        if expected_size is not None and offset + sent < expected_size:
+            # Source ended early; keep the .part file so the caller can resume it
+            return False, sent, f"stream ended after {offset + sent} of {expected_size} bytes"
+
+        result = self.run(self._finish_command(part_path, final_path, expected_size, md5), timeout=600)
+        if result.returncode != 0:
+            return False, sent, result.stderr.strip() or "remote rename failed"
+        return True, sent, None
+
+    def _finish_command(self, part_path, final_path, expected_size, md5):
+        """Shell script that verifies the .part file and renames it into place"""
+        part = shlex.quote(part_path)
+        lines = []
+        if expected_size is not None:
+            lines.append(f'size=$(stat -c %s -- {part}); [ "$size" = {int(expected_size)} ] || '
+                         f'{{ rm -f {part}; echo "size mismatch: got $size of {int(expected_size)} bytes" >&2; exit 3; }}')
+        if md5:
+            lines.append(f'set -- $(md5sum < {part}); [ "$1" = {shlex.quote(md5.lower())} ] || '
+                         f'{{ rm -f {part}; echo "checksum mismatch after upload" >&2; exit 3; }}')
+        lines.append(f"mv -f {part} {shlex.quote(final_path)}")
+        return '\n'.join(lines)
+
+    def upload_tar(self, members, base_dir, chunk_size=256 * 1024):
+        """Copy many files to the device as a single tar stream.
+
+        members is a list of (relative_path, source, size, md5) with
+        relative_path under base_dir and md5 optional. The tar is generated
+        on the fly and unpacked by one remote `tar`, so a batch costs one
+        SSH channel instead of one per file. Like upload_stream, every file
+        arrives as a .part file and a second command renames those whose
+        size (and md5) match. Returns an error message, or None on success,
+        for each member in order.
+        """
+        remote_cmd = f"mkdir -p {shlex.quote(base_dir)} && tar -xf - -C {shlex.quote(base_dir)}"
+        process = self.popen(remote_cmd, stdin=subprocess.PIPE,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stream_error = None
+        try:
+            archive = tarfile.open(fileobj=process.stdin, mode='w|', bufsize=chunk_size,
+                                   format=tarfile.GNU_FORMAT)
+            for relative_path, source, size, _ in members:
+                info = tarfile.TarInfo(f"{relative_path}.part")
+                info.size = size
+                info.mode = 0o644
+                info.mtime = time.time()
+                archive.addfile(info, source)
+            archive.close()
+        except BrokenPipeError:
+            pass  # The remote side failed; its stderr says why
+        except OSError as e:
+            # A source ended early; members already sent are still checked below
+            stream_error = str(e)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        stderr = process.stderr.read().decode('utf-8', errors='replace').strip()
+        process.wait()
+        if process.returncode != 0:
+            stream_error = stream_error or stderr or f"remote tar exited with status {process.returncode}"
+
+        result = self.run('sh -s', timeout=600, input=self._finish_batch_script(members, base_dir))
+        errors = [stream_error or result.stderr.strip() or "not unpacked on the device"] * len(members)
+        for line in result.stdout.splitlines():
+            index, _, message = line.partition(' ')
+            if index.isdigit() and int(index) < len(members):
+                errors[int(index)] = None if message == 'ok' else message
+        return errors
+
+    def _finish_batch_script(self, members, base_dir):
+        """Shell script that verifies each unpacked .part file and renames it into place"""
+        lines = [
+            f"cd {shlex.quote(base_dir)} || exit 1",
+            'finish() {',
+            '  size=$(stat -c %s -- "$2.part" 2>/dev/null)',
+            '  if [ "$size" != "$3" ]; then rm -f -- "$2.part"; '
+            'echo "$1 size mismatch: got ${size:-0} of $3 bytes"; return; fi',
+            '  if [ -n "$4" ]; then sum=$(md5sum < "$2.part"); if [ "${sum%% *}" != "$4" ]; then '
+            'rm -f -- "$2.part"; echo "$1 checksum mismatch after upload"; return; fi; fi',
+            '  mv -f -- "$2.part" "$2" && echo "$1 ok" || echo "$1 rename failed"',
+            '}',
+        ]
+        for index, (relative_path, _, size, md5) in enumerate(members):
+            lines.append(f"finish {index} {shlex.quote(relative_path)} {int(size)} "
+                         f"{shlex.quote((md5 or '').lower())}")
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        if self.master is None:
+            return
+        if self.master.poll() is None:
+            SSH_PROCESSES.inc(kind='exit')
+            subprocess.run(['ssh', '-o', f'ControlPath={self.control_path}', '-O', 'exit', self.target],
+                           capture_output=True)
+            try:
+                self.master.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.master.kill()
+                self.master.wait()
+        self.master = None
+
+
+class SSHSessionPool:
+    """Authenticated device sessions keyed by (host, port, user)"""
+
+    def __init__(self, idle_timeout=300, health_check_interval=30, connect_timeout=10,
+                 auth_ttl=3600, failure_ttl=30):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self.auth_ttl = auth_ttl
+        self.failure_ttl = failure_ttl
+        # (host, port, user) -> (password, expires_at) of the password that last worked
+        self.credentials = {}
+        # (host, port, user, configured password) -> (error, expires_at) of the last failed connect
+        self.failures = {}
+        self.control_dir = tempfile.mkdtemp(prefix='romnix-ssh-')
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.open_locks = {}
+        self.reaper = threading.Thread(target=self._reap, daemon=True, name='ssh-session-reaper')
+        self.reaper.start()
+
+    @staticmethod
+    def key_for(host_config):
+        return (host_config.get('hostIp'), int(host_config.get('port') or 22),
+                host_config.get('username', 'root'))
+
+    @contextmanager
+    def session(self, host_config):
+        """Borrow a live session for a device, opening one if needed"""
+        session = self._get(host_config)
+        try:
+            yield session
+        finally:
+            with self.lock:
+                session.active -= 1
+            session.last_used = time.monotonic()
+
+    def _get(self, host_config):
+        """A live session with one use counted in session.active; the caller gives it back"""
+        key = self.key_for(host_config)
+        with self.lock:
+            open_lock = self.open_locks.setdefault(key, threading.Lock())
+
+        # Only one thread opens (and probes passwords for) a given device
+        with open_lock:
+            with self.lock:
+                session = self.sessions.get(key)
+                # Counted before the lock is let go, so the reaper can't close it under us
+                if session is not None:
+                    session.active += 1
+            if session is not None and self._healthy(session):
+                return session
+            if session is not None:
+                with self.lock:
+                    session.active -= 1
+                print(f"♻️  SSH session to {session.target} went away, reconnecting")
+                session.close()
+
+            identity_file = host_config.get('identityFile')
+            password = host_config.get('password', 'muos')
+            failure_key = key + (identity_file or password,)
+            with self.lock:
+                error, expires_at = self.failures.get(failure_key, (None, 0))
+            if error is not None and expires_at > time.monotonic():
+                # Threads that queued behind a failed connect fail with it
+                raise type(error)(f"{error} (not retrying for {expires_at - time.monotonic():.0f}s)")
+
+            digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:12]
+            session = DeviceSession(key, f"{self.control_dir}/{digest}", self.connect_timeout, identity_file)
+            started = time.monotonic()
+            try:
+                session.open([None] if identity_file else self._candidates(key, password))
+            except SSHConnectError as e:
+                result = 'unreachable' if isinstance(e, SSHUnreachableError) else 'failed'
+                SSH_CONNECT_SECONDS.observe(time.monotonic() - started, result=result)
+                with self.lock:
+                    self.failures[failure_key] = (e, time.monotonic() + self.failure_ttl)
+                raise
+            SSH_CONNECT_SECONDS.observe(time.monotonic() - started, result='ok')
+            print(f"🔐 SSH session to {session.target} ready in {time.monotonic() - started:.2f}s")
+            with self.lock:
+                self.sessions[key] = session
+                session.active += 1
+                if not identity_file:
+                    self.credentials[key] = (session.password, time.monotonic() + self.auth_ttl)
+                self.failures.pop(failure_key, None)
+            return session
+
+    def _candidates(self, key, password):
+        """Passwords to try: the one that last worked, the configured one, then the defaults"""
+        with self.lock:
+            cached, expires_at = self.credentials.get(key, (None, 0))
+        candidates = [cached] if cached is not None and expires_at > time.monotonic() else []
+        for candidate in [password] + ALT_PASSWORDS:
+            if candidate not in candidates:
+                candidates.append(candidate)
+        return candidates
+
+    def _healthy(self, session):
+        if session.master is None or session.master.poll() is not None:
+            return False
+        if time.monotonic() - session.last_checked < self.health_check_interval:
+            return True
+        alive = session.check()
+        session.last_checked = time.monotonic()
+        return alive
+
+    def _reap(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 30))
+            now = time.monotonic()
+            with self.lock:
+                idle = [s for s in self.sessions.values()
+                        if s.active == 0 and now - s.last_used > self.idle_timeout]
+                for session in idle:
+                    del self.sessions[session.key]
+            for session in idle:
+                print(f"💤 Closing idle SSH session to {session.target}")
+                session.close()
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+        shutil.rmtree(self.control_dir, ignore_errors=True)
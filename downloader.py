@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Resumable ROM downloads
+Downloads go to a .part file in a staging directory next to a small JSON
+sidecar holding the upstream validator (strong ETag or Last-Modified). If a
+transfer drops, the next attempt - or the next request for the same URL -
+continues from the bytes already on disk with Range + If-Range, and starts
+over only if the file changed upstream.
+
+Large files from hosts that support ranges are split into segments that
+are fetched over parallel connections and written into a preallocated
+file with positional writes; per-segment progress lives in the sidecar so
+segmented downloads resume too.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+DEFAULT_DOWNLOAD_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'romnix', 'downloads')
+
+# Staged files nobody came back for are removed after this long
+STALE_DOWNLOAD_AGE = 24 * 3600
+
+
+def resume_validator(headers):
+    """Validator usable in If-Range: a strong ETag, else Last-Modified"""
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def response_validators(headers):
+    """Headers that tell whether a previously fetched file is still current"""
+    return {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+    }
+
+
+class RangeNotHonored(Exception):
+    """The host answered a segment request with the whole file"""
+
+
+def expected_length(response, offset=0):
+    """Full size of the entity being fetched, or None if the host doesn't say"""
+    length = response.headers.get('Content-Length')
+    if not (length and length.isdigit()):
+        return None
+    return offset + int(length)
+
+
+class ResumableDownloader:
+    """Downloads URLs into a staging directory, resuming partial files"""
+
+    def __init__(self, upstream, directory=DEFAULT_DOWNLOAD_DIR, chunk_size=256 * 1024,
+                 retries=3, retry_delay=2, segments=4, segment_min_size=8 * 1024 * 1024, throttle=None):
+        self.upstream = upstream
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # Files are split into at most `segments` parallel ranges of at least
+        # segment_min_size bytes; smaller files use a single stream
+        self.segments = segments if hasattr(os, 'pwrite') else 1
+        self.segment_min_size = segment_min_size
+        # Called with the size of every chunk received; may sleep to cap the rate
+        self.throttle = throttle
+        self.lock = threading.Lock()
+        self.url_locks = {}
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale()
+
+    def _paths(self, url, suffix):
+        base = os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest()[:32])
+        return base + '.part', base + '.json', base + suffix
+
+    def download(self, url, suffix='', progress=None):
+        """Fetch url into the staging directory.
+
+        Returns (path, validators), the validators being the upstream ETag and
+        Last-Modified the file was fetched under. The caller owns the returned
+        file and should delete (or move) it once it is no longer needed;
+        keeping it lets a failed upload be retried without downloading again.
+        """
+        part_path, meta_path, final_path = self._paths(url, suffix)
+        with self.lock:
+            url_lock = self.url_locks.setdefault(final_path, threading.Lock())
+
+        # Two transfers of the same URL must not write the same .part file
+        with url_lock:
+            if os.path.exists(final_path):
+                if progress:
+                    size = os.path.getsize(final_path)
+                    progress.set_total(size)
+                    progress.downloaded = size
+                return final_path, {}
+
+            last_error = None
+            segmented = self.segments > 1
+            for attempt in range(1, self.retries + 2):
+                try:
+                    plan = self._segment_plan(url, part_path, meta_path) if segmented else None
+                    if plan:
+                        self._fetch_segmented(url, part_path, meta_path, plan, progress)
+                    else:
+                        self._fetch(url, part_path, meta_path, progress)
+                    os.replace(part_path, final_path)
+                    validators = (self._meta(meta_path) or {}).get('validators', {})
+                    self._unlink(meta_path)
+                    return final_path, validators
+                except RangeNotHonored:
+                    # Fall back to a single stream right away
+                    print(f"↪️  {url} ignored a segment range, downloading as a single stream")
+                    self._unlink(part_path, meta_path)
+                    segmented = False
+                    continue
+                except HTTPError as e:
+                    if e.code == 416:
+                        # Our partial no longer fits the upstream file
+                        self._unlink(part_path, meta_path)
+                    elif e.code < 500:
+                        raise
+                    last_error = e
+                except (OSError, http.client.HTTPException) as e:
+                    last_error = e
+                if attempt <= self.retries:
+                    print(f"🔁 Download of {url} interrupted ({last_error}), retrying from "
+                          f"{self._partial_size(part_path, meta_path)} bytes")
+                    time.sleep(self.retry_delay * attempt)
+            raise last_error
+
+    def _fetch(self, url, part_path, meta_path, progress):
+        meta = self._meta(meta_path) or {}
+        # A preallocated segmented partial can't be continued as one stream
+        offset = 0 if meta.get('segments') else self._partial_size(part_path, meta_path)
+        validator = meta.get('validator')
+        headers = {'Accept': '*/*'}
+        if offset and validator:
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = validator
+
+        with self.upstream.request(url, headers=headers) as response:
+            if response.status != 206:
+                offset = 0     # Range ignored or the file changed: start over
+            total = expected_length(response, offset)
+            validator = resume_validator(response.headers)
+            if validator:
+                self._save_meta(meta_path, {'url': url, 'validator': validator, 'total': total,
+                                            'validators': response_validators(response.headers)})
+            else:
+                self._unlink(meta_path)
+            if progress:
+                progress.set_total(total)
+                progress.downloaded = offset
+
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                buffer = bytearray(self.chunk_size)
+                view = memoryview(buffer)
+                while True:
+                    count = response.readinto(buffer)
+                    if not count:
+                        break
+                    f.write(view[:count])
+                    if progress:
+                        progress.add_downloaded(count)
+                    if self.throttle:
+                        self.throttle(count)
+
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            raise http.client.IncompleteRead(b'', total - size)
+
+    def _segment_plan(self, url, part_path, meta_path):
+        """Segment state for a segmented download, or None for a single stream"""
+        meta = self._meta(meta_path)
+        if meta and os.path.exists(part_path):
+            # Resume in whichever mode the partial file was started
+            return meta if meta.get('segments') else None
+
+        try:
+            with self.upstream.request(url, headers={'Accept': '*/*'}, method='HEAD') as response:
+                response.read()
+                total = expected_length(response)
+                validator = resume_validator(response.headers)
+                validators = response_validators(response.headers)
+                ranges = response.headers.get('Accept-Ranges', '').lower()
+        except (OSError, http.client.HTTPException):
+            return None     # The GET will report the real problem
+        if ranges != 'bytes' or not validator or total is None:
+            return None
+        count = min(self.segments, total // self.segment_min_size)
+        if count < 2:
+            return None
+
+        size = -(-total // count)
+        segments = [[start, min(start + size, total) - 1, 0] for start in range(0, total, size)]
+        with open(part_path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, total)
+            else:
+                f.truncate(total)
+        meta = {'url': url, 'validator': validator, 'validators': validators, 'total': total,
+                'segments': segments}
+        self._save_meta(meta_path, meta)
+        return meta
+
+    def _fetch_segmented(self, url, part_path, meta_path, meta, progress):
+        segments = meta['segments']
+        pending = [segment for segment in segments if segment[0] + segment[2] <= segment[1]]
+        if progress:
+            progress.set_total(meta['total'])
+            progress.downloaded = sum(segment[2] for segment in segments)
+
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+                futures = [executor.submit(self._fetch_segment, url, fd, segment, meta['validator'], progress)
+                           for segment in pending]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+            # Record how far every segment got so a retry only fetches the rest
+            self._save_meta(meta_path, meta)
+
+    def _fetch_segment(self, url, fd, segment, validator, progress):
+        start, end, done = segment
+        position = start + done
+        headers = {'Accept': '*/*', 'Range': f"bytes={position}-{end}", 'If-Range': validator}
+        with self.upstream.request(url, headers=headers) as response:
+            if response.status != 206:
+                raise RangeNotHonored(url)
+            buffer = bytearray(self.chunk_size)
+            view = memoryview(buffer)
+            while position <= end:
+                count = response.readinto(buffer)
+                if not count:
+                    break
+                count = min(count, end - position + 1)
+                os.pwrite(fd, view[:count], position)
+                position += count
+                segment[2] += count
+                if progress:
+                    progress.add_downloaded(count)
+                if self.throttle:
+                    self.throttle(count)
+        if position <= end:
+            raise http.client.IncompleteRead(b'', end - position + 1)
+
+    def _partial_size(self, part_path, meta_path):
+        """Bytes already downloaded into part_path"""
+        meta = self._meta(meta_path)
+        # A partial without a validator can't be resumed safely
+        if not meta or not os.path.exists(part_path):
+            return 0
+        if meta.get('segments'):
+            return sum(segment[2] for segment in meta['segments'])
+        return os.path.getsize(part_path)
+
+    def _meta(self, meta_path):
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, meta_path, meta):
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    def _unlink(self, *paths):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _remove_stale(self):
+        cutoff = time.time() - STALE_DOWNLOAD_AGE
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+            except OSError:
+                pass
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+In-memory index of the local ROM library
+Walks the configured library directories once with a recursive scandir and
+answers lookups by file name from memory. Rescans are incremental: a
+directory is only listed again when its mtime changed, so keeping the index
+current costs one stat per directory. Names match across subfolders and
+across archive/extracted variants ("Game (USA).zip" finds "Game (USA).nes").
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+DEFAULT_LIBRARY_DIRS = (os.path.join(os.path.expanduser('~'), 'Downloads'),)
+
+# Unfinished browser/downloader files are never reported as present
+PARTIAL_SUFFIXES = ('.part', '.crdownload', '.download', '.tmp')
+
+HASH_ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+# Files that share a ROM's stem without being a copy of it
+NON_ROM_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.txt', '.nfo', '.xml', '.srm', '.sav', '.state', '.html'}
+
+
+def name_stem(name):
+    """Lowercased file name without its last extension"""
+    stem, ext = os.path.splitext(name.lower())
+    return stem if ext else name.lower()
+
+
+class LibraryDirectory:
+    """What the last listing of one directory found"""
+
+    def __init__(self, mtime_ns, files, subdirs):
+        self.mtime_ns = mtime_ns
+        self.files = files          # name -> (size, mtime)
+        self.subdirs = subdirs      # names of subdirectories
+
+
+class LibraryIndex:
+    """File names, sizes and paths under a set of library directories"""
+
+    def __init__(self, directories=DEFAULT_LIBRARY_DIRS, rescan_interval=5, max_depth=8):
+        self.roots = [os.path.abspath(os.path.expanduser(path)) for path in directories]
+        # Lookups rescan first if the index is older than this many seconds
+        self.rescan_interval = rescan_interval
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.directories = {}   # absolute path -> LibraryDirectory
+        self.by_name = {}       # lowercased name -> set of paths
+        self.by_stem = {}       # lowercased stem -> set of paths
+        self.digests = {}       # (path, algorithm) -> (size, mtime, hexdigest)
+        self.scanned_at = None
+
+    def file_count(self):
+        with self.lock:
+            return sum(len(paths) for paths in self.by_name.values())
+
+    def refresh(self, max_age=None):
+        """Bring the index up to date; skipped if it was scanned less than max_age seconds ago"""
+        with self.lock:
+            if max_age is not None and self.scanned_at is not None \
+                    and time.monotonic() - self.scanned_at < max_age:
+                return
+            started = time.monotonic()
+            first = self.scanned_at is None
+            listed = sum(self._scan_root(root) for root in self.roots)
+            self.scanned_at = time.monotonic()
+            if first:
+                files = sum(len(paths) for paths in self.by_name.values())
+                print(f"📚 Indexed {files} files in {len(self.directories)} library directories "
+                      f"in {self.scanned_at - started:.1f}s")
+            elif listed:
+                print(f"📚 Relisted {listed} changed library directories in {self.scanned_at - started:.2f}s")
+
+    def _scan_root(self, root):
+        """Walk one root, listing only directories whose mtime changed; returns how many were listed"""
+        listed = 0
+        stack = [(root, 0)]
+        while stack:
+            path, depth = stack.pop()
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._forget(path)
+                continue
+            record = self.directories.get(path)
+            if record is None or record.mtime_ns != stat.st_mtime_ns:
+                record = self._list(path, stat.st_mtime_ns, record)
+                listed += 1
+            if depth < self.max_depth:
+                stack.extend((os.path.join(path, name), depth + 1) for name in record.subdirs)
+        return listed
+
+    def _list(self, path, mtime_ns, previous):
+        files, subdirs = {}, []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.is_file() and not entry.name.lower().endswith(PARTIAL_SUFFIXES):
+                            stat = entry.stat()
+                            files[entry.name] = (stat.st_size, stat.st_mtime)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+
+        if previous is not None:
+            for name in previous.files:
+                self._unlink(os.path.join(path, name), name)
+            for name in set(previous.subdirs) - set(subdirs):
+                self._forget(os.path.join(path, name))
+        for name in files:
+            file_path = os.path.join(path, name)
+            self.by_name.setdefault(name.lower(), set()).add(file_path)
+            self.by_stem.setdefault(name_stem(name), set()).add(file_path)
+        record = LibraryDirectory(mtime_ns, files, subdirs)
+        self.directories[path] = record
+        return record
+
+    def _unlink(self, file_path, name):
+        for algorithm in HASH_ALGORITHMS:
+            self.digests.pop((file_path, algorithm), None)
+        for table, key in ((self.by_name, name.lower()), (self.by_stem, name_stem(name))):
+            paths = table.get(key)
+            if paths is not None:
+                paths.discard(file_path)
+                if not paths:
+                    del table[key]
+
+    def _forget(self, path):
+        """Drop a directory that disappeared, with everything below it"""
+        record = self.directories.pop(path, None)
+        if record is None:
+            return
+        for name in record.files:
+            self._unlink(os.path.join(path, name), name)
+        for name in record.subdirs:
+            self._forget(os.path.join(path, name))
+
+    def _rank(self, file_name, file_path):
+        """Sort key: exact name first, then case-insensitive, then variants; earlier roots and shallower paths win"""
+        name = os.path.basename(file_path)
+        kind = 0 if name == file_name else 1 if name.lower() == file_name.lower() else 2
+        root = next((index for index, root in enumerate(self.roots)
+                     if file_path.startswith(root + os.sep)), len(self.roots))
+        return kind, root, file_path.count(os.sep), file_path
+
+    def lookup(self, file_names, algorithm=None, variants=True):
+        """Best local match for each name, in order; None where nothing matched.
+
+        A match is a dict with name, path, size, mtime and whether it is the
+        exact file or an archive/extracted variant. A variant holds other
+        bytes than the named file, so callers that upload it as that name
+        must pass variants=False. With algorithm, the file's digest is added
+        (computed once per file version).
+        """
+        self.refresh(max_age=self.rescan_interval)
+        results = []
+        for file_name in file_names:
+            file_name = os.path.basename(str(file_name or ''))
+            with self.lock:
+                candidates = self.by_name.get(file_name.lower(), set())
+                if variants:
+                    candidates = candidates | self.by_stem.get(name_stem(file_name), set())
+                ranked = sorted((path for path in candidates
+                                 if os.path.splitext(path)[1].lower() not in NON_ROM_EXTENSIONS
+                                 or os.path.basename(path).lower() == file_name.lower()),
+                                key=lambda path: self._rank(file_name, path))
+            match = None
+            for file_path in ranked:
+                # Files rewritten in place don't touch the directory mtime
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                name = os.path.basename(file_path)
+                match = {
+                    'name': name,
+                    'path': file_path,
+                    'size': stat.st_size,
+                    'mtime': int(stat.st_mtime),
+                    'match': 'exact' if name.lower() == file_name.lower() else 'variant',
+                }
+                if algorithm:
+                    match[algorithm] = self.digest(file_path, stat, algorithm)
+                break
+            results.append(match)
+        return results
+
+    def digest(self, file_path, stat, algorithm):
+        key = (file_path, algorithm)
+        with self.lock:
+            cached = self.digests.get(key)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime):
+            return cached[2]
+        try:
+            digest = hashlib.new(algorithm)
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            hexdigest = digest.hexdigest()
+        except OSError:
+            return None
+        with self.lock:
+            self.digests[key] = (stat.st_size, stat.st_mtime, hexdigest)
+        return hexdigest
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Metrics and request timing for the ROM Downloader services
+Counters, gauges and histograms live in one in-process registry and are
+rendered in the Prometheus text format by each service's /metrics endpoint.
+Services that share a process (start_services.py --unified) share the
+registry. The optional timing log is a JSON-lines file with one record per
+request or transfer, including how long each stage took.
+"""
+
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers quick cache hits through multi-minute disc image transfers
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """All metrics of a process, in registration order"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(Metric):
+    """Monotonic total per label set"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield '', self._labels(key), value
+
+
+class Gauge(Metric):
+    """Current value per label set, or computed by a callback at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Report function() instead of a stored value (unlabelled gauges only)"""
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                yield '', {}, self.function()
+            except Exception:
+                pass  # A broken callback shouldn't take down the whole scrape
+            return
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield '', self._labels(key), value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * len(self.buckets)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        for key, (counts, total) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '_bucket', dict(labels, le=format_value(bound)), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+class TimingLog:
+    """Appends one JSON object per line to a file, safe to share between threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def write(self, record):
+        line = json.dumps({'time': round(time.time(), 3), **record}, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+HTTP_REQUESTS = Counter('romnix_http_requests_total', "HTTP requests served",
+                        ('service', 'route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = Histogram('romnix_http_request_duration_seconds',
+                                 "Time from reading a request to finishing the response",
+                                 ('service', 'route'))
+
+
+class RequestMetricsMixin:
+    """Counts and times every request of a BaseHTTPRequestHandler subclass.
+
+    Subclasses set `service` and map paths to a small set of route names in
+    route_name(). Handlers may add stage durations to self.timings and
+    other fields to self.timing_details for the timing log.
+    """
+
+    service = 'http'
+    # TimingLog for per-request records, or None
+    timing_log = None
+
+    def route_name(self):
+        return 'other'
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self.response_status = None
+        self.timings = {}
+        self.timing_details = {}
+        self.request_started = time.perf_counter()
+        try:
+            super().handle_one_request()
+        finally:
+            # No status means the keep-alive connection just closed
+            if self.response_status is not None:
+                self.record_request(time.perf_counter() - self.request_started)
+
+    def parse_request(self):
+        # The clock starts once the request line is in, not while a keep-alive connection idles
+        self.request_started = time.perf_counter()
+        return super().parse_request()
+
+    def record_request(self, elapsed):
+        # Requests rejected before their request line parsed have no command or path
+        route = self.route_name() if self.command else 'invalid'
+        HTTP_REQUESTS.inc(service=self.service, route=route, method=self.command or '-',
+                          status=self.response_status)
+        HTTP_REQUEST_SECONDS.observe(elapsed, service=self.service, route=route)
+        if self.timing_log is not None:
+            self.timing_log.write({
+                'type': 'request',
+                'service': self.service,
+                'method': self.command,
+                'route': route,
+                'status': self.response_status,
+                'seconds': round(elapsed, 4),
+                'stages': {name: round(seconds, 4) for name, seconds in self.timings.items()},
+                **self.timing_details,
+            })
+
+    def send_metrics(self):
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
@@ -133,6 +133,12 @@ class RomRepository {
         ];
         this.currentProxyIndex = 0;
         
+        // Local proxy endpoints that crawl listings server-side and search
+        // the persisted catalog (proxy_server.py)
+        this.localIndexUrl = 'http://localhost:8001/crawl';
+        this.localCatalogUrl = 'http://localhost:8001/search';
+        this.catalogPlatforms = new Map(); // platform id -> archiveUrl registered this session
+        
         // Demo mode disabled: always use live directory parsing via proxies
         this.forceDemoMode = false;
 
@@ -407,6 +413,114 @@ class RomRepository {
         return results;
     }
 
+    async requestLocalIndex(params) {
+        // Ask the local proxy to crawl (or reuse) an index; returns null if unavailable
+        const controller = new AbortController();
+        const timeoutId = setTimeout(() => controller.abort(), 120000); // First crawl of a large archive can take a while
+        
+        try {
+            const response = await fetch(`${this.localIndexUrl}?${params}`, {
+                method: 'GET',
+                credentials: 'omit',
+                signal: controller.signal
+            });
+            if (!response.ok) {
+                console.warn(`Local ROM index failed with status: ${response.status}`);
+                return null;
+            }
+            
+            const index = await response.json();
+            if (!index.success) {
+                console.warn('Local ROM index error:', index.error);
+                return null;
+            }
+            return index;
+        } catch (error) {
+            console.warn('Local ROM index unavailable:', error.message);
+            return null;
+        } finally {
+            clearTimeout(timeoutId);
+        }
+    }
+
+    async fetchRomIndex(archiveUrl, extensions, depth = 2) {
+        const index = await this.requestLocalIndex(new URLSearchParams({
+            url: archiveUrl,
+            ext: extensions.join(','),
+            depth: String(depth)
+        }));
+        if (!index) return null;
+        
+        console.log(`🗂️ Local ROM index returned ${index.count} entries for ${archiveUrl}`);
+        return index.entries.map(entry => ({
+            displayName: entry.name,
+            downloadUrl: entry.url,
+            size: entry.size,
+            mtime: entry.mtime
+        }));
+    }
+
+    async ensureCatalogPlatform(platform) {
+        // Register a platform with the local catalog once per session (again if its link changes)
+        const archiveUrl = platform.archiveUrl.replace(/\/$/, '') + '/';
+        if (this.catalogPlatforms.get(platform.id) === archiveUrl) {
+            return true;
+        }
+        
+        const index = await this.requestLocalIndex(new URLSearchParams({
+            url: archiveUrl,
+            ext: platform.extensions.map(ext => ext.toLowerCase()).join(','),
+            depth: '2',
+            platform: platform.id,
+            entries: '0'
+        }));
+        if (!index) return false;
+        
+        console.log(`🗂️ Catalog has ${index.count} entries for ${platform.label}`);
+        this.catalogPlatforms.set(platform.id, archiveUrl);
+        return true;
+    }
+
+    async searchCatalog(searchTerm, platformIds) {
+        // Page through /search results from the local catalog; returns null if unavailable
+        const pageSize = 500;
+        const maxPages = 20;
+        const results = [];
+        
+        try {
+            for (let page = 1; page <= maxPages; page++) {
+                const params = new URLSearchParams({
+                    q: searchTerm.trim(),
+                    platform: platformIds.join(','),
+                    page: String(page),
+                    limit: String(pageSize)
+                });
+                const response = await fetch(`${this.localCatalogUrl}?${params}`, { method: 'GET', credentials: 'omit' });
+                if (!response.ok) return null;
+                
+                const data = await response.json();
+                if (!data.success) return null;
+                
+                for (const rom of data.results) {
+                    results.push({
+                        displayName: rom.name,
+                        downloadUrl: rom.url,
+                        size: rom.size,
+                        mtime: rom.mtime,
+                        platform: Object.values(platforms).find(p => p.id === rom.platform)
+                    });
+                }
+                if (results.length >= data.total || data.results.length < pageSize) break;
+            }
+        } catch (error) {
+            console.warn('Local catalog search unavailable:', error.message);
+            return null;
+        }
+        
+        console.log(`🔍 Catalog returned ${results.length} ROMs for "${searchTerm}"`);
+        return results;
+    }
+
     async search(platform, searchTerm = '') {
         try {
             console.log(`Searching ${platform.label} for "${searchTerm}"...`);
@@ -426,13 +540,25 @@ class RomRepository {
                 return [];
             }
             
+            // Answer from the local catalog when the proxy is running
+            if (await this.ensureCatalogPlatform(platform)) {
+                const catalogResults = await this.searchCatalog(searchTerm, [platform.id]);
+                if (catalogResults !== null) {
+                    return catalogResults;
+                }
+            }
+            
             // Enhanced search logic with direct download capabilities
             const startUrl = platform.archiveUrl.replace(/\/$/, '') + '/';
             console.log(`🎯 Final search URL: ${startUrl}`);
             const extensions = platform.extensions.map(ext => ext.toLowerCase());
             
-            const rawItems = await this.parseDirectoryRecursively(startUrl, extensions, 2, new Set());
-            console.log(`🎯 parseDirectoryRecursively returned ${rawItems.length} raw items:`, rawItems);
+            // Prefer the server-side index; crawl from the browser only as a fallback
+            let rawItems = await this.fetchRomIndex(startUrl, extensions, 2);
+            if (rawItems === null) {
+                rawItems = await this.parseDirectoryRecursively(startUrl, extensions, 2, new Set());
+                console.log(`🎯 parseDirectoryRecursively returned ${rawItems.length} raw items:`, rawItems);
+            }
             
             // Add platform info to each ROM
             const items = rawItems.map(item => ({
@@ -464,6 +590,18 @@ class RomRepository {
 
         console.log(`Searching all platforms for "${searchTerm}"...`);
 
+        // One catalog query covers every configured platform
+        const configured = allPlatforms.filter(p => p.archiveUrl && p.archiveUrl.trim() !== '');
+        if (configured.length > 0) {
+            const registered = await Promise.all(configured.map(p => this.ensureCatalogPlatform(p)));
+            if (registered.every(Boolean)) {
+                const catalogResults = await this.searchCatalog(searchTerm, configured.map(p => p.id));
+                if (catalogResults !== null) {
+                    return catalogResults;
+                }
+            }
+        }
+
         // Search all platforms in parallel for better performance
         const searchPromises = allPlatforms.map(platform => 
             this.search(platform, searchTerm)
@@ -4,19 +4,73 @@ Simple CORS proxy server for ROM Downloader
 Run this alongside the main HTTP server to bypass CORS restrictions.
 """
 
+import argparse
 import http.server
-import socketserver
-import urllib.request
+import os
+import shutil
+import time
 import urllib.parse
 import json
 from urllib.error import URLError, HTTPError
 
-class CORSProxyHandler(http.server.BaseHTTPRequestHandler):
+from metrics import Counter, Histogram, RequestMetricsMixin, TimingLog
+from response_cache import ResponseCache, DEFAULT_CACHE_DIR, fetch_document
+from rom_index import RomIndexer, DEFAULT_INDEX_DIR
+from rom_catalog import RomCatalog, CatalogRefresher, DEFAULT_CATALOG_PATH
+from server_utils import BoundedThreadingHTTPServer
+from upstream_pool import UpstreamPool
+
+# Size of the relay buffer used when streaming upstream bodies
+CHUNK_SIZE = 64 * 1024
+
+# Upstream headers that are forwarded to the client unchanged
+PASSTHROUGH_HEADERS = ('Last-Modified', 'ETag', 'Content-Disposition', 'Content-Range', 'Accept-Ranges')
+
+# Client headers forwarded upstream so partial downloads can be resumed
+RANGE_HEADERS = ('Range', 'If-Range')
+
+CACHE_LOOKUPS = Counter('romnix_proxy_cache_lookups_total',
+                        "Proxied requests by cache and outcome (hit, miss, revalidated, stale)",
+                        ('cache', 'result'))
+UPSTREAM_SECONDS = Histogram('romnix_proxy_upstream_seconds',
+                             "Time waiting on the upstream archive: for response headers, then reading the body",
+                             ('stage',))
+CLIENT_WRITE_SECONDS = Histogram('romnix_proxy_client_write_seconds',
+                                 "Time spent writing response bodies to the client")
+PROXY_BYTES = Counter('romnix_proxy_bytes_total', "Body bytes sent to clients, by where they came from",
+                      ('source',))
+
+class CORSProxyHandler(RequestMetricsMixin, http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    service = 'proxy'
+    # Idle keep-alive clients give up their request slot after this long
+    timeout = 15
+    chunk_size = CHUNK_SIZE
+    streaming = True
+    upstream = UpstreamPool()
+    cache = None
+    indexer = None
+    catalog = None
+    # The transfer service's ROM cache, when both run in one process
+    rom_cache = None
+    
     def do_GET(self):
+        self.headers_sent = False
+        
         # Extract the target URL from the query parameter
         parsed_path = urllib.parse.urlparse(self.path)
         query_params = urllib.parse.parse_qs(parsed_path.query)
         
+        if parsed_path.path == '/crawl':
+            self.handle_crawl(query_params)
+            return
+        if parsed_path.path == '/search':
+            self.handle_search(query_params)
+            return
+        if parsed_path.path == '/metrics':
+            self.send_metrics()
+            return
+        
         if 'url' not in query_params:
             self.send_error(400, "Missing 'url' parameter")
             return
@@ -42,70 +96,406 @@ class CORSProxyHandler(http.server.BaseHTTPRequestHandler):
                 else:
                     target_url = decoded_url
             
+            # Ranged requests go straight upstream; the cache only holds whole bodies
+            range_headers = {name: self.headers[name] for name in RANGE_HEADERS if self.headers.get(name)}
+            use_cache = self.cache is not None and not range_headers
+            
+            self.timing_details['url'] = target_url
+            
+            # ROMs the transfer service already fetched don't need the archive at all
+            if self.rom_cache is not None and not range_headers:
+                if self.send_cached_rom(target_url):
+                    CACHE_LOOKUPS.inc(cache='rom', result='hit')
+                    print(f"💾 ROM cache hit: {target_url}")
+                    return
+                CACHE_LOOKUPS.inc(cache='rom', result='miss')
+            
+            # Serve fresh directory listings straight from the disk cache
+            cached = self.cache.lookup(target_url) if use_cache else None
+            if cached and self.cache.is_fresh(cached):
+                if self.send_cached(cached, 'HIT'):
+                    CACHE_LOOKUPS.inc(cache='response', result='hit')
+                    print(f"💾 Cache hit: {target_url}")
+                    return
+                cached = None
+            
             print(f"📡 Fetching: {target_url}")
             
-            # Create request with proper headers
-            req = urllib.request.Request(
-                target_url,
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0 Safari/537.36',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.9'
-                }
-            )
+            # Revalidate stale entries with a conditional GET
+            headers = dict(range_headers)
+            if cached and self.cache.can_revalidate(cached):
+                headers = self.cache.conditional_headers(cached)
             
-            # Fetch the content
-            with urllib.request.urlopen(req, timeout=30) as response:
-                content = response.read()
-                content_type = response.headers.get('Content-Type', 'text/html')
-                
-                # Send successful response with CORS headers
-                self.send_response(200)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-                self.send_header('Content-Type', content_type)
-                self.send_header('Content-Length', str(len(content)))
-                self.end_headers()
-                
-                self.wfile.write(content)
-                
+            # Fetch the content over a pooled keep-alive connection and
+            # stream it through as it arrives
+            started = time.perf_counter()
+            try:
+                response = self.upstream.request(target_url, headers=headers)
+            except (HTTPError, URLError):
+                if cached and self.send_cached(cached, 'STALE'):
+                    CACHE_LOOKUPS.inc(cache='response', result='stale')
+                    print(f"⚠️  Upstream failed, served stale copy: {target_url}")
+                    return
+                raise
+            finally:
+                self.timings['upstream_headers'] = time.perf_counter() - started
+                UPSTREAM_SECONDS.observe(self.timings['upstream_headers'], stage='headers')
+            
+            with response:
+                if response.status == 304 and cached:
+                    self.cache.refresh(cached, response.headers)
+                    if self.send_cached(cached, 'REVALIDATED'):
+                        CACHE_LOOKUPS.inc(cache='response', result='revalidated')
+                        print(f"💾 Revalidated: {target_url}")
+                        return
+                    raise URLError("cached body disappeared during revalidation")
+                if use_cache:
+                    CACHE_LOOKUPS.inc(cache='response', result='miss')
+                writer = self.cache.writer(target_url, response) if use_cache else None
+                self.stream_response(response, writer)
                 print(f"✓ Successfully proxied: {target_url}")
                 
         except HTTPError as e:
             print(f"✗ HTTP Error {e.code} for: {target_url}")
-            self.send_error(e.code, f"HTTP Error: {e.reason}")
+            self.send_proxy_error(e.code, f"HTTP Error: {e.reason}")
         except URLError as e:
             print(f"✗ URL Error for: {target_url} - {e.reason}")
-            self.send_error(500, f"URL Error: {e.reason}")
+            self.send_proxy_error(500, f"URL Error: {e.reason}")
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"✗ Client disconnected while streaming: {target_url}")
+            self.close_connection = True
         except Exception as e:
             print(f"✗ General Error for: {target_url} - {str(e)}")
-            self.send_error(500, f"Proxy Error: {str(e)}")
+            self.send_proxy_error(500, f"Proxy Error: {str(e)}")
+    
+    def handle_crawl(self, query_params):
+        """Crawl an archiveUrl server-side and return a compact ROM index.
+        
+        Query parameters: url (archiveUrl), ext (comma separated list of
+        extensions), depth (default 2) and refresh=1 to force a re-crawl.
+        With platform=<id> the index is also synced into the search catalog,
+        and entries=0 leaves the entry list out of the response.
+        """
+        if 'url' not in query_params or 'ext' not in query_params:
+            self.send_json_response(400, {'success': False, 'error': "Missing 'url' or 'ext' parameter"})
+            return
+        
+        archive_url = query_params['url'][0]
+        extensions = [ext.strip() for ext in query_params['ext'][0].split(',')]
+        refresh = query_params.get('refresh', ['0'])[0] in ('1', 'true')
+        try:
+            depth = int(query_params.get('depth', ['2'])[0])
+        except ValueError:
+            self.send_json_response(400, {'success': False, 'error': "Invalid 'depth' parameter"})
+            return
+        
+        try:
+            index = self.indexer.get_index(archive_url, extensions, depth, refresh=refresh)
+            platform_id = query_params.get('platform', [''])[0]
+            if platform_id and self.catalog:
+                self.catalog.register_platform(platform_id, archive_url, index['extensions'], index['depth'])
+                changes = self.catalog.sync_platform(platform_id, index)
+                if changes:
+                    print(f"🗂️  Catalog {platform_id}: +{changes[0]} ~{changes[1]} -{changes[2]}")
+        except Exception as e:
+            print(f"✗ Crawl error for: {archive_url} - {str(e)}")
+            self.send_json_response(500, {'success': False, 'error': f"Crawl Error: {str(e)}"})
+            return
+        
+        if query_params.get('entries', ['1'])[0] == '0':
+            index = {key: value for key, value in index.items() if key != 'entries'}
+        self.send_json_response(200, {'success': True, **index})
+    
+    def handle_search(self, query_params):
+        """Search the ROM catalog: /search?q=&platform=nes,snes&page=1&limit=100"""
+        if not self.catalog:
+            self.send_json_response(503, {'success': False, 'error': "ROM catalog is disabled"})
+            return
+        
+        query = query_params.get('q', [''])[0]
+        platforms = [p for p in query_params.get('platform', [''])[0].split(',') if p]
+        try:
+            page = max(1, int(query_params.get('page', ['1'])[0]))
+            limit = max(1, min(int(query_params.get('limit', ['100'])[0]), 1000))
+        except ValueError:
+            self.send_json_response(400, {'success': False, 'error': "Invalid 'page' or 'limit' parameter"})
+            return
+        
+        total, results = self.catalog.search(query, platforms, page, limit)
+        self.send_json_response(200, {
+            'success': True,
+            'query': query,
+            'page': page,
+            'limit': limit,
+            'total': total,
+            'results': results
+        })
+    
+    def send_json_response(self, code, data):
+        """Send compact JSON with CORS headers"""
+        body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        self.send_response(code)
+        self.send_cors_headers()
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.headers_sent = True
+        self.wfile.write(body)
+    
+    def stream_response(self, response, writer=None):
+        """Forward an upstream response to the client chunk by chunk.
+        
+        Only one chunk is held in memory at a time. When the upstream
+        length is known it is passed through as Content-Length, otherwise
+        the body is re-framed with chunked transfer encoding. If a cache
+        writer is given, each chunk is also teed into the disk cache.
+        """
+        content_type = response.headers.get('Content-Type', 'text/html')
+        content_length = response.headers.get('Content-Length')
+        
+        # 206 Partial Content is relayed as-is along with its Content-Range
+        self.send_response(206 if response.status == 206 else 200)
+        self.send_cors_headers()
+        self.send_header('Content-Type', content_type)
+        for header in PASSTHROUGH_HEADERS:
+            value = response.headers.get(header)
+            if value:
+                self.send_header(header, value)
+        if self.cache and not self.headers.get('Range'):
+            self.send_header('X-Cache', 'MISS')
+        
+        try:
+            if not self.streaming:
+                # Buffered mode: read the whole body before replying
+                started = time.perf_counter()
+                body = response.read()
+                read_done = time.perf_counter()
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.headers_sent = True
+                self.wfile.write(body)
+                self.record_relay(read_done - started, time.perf_counter() - read_done, len(body))
+                if writer:
+                    writer.write(body)
+                    writer.commit()
+                return
+            self.relay_body(response, content_length, writer)
+        finally:
+            if writer:
+                writer.abort()
+    
+    def relay_body(self, response, content_length, writer):
+        """Finish the headers and copy the body through a fixed-size buffer"""
+        chunked = not (content_length and content_length.isdigit())
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', content_length)
+        self.end_headers()
+        self.headers_sent = True
+        
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        # Upstream reads and client writes are timed apart to show which side is slow
+        read_time = write_time = 0.0
+        sent = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                count = response.readinto(buffer)
+                read_done = time.perf_counter()
+                read_time += read_done - started
+                if not count:
+                    break
+                if chunked:
+                    self.wfile.write(f"{count:X}\r\n".encode('ascii'))
+                    self.wfile.write(view[:count])
+                    self.wfile.write(b"\r\n")
+                else:
+                    self.wfile.write(view[:count])
+                write_time += time.perf_counter() - read_done
+                sent += count
+                if writer:
+                    writer.write(view[:count])
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        finally:
+            self.record_relay(read_time, write_time, sent)
+        if writer:
+            writer.commit()
+    
+    def record_relay(self, read_time, write_time, sent, source='upstream'):
+        """Account for one response body relayed to the client"""
+        if source == 'upstream':
+            self.timings['upstream_body'] = read_time
+            UPSTREAM_SECONDS.observe(read_time, stage='body')
+        self.timings['client_write'] = write_time
+        CLIENT_WRITE_SECONDS.observe(write_time)
+        PROXY_BYTES.inc(sent, source=source)
+        self.timing_details['bytes'] = sent
+    
+    def send_cached(self, meta, cache_status):
+        """Reply with a cached body; returns False if it vanished from disk"""
+        try:
+            body = self.cache.open_body(meta)
+        except OSError:
+            return False
+        with body:
+            size = os.fstat(body.fileno()).st_size
+            self.send_response(200)
+            self.send_cors_headers()
+            self.send_header('Content-Type', meta.get('content_type') or 'text/html')
+            if meta.get('etag'):
+                self.send_header('ETag', meta['etag'])
+            if meta.get('last_modified'):
+                self.send_header('Last-Modified', meta['last_modified'])
+            self.send_header('X-Cache', cache_status)
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            self.headers_sent = True
+            self.timing_details['cache'] = cache_status
+            started = time.perf_counter()
+            shutil.copyfileobj(body, self.wfile, self.chunk_size)
+            self.record_relay(0, time.perf_counter() - started, size, 'response-cache')
+        return True
+    
+    def send_cached_rom(self, url):
+        """Reply with a ROM from the shared ROM cache; False if it isn't cached"""
+        meta = self.rom_cache.lookup(url)
+        if meta is None or not self.rom_cache.is_fresh(meta):
+            return False
+        path = self.rom_cache.pin(meta)
+        if path is None:
+            return False
+        try:
+            with open(path, 'rb') as body:
+                self.send_response(200)
+                self.send_cors_headers()
+                self.send_header('Content-Type', 'application/octet-stream')
+                if meta.get('etag'):
+                    self.send_header('ETag', meta['etag'])
+                if meta.get('last_modified'):
+                    self.send_header('Last-Modified', meta['last_modified'])
+                self.send_header('X-Cache', 'ROM')
+                self.send_header('Content-Length', str(meta['size']))
+                self.end_headers()
+                self.headers_sent = True
+                self.timing_details['cache'] = 'ROM'
+                started = time.perf_counter()
+                shutil.copyfileobj(body, self.wfile, self.chunk_size)
+                self.record_relay(0, time.perf_counter() - started, meta['size'], 'rom-cache')
+        finally:
+            self.rom_cache.release(path)
+        return True
+    
+    def send_cors_headers(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range, If-Range')
+        self.send_header('Access-Control-Expose-Headers', 'X-Cache, Content-Range, Accept-Ranges, Content-Length')
+    
+    def send_proxy_error(self, code, message):
+        """Send an error, or drop the connection if the body already started"""
+        if self.headers_sent:
+            self.close_connection = True
+            return
+        self.send_error(code, message)
     
     def do_OPTIONS(self):
         # Handle preflight requests
         self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_cors_headers()
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
+    def route_name(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path in ('/crawl', '/search', '/metrics'):
+            return path[1:]
+        return 'proxy' if path == '/' else 'other'
+    
     def log_message(self, format, *args):
-        # Suppress default logging, we handle it above
+        # Suppress default logging; requests are counted in /metrics and the timing log
         pass
 
+def build_parser():
+    parser = argparse.ArgumentParser(description="CORS proxy for ROM Downloader")
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="relay buffer size in bytes when streaming")
+    parser.add_argument('--buffered', action='store_true',
+                        help="read whole upstream bodies before replying")
+    parser.add_argument('--max-concurrency', type=int, default=32,
+                        help="maximum client requests handled at once")
+    parser.add_argument('--per-host-limit', type=int, default=4,
+                        help="maximum in-flight requests per upstream host")
+    parser.add_argument('--upstream-idle-timeout', type=float, default=60,
+                        help="seconds an idle upstream keep-alive connection is kept")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="directory for cached upstream responses")
+    parser.add_argument('--cache-ttl', type=float, default=24 * 3600,
+                        help="seconds before a cached response is revalidated")
+    parser.add_argument('--cache-max-mb', type=float, default=512,
+                        help="total size cap of the response cache")
+    parser.add_argument('--cache-entry-max-mb', type=float, default=16,
+                        help="largest single response that is cached")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="disable the response cache")
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR,
+                        help="directory for persisted ROM indexes")
+    parser.add_argument('--index-max-age', type=float, default=7 * 24 * 3600,
+                        help="seconds before a stored ROM index is re-crawled")
+    parser.add_argument('--crawl-workers', type=int, default=4,
+                        help="directory listings fetched in parallel per crawl")
+    parser.add_argument('--catalog-db', default=DEFAULT_CATALOG_PATH,
+                        help="SQLite file backing the ROM search catalog")
+    parser.add_argument('--catalog-refresh', type=float, default=6 * 3600,
+                        help="seconds between background re-crawls of catalog platforms")
+    parser.add_argument('--no-catalog', action='store_true',
+                        help="disable the ROM search catalog")
+    parser.add_argument('--timing-log', metavar='PATH',
+                        help="append a JSON line with stage timings for every request to PATH")
+    return parser
+
+def configure(args, upstream=None):
+    """Set up CORSProxyHandler from parsed arguments, optionally sharing an upstream pool"""
+    CORSProxyHandler.chunk_size = args.chunk_size
+    CORSProxyHandler.streaming = not args.buffered
+    CORSProxyHandler.upstream = upstream or UpstreamPool(max_per_host=args.per_host_limit,
+                                                         idle_timeout=args.upstream_idle_timeout)
+    if not args.no_cache:
+        CORSProxyHandler.cache = ResponseCache(args.cache_dir, ttl=args.cache_ttl,
+                                               max_bytes=int(args.cache_max_mb * 1024 * 1024),
+                                               max_entry_bytes=int(args.cache_entry_max_mb * 1024 * 1024))
+    if args.timing_log:
+        CORSProxyHandler.timing_log = TimingLog(args.timing_log)
+    CORSProxyHandler.indexer = RomIndexer(
+        lambda url: fetch_document(CORSProxyHandler.upstream, CORSProxyHandler.cache, url),
+        args.index_dir, max_workers=args.crawl_workers, max_age=args.index_max_age)
+    if not args.no_catalog:
+        CORSProxyHandler.catalog = RomCatalog(args.catalog_db)
+        CatalogRefresher(CORSProxyHandler.catalog, CORSProxyHandler.indexer,
+                         interval=args.catalog_refresh).start()
+
 def main():
-    PORT = 8001
+    args = build_parser().parse_args()
+    PORT = args.port
+    configure(args)
     
     print("🚀 Starting CORS Proxy Server...")
     print(f"📡 Listening on http://localhost:{PORT}")
-    print("📝 Usage: http://localhost:8001/?url=<encoded_target_url>")
+    print(f"📝 Usage: http://localhost:{PORT}/?url=<encoded_target_url>")
+    print(f"🗂️  ROM index: http://localhost:{PORT}/crawl?url=<archive_url>&ext=zip,7z")
+    print(f"🔍 ROM search: http://localhost:{PORT}/search?q=<term>&platform=<id>")
+    print(f"📈 Metrics: http://localhost:{PORT}/metrics")
     print("🔄 Use this proxy in your web app by updating the corsProxies array")
     print("⚠️  Keep this running alongside your main HTTP server (port 8000)")
     print("\n" + "="*60 + "\n")
     
     try:
-        with socketserver.TCPServer(("", PORT), CORSProxyHandler) as httpd:
+        with BoundedThreadingHTTPServer(("", PORT), CORSProxyHandler,
+                                        max_concurrency=args.max_concurrency) as httpd:
             httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n\n🛑 Proxy server stopped")
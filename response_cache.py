@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Disk-backed HTTP response cache for the CORS proxy
+Directory listings rarely change, so they are kept on disk keyed by the
+normalized target URL. Entries are fresh for a TTL, then revalidated with
+conditional GETs (If-None-Match / If-Modified-Since). Total size is capped
+and the least recently used entries are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'romnix', 'responses')
+
+
+def normalize_url(url):
+    """Canonical form of a URL used as the cache key"""
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    default_port = {'http': 80, 'https': 443}.get(scheme)
+    if parts.port and parts.port != default_port:
+        host = f"{host}:{parts.port}"
+    path = urllib.parse.quote(urllib.parse.unquote(parts.path or '/'), safe='/()-')
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, host, path, query, ''))
+
+
+def fetch_document(upstream, cache, url):
+    """Fetch a whole (small) document through the cache.
+
+    Used by server-side crawls, which need the full listing rather than a
+    relayed stream. Returns the body as text.
+    """
+    cached = cache.lookup(url) if cache else None
+    if cached and cache.is_fresh(cached):
+        try:
+            return cache.read_body(cached).decode('utf-8', errors='replace')
+        except OSError:
+            cached = None
+
+    headers = cache.conditional_headers(cached) if cached else {}
+    try:
+        response = upstream.request(url, headers=headers)
+    except OSError:
+        if cached:
+            return cache.read_body(cached).decode('utf-8', errors='replace')
+        raise
+
+    with response:
+        if response.status == 304 and cached:
+            cache.refresh(cached, response.headers)
+            return cache.read_body(cached).decode('utf-8', errors='replace')
+        writer = cache.writer(url, response) if cache else None
+        try:
+            body = response.read()
+            if writer:
+                writer.write(body)
+                writer.commit()
+        finally:
+            if writer:
+                writer.abort()
+    charset = response.headers.get_content_charset() or 'utf-8'
+    return body.decode(charset, errors='replace')
+
+
+class CacheWriter:
+    """Collects a response body into a temp file while it is being relayed"""
+
+    def __init__(self, cache, key, meta, max_bytes):
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        self.max_bytes = max_bytes
+        self.size = 0
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.directory, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+        self.active = True
+
+    def write(self, data):
+        """Append data; gives up silently once the entry limit is exceeded"""
+        if not self.active:
+            return
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.abort()
+            return
+        self.file.write(data)
+
+    def commit(self):
+        if not self.active:
+            return None
+        self.active = False
+        self.file.close()
+        self.meta['size'] = self.size
+        return self.cache._store(self.key, self.meta, self.temp_path)
+
+    def abort(self):
+        if not self.active:
+            return
+        self.active = False
+        self.file.close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
+
+
+class ResponseCache:
+    """On-disk response cache with TTL, size cap and LRU eviction"""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=24 * 3600,
+                 max_bytes=512 * 1024 * 1024, max_entry_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> meta, least recently used first
+        self.total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _paths(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return base + '.body', base + '.json'
+
+    def _load(self):
+        """Rebuild the in-memory LRU order from the metadata files on disk"""
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                # Left over from an interrupted write
+                os.unlink(path)
+                continue
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                last_used = os.path.getmtime(path)
+            except (OSError, ValueError):
+                continue
+            if os.path.exists(self._paths(meta['key'])[0]):
+                found.append((last_used, meta))
+        for _, meta in sorted(found, key=lambda item: item[0]):
+            self.entries[meta['key']] = meta
+            self.total_bytes += meta.get('size', 0)
+
+    def lookup(self, url):
+        """Return the cached metadata for a URL, marking it recently used"""
+        key = normalize_url(url)
+        with self.lock:
+            meta = self.entries.get(key)
+            if meta is None:
+                return None
+            self.entries.move_to_end(key)
+        _, meta_path = self._paths(key)
+        try:
+            os.utime(meta_path)
+        except OSError:
+            self._remove(key)
+            return None
+        return meta
+
+    def is_fresh(self, meta):
+        return time.time() - meta['stored_at'] < self.ttl
+
+    def conditional_headers(self, meta):
+        """Validators to send when revalidating a stale entry"""
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def can_revalidate(self, meta):
+        return bool(meta.get('etag') or meta.get('last_modified'))
+
+    def refresh(self, meta, headers=None):
+        """Mark an entry fresh again after a 304 Not Modified"""
+        with self.lock:
+            meta['stored_at'] = time.time()
+            if headers is not None:
+                meta['etag'] = headers.get('ETag') or meta.get('etag')
+                meta['last_modified'] = headers.get('Last-Modified') or meta.get('last_modified')
+        self._write_meta(meta)
+
+    def open_body(self, meta):
+        return open(self._paths(meta['key'])[0], 'rb')
+
+    def read_body(self, meta):
+        with self.open_body(meta) as f:
+            return f.read()
+
+    def writer(self, url, response):
+        """Start caching a 200 response, or return None if it isn't cacheable"""
+        if response.status != 200:
+            return None
+        cache_control = (response.headers.get('Cache-Control') or '').lower()
+        if 'no-store' in cache_control:
+            return None
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > self.max_entry_bytes:
+            return None
+        meta = {
+            'key': normalize_url(url),
+            'url': url,
+            'content_type': response.headers.get('Content-Type', 'text/html'),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'stored_at': time.time(),
+        }
+        return CacheWriter(self, meta['key'], meta, self.max_entry_bytes)
+
+    def _store(self, key, meta, temp_path):
+        body_path, _ = self._paths(key)
+        os.replace(temp_path, body_path)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.total_bytes -= old.get('size', 0)
+            self.entries[key] = meta
+            self.total_bytes += meta['size']
+        self._write_meta(meta)
+        self._evict()
+        return meta
+
+    def _write_meta(self, meta):
+        _, meta_path = self._paths(meta['key'])
+        temp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, meta_path)
+
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or len(self.entries) <= 1:
+                    return
+                key = next(iter(self.entries))
+            self._remove(key)
+
+    def _remove(self, key):
+        with self.lock:
+            meta = self.entries.pop(key, None)
+            if meta:
+                self.total_bytes -= meta.get('size', 0)
+        for path in self._paths(key):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
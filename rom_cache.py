@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Content-addressed local ROM cache
+ROM bodies are stored once under their SHA-256, with a small JSON entry per
+source URL recording the blob and the upstream validators (ETag,
+Last-Modified, size). Pushing the same set to a second device then costs
+only the LAN upload. Total size is capped and the least recently used blobs
+are evicted first; blobs that are being uploaded are never evicted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from downloader import response_validators
+from response_cache import normalize_url
+
+DEFAULT_ROM_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'romnix', 'roms')
+
+
+class TeeReader:
+    """Readable wrapper that copies everything read into a cache writer"""
+
+    def __init__(self, source, writer):
+        self.source = source
+        self.writer = writer
+
+    def readinto(self, buffer):
+        count = self.source.readinto(buffer)
+        if count:
+            self.writer.write(memoryview(buffer)[:count])
+        return count
+
+
+class RomCacheWriter:
+    """Collects a ROM into the cache while it is being streamed elsewhere"""
+
+    def __init__(self, cache, url, meta):
+        self.cache = cache
+        self.url = url
+        self.meta = meta
+        self.size = 0
+        self.digest = hashlib.sha256()
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.blob_dir, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+        self.active = True
+
+    def write(self, data):
+        """Append data; gives up silently once the cache budget is exceeded"""
+        if not self.active:
+            return
+        self.size += len(data)
+        if self.size > self.cache.max_bytes:
+            self.abort()
+            return
+        self.file.write(data)
+        self.digest.update(data)
+
+    def commit(self, expected_size=None):
+        if not self.active:
+            return None
+        self.active = False
+        self.file.close()
+        if expected_size is not None and self.size != expected_size:
+            os.unlink(self.temp_path)
+            return None
+        return self.cache._store(self.url, self.meta, self.temp_path, self.digest.hexdigest(), self.size)
+
+    def abort(self):
+        if not self.active:
+            return
+        self.active = False
+        self.file.close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
+
+
+class RomCache:
+    """On-disk ROM store keyed by source URL, deduplicated by content hash"""
+
+    def __init__(self, directory=DEFAULT_ROM_CACHE_DIR, max_bytes=20 * 1024 ** 3, ttl=7 * 24 * 3600):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, 'blobs')
+        self.url_dir = os.path.join(directory, 'urls')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.blobs = OrderedDict()     # sha256 -> size, least recently used first
+        self.total_bytes = 0
+        self.pins = {}                 # sha256 -> number of uploads reading it
+        self.fill_locks = {}
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.url_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for name in os.listdir(self.blob_dir):
+            path = os.path.join(self.blob_dir, name)
+            if name.endswith('.tmp'):
+                # Left over from an interrupted write
+                os.unlink(path)
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, name, stat.st_size))
+        for _, digest, size in sorted(found):
+            self.blobs[digest] = size
+            self.total_bytes += size
+
+    def _entry_path(self, url):
+        return os.path.join(self.url_dir, hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest() + '.json')
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def lookup(self, url):
+        """Cached entry for a URL, or None if it isn't cached (or was evicted)"""
+        try:
+            with open(self._entry_path(url), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            if meta['sha256'] not in self.blobs:
+                meta = None
+        if meta is None:
+            self._unlink(self._entry_path(url))
+        return meta
+
+    def is_fresh(self, meta):
+        return time.time() - meta['stored_at'] < self.ttl
+
+    def conditional_headers(self, meta):
+        """Validators to send when revalidating a stale entry"""
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def matches(self, meta, headers):
+        """True if upstream response headers still describe the cached blob"""
+        length = headers.get('Content-Length')
+        if length and length.isdigit() and int(length) != meta['size']:
+            return False
+        if meta.get('etag') or headers.get('ETag'):
+            return meta.get('etag') == headers.get('ETag')
+        return bool(meta.get('last_modified')) and meta['last_modified'] == headers.get('Last-Modified')
+
+    def refresh(self, meta):
+        """Mark an entry fresh again after upstream confirmed it is unchanged"""
+        meta['stored_at'] = time.time()
+        self._write_entry(meta)
+
+    def forget(self, url):
+        self._unlink(self._entry_path(url))
+
+    def pin(self, meta):
+        """Path of an entry's blob, protected from eviction until release()"""
+        digest = meta['sha256']
+        with self.lock:
+            if digest not in self.blobs:
+                return None
+            self.pins[digest] = self.pins.get(digest, 0) + 1
+            self.blobs.move_to_end(digest)
+        path = self.blob_path(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def release(self, path):
+        """Unpin a path returned by pin() or adopt(); False if it isn't a cache blob"""
+        if os.path.dirname(path) != self.blob_dir:
+            return False
+        digest = os.path.basename(path)
+        with self.lock:
+            if self.pins.get(digest, 0) > 1:
+                self.pins[digest] -= 1
+            else:
+                self.pins.pop(digest, None)
+        return True
+
+    @contextmanager
+    def fill_lock(self, url):
+        """Serialize concurrent misses for one URL so it is fetched only once"""
+        key = normalize_url(url)
+        with self.lock:
+            lock = self.fill_locks.setdefault(key, threading.Lock())
+        with lock:
+            yield
+
+    def writer(self, url, response):
+        """Start caching a full 200 response, or None if it can't be cached"""
+        if response.status != 200:
+            return None
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            return None
+        return RomCacheWriter(self, url, response_validators(response.headers))
+
+    def adopt(self, url, path, validators):
+        """Move a fully downloaded file into the cache.
+
+        Returns the blob's path, pinned as by pin(), or None if the file is
+        too big to cache (it is then left where it was).
+        """
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            return None
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        fd, temp_path = tempfile.mkstemp(dir=self.blob_dir, suffix='.tmp')
+        os.close(fd)
+        shutil.move(path, temp_path)
+        meta = self._store(url, dict(validators), temp_path, digest.hexdigest(), size, pin=True)
+        return self.blob_path(meta['sha256'])
+
+    def _store(self, url, meta, temp_path, digest, size, pin=False):
+        blob_path = self.blob_path(digest)
+        with self.lock:
+            known = digest in self.blobs
+            if not known:
+                self.blobs[digest] = size
+                self.total_bytes += size
+            self.blobs.move_to_end(digest)
+            if pin:
+                self.pins[digest] = self.pins.get(digest, 0) + 1
+        if known:
+            # Same content under another URL (or a refetch): keep one copy
+            os.unlink(temp_path)
+        else:
+            os.replace(temp_path, blob_path)
+        meta.update({'url': url, 'sha256': digest, 'size': size, 'stored_at': time.time()})
+        self._write_entry(meta)
+        self._evict()
+        return meta
+
+    def _write_entry(self, meta):
+        path = self._entry_path(meta['url'])
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, path)
+
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes:
+                    return
+                victim = next((digest for digest in self.blobs if digest not in self.pins), None)
+                if victim is None:
+                    return
+                self.total_bytes -= self.blobs.pop(victim)
+                # Unlinked under the lock so a concurrent _store() can't re-add it first;
+                # URL entries pointing at the blob are dropped lazily by lookup()
+                self._unlink(self.blob_path(victim))
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
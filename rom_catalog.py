@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Persistent searchable ROM catalog
+Holds every indexed ROM for all registered platforms in SQLite, with an
+FTS5 trigram index for substring search when the SQLite build supports it.
+Platforms are synced incrementally from the crawler's index and can be
+refreshed in the background.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'romnix', 'catalog.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS platforms (
+    id TEXT PRIMARY KEY,
+    archive_url TEXT NOT NULL,
+    extensions TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    indexed_at INTEGER NOT NULL DEFAULT 0,
+    refreshed_at REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS roms (
+    id INTEGER PRIMARY KEY,
+    platform TEXT NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    UNIQUE (platform, url)
+);
+CREATE INDEX IF NOT EXISTS roms_name ON roms (name COLLATE NOCASE);
+'''
+
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS roms_fts USING fts5(
+    name, content='roms', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS roms_fts_insert AFTER INSERT ON roms BEGIN
+    INSERT INTO roms_fts (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS roms_fts_delete AFTER DELETE ON roms BEGIN
+    INSERT INTO roms_fts (roms_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS roms_fts_update AFTER UPDATE OF name ON roms BEGIN
+    INSERT INTO roms_fts (roms_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO roms_fts (rowid, name) VALUES (new.id, new.name);
+END;
+'''
+
+# Trigram FTS can only match terms of at least three characters
+MIN_FTS_QUERY = 3
+
+
+class RomCatalog:
+    """SQLite-backed catalog of ROM entries across all platforms"""
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite older than 3.34 or built without FTS5: fall back to LIKE
+            self.has_fts = False
+        conn.commit()
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def register_platform(self, platform_id, archive_url, extensions, depth):
+        """Record (or update) where a platform's ROMs are crawled from"""
+        conn = self._connect()
+        with self.write_lock, conn:
+            row = conn.execute('SELECT archive_url, extensions, depth FROM platforms WHERE id = ?',
+                               (platform_id,)).fetchone()
+            config = (archive_url, ','.join(sorted(extensions)), depth)
+            if row is None:
+                conn.execute('INSERT INTO platforms (id, archive_url, extensions, depth) VALUES (?, ?, ?, ?)',
+                             (platform_id, *config))
+            elif tuple(row) != config:
+                # Source changed: force the next sync to replace everything
+                conn.execute('UPDATE platforms SET archive_url = ?, extensions = ?, depth = ?, '
+                             'indexed_at = 0 WHERE id = ?', (*config, platform_id))
+
+    def platforms(self):
+        conn = self._connect()
+        return [dict(row) for row in conn.execute('SELECT * FROM platforms ORDER BY id')]
+
+    def sync_platform(self, platform_id, index):
+        """Apply a crawler index to the catalog, touching only what changed.
+
+        Rows missing from the index are only removed when the crawl was
+        complete; a partial crawl just adds and updates, and an empty one
+        is ignored while the platform still has rows. Returns (added,
+        updated, removed), or None if nothing was applied.
+        """
+        conn = self._connect()
+        with self.write_lock, conn:
+            row = conn.execute('SELECT indexed_at FROM platforms WHERE id = ?', (platform_id,)).fetchone()
+            if row is not None and row['indexed_at'] == index['crawledAt']:
+                conn.execute('UPDATE platforms SET refreshed_at = ? WHERE id = ?', (time.time(), platform_id))
+                return None
+
+            existing = {r['url']: r for r in conn.execute(
+                'SELECT id, url, name, size, mtime FROM roms WHERE platform = ?', (platform_id,))}
+            complete = not index.get('errors')
+            if existing and not index['entries']:
+                print(f"⚠️  Catalog {platform_id}: crawl found no ROMs, keeping the {len(existing)} listed")
+                return None
+            inserts, updates = [], []
+            for entry in index['entries']:
+                current = existing.pop(entry['url'], None)
+                if current is None:
+                    inserts.append((platform_id, entry['name'], entry['url'], entry['size'], entry['mtime']))
+                elif (current['name'], current['size'], current['mtime']) != (entry['name'], entry['size'], entry['mtime']):
+                    updates.append((entry['name'], entry['size'], entry['mtime'], current['id']))
+            conn.executemany('INSERT INTO roms (platform, name, url, size, mtime) VALUES (?, ?, ?, ?, ?)', inserts)
+            conn.executemany('UPDATE roms SET name = ?, size = ?, mtime = ? WHERE id = ?', updates)
+            if not complete:
+                # Unlisted rows may just sit in a directory that failed; retry on the next refresh
+                print(f"⚠️  Catalog {platform_id}: {len(index['errors'])} directories failed to crawl, "
+                      f"not removing any ROMs")
+                return len(inserts), len(updates), 0
+            conn.executemany('DELETE FROM roms WHERE id = ?', [(r['id'],) for r in existing.values()])
+            conn.execute('UPDATE platforms SET indexed_at = ?, refreshed_at = ? WHERE id = ?',
+                         (index['crawledAt'], time.time(), platform_id))
+        return len(inserts), len(updates), len(existing)
+
+    def search(self, query='', platforms=None, page=1, limit=100):
+        """Case-insensitive substring search; returns (total, rows)"""
+        query = (query or '').strip()
+        clauses, params = [], []
+
+        if query and self.has_fts and len(query) >= MIN_FTS_QUERY:
+            # Resolve the FTS match first so the planner doesn't probe it per row
+            clauses.append('r.id IN (SELECT rowid FROM roms_fts WHERE roms_fts MATCH ?)')
+            params.append('"' + query.replace('"', '""') + '"')
+        elif query:
+            escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("r.name LIKE ? ESCAPE '\\'")
+            params.append(f'%{escaped}%')
+
+        if platforms:
+            clauses.append(f"r.platform IN ({','.join('?' * len(platforms))})")
+            params.extend(platforms)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        conn = self._connect()
+        total = conn.execute(f'SELECT COUNT(*) FROM roms r {where}', params).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT r.platform, r.name, r.url, r.size, r.mtime FROM roms r {where} '
+            f'ORDER BY r.name COLLATE NOCASE LIMIT ? OFFSET ?',
+            (*params, limit, (page - 1) * limit)).fetchall()
+        return total, [dict(row) for row in rows]
+
+
+class CatalogRefresher(threading.Thread):
+    """Background thread that re-crawls registered platforms periodically.
+
+    Re-crawls go through the response cache, so listings that haven't
+    changed upstream cost a conditional GET (or nothing while still fresh).
+    """
+
+    def __init__(self, catalog, indexer, interval=6 * 3600):
+        super().__init__(daemon=True, name='catalog-refresher')
+        self.catalog = catalog
+        self.indexer = indexer
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(min(self.interval, 300)):
+            for platform in self.catalog.platforms():
+                if time.time() - platform['refreshed_at'] < self.interval:
+                    continue
+                try:
+                    index = self.indexer.get_index(platform['archive_url'], platform['extensions'].split(','),
+                                                   platform['depth'], refresh=True)
+                    if index.get('errors'):
+                        print(f"✗ Catalog refresh for {platform['id']} incomplete "
+                              f"({len(index['errors'])} directories failed), skipping sync")
+                        continue
+                    changes = self.catalog.sync_platform(platform['id'], index)
+                    if changes:
+                        print(f"🔄 Catalog {platform['id']}: +{changes[0]} ~{changes[1]} -{changes[2]}")
+                except Exception as e:
+                    print(f"✗ Catalog refresh failed for {platform['id']}: {e}")
+
+    def stop(self):
+        self.stopped.set()
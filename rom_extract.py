@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Host-side archive extraction
+Most platforms are offered as .zip or .7z, but some device cores need the
+bare ROM and unpacking on a handheld is slow. Archives for platforms that
+want it are unpacked here instead, in a process pool so decompression never
+holds up the request threads. Members are decompressed as streams, chunk by
+chunk, so large disc images are never held in memory.
+"""
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_EXTRACT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'romnix', 'extract')
+
+# Platforms (as the web app names them) whose archives are unpacked before
+# upload by default. Cartridge cores load zipped ROMs directly; disc-based
+# systems need the image files.
+DEFAULT_EXTRACT_PLATFORMS = {'segacd', 'sega cd', 'saturn', 'sega saturn', 'playstation', 'psx', 'dreamcast'}
+
+# Leftover extraction directories older than this are removed at startup
+STALE_EXTRACT_AGE = 24 * 3600
+
+
+def seven_zip_binary():
+    """Path of a 7-Zip command line tool, or None if none is installed"""
+    for name in ('7z', '7za', '7zr'):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def safe_member_path(name):
+    """Relative path for an archive member, or None if it would escape the target"""
+    path = os.path.normpath(name.replace('\\', '/'))
+    if os.path.isabs(path) or path == '.' or path.split(os.sep)[0] == '..':
+        return None
+    return path
+
+
+def extract_archive(archive_path, dest_dir, seven_zip=None, chunk_size=1024 * 1024):
+    """Unpack archive_path into dest_dir; returns [(relative_path, size)].
+
+    Runs in a worker process. Zip members are streamed out with zipfile;
+    7z archives are handed to the 7-Zip binary.
+    """
+    if zipfile.is_zipfile(archive_path):
+        members = []
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                relative_path = safe_member_path(info.filename)
+                if info.is_dir() or relative_path is None:
+                    continue
+                target = os.path.join(dest_dir, relative_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with archive.open(info) as source, open(target, 'wb') as output:
+                    shutil.copyfileobj(source, output, chunk_size)
+                members.append((relative_path, os.path.getsize(target)))
+        return members
+
+    if seven_zip is None:
+        raise ValueError(f"{os.path.basename(archive_path)} is not a zip archive and 7-Zip isn't installed")
+    result = subprocess.run([seven_zip, 'x', '-y', '-bd', f'-o{dest_dir}', archive_path],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise ValueError(result.stderr.strip() or result.stdout.strip().splitlines()[-1])
+    members = []
+    for root, _, files in os.walk(dest_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            members.append((os.path.relpath(path, dest_dir), os.path.getsize(path)))
+    return sorted(members)
+
+
+class ArchiveExtractor:
+    """Decides which ROM archives to unpack and unpacks them off-thread"""
+
+    def __init__(self, platforms=DEFAULT_EXTRACT_PLATFORMS, workers=2, directory=DEFAULT_EXTRACT_DIR):
+        # A set of platform names, or None to extract for every platform
+        self.platforms = platforms
+        self.directory = directory
+        self.seven_zip = seven_zip_binary()
+        # Forking a threaded server is unsafe, so workers are spawned fresh
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        # Submitted extractions, so shutdown() can cancel the ones not started yet
+        self.pending = set()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale()
+
+    def wants(self, rom_name, platform, requested=None):
+        """True if rom_name is an archive that should be unpacked before upload.
+
+        requested is a per-request override; None falls back to the
+        platform policy.
+        """
+        ext = os.path.splitext(rom_name)[1].lower()
+        if ext != '.zip' and not (ext == '.7z' and self.seven_zip):
+            return False
+        if requested is not None:
+            return bool(requested)
+        return self.platforms is None or platform in self.platforms
+
+    def extract(self, archive_path):
+        """Unpack an archive; returns (directory, [(relative_path, size)]).
+
+        The caller removes the directory with cleanup() when done.
+        """
+        dest_dir = tempfile.mkdtemp(dir=self.directory)
+        try:
+            future = self.pool.submit(extract_archive, archive_path, dest_dir, self.seven_zip)
+            with self.lock:
+                self.pending.add(future)
+            try:
+                members = future.result()
+            finally:
+                with self.lock:
+                    self.pending.discard(future)
+        except BaseException:
+            self.cleanup(dest_dir)
+            raise
+        if not members:
+            self.cleanup(dest_dir)
+            raise ValueError("archive is empty")
+        return dest_dir, members
+
+    def cleanup(self, dest_dir):
+        shutil.rmtree(dest_dir, ignore_errors=True)
+
+    def shutdown(self):
+        # shutdown(cancel_futures=True) needs Python 3.9
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+        self.pool.shutdown(wait=False)
+
+    def _remove_stale(self):
+        cutoff = time.time() - STALE_EXTRACT_AGE
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Server-side directory crawler and persistent ROM index
+Crawls an archive directory listing (and its subdirectories) with bounded
+parallelism, keeps the links that match a platform's extensions and stores
+the result as a compact JSON index so later searches don't touch upstream.
+"""
+
+import calendar
+import hashlib
+import html
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from response_cache import normalize_url
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'romnix', 'indexes')
+
+LINK_REGEX = re.compile(r'<a\s+[^>]*href="([^"]+)"', re.IGNORECASE)
+TAG_REGEX = re.compile(r'<[^>]+>')
+ROW_SPLIT_REGEX = re.compile(r'<tr[\s>]', re.IGNORECASE)
+ISO_DATE_REGEX = re.compile(r'(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}(?::\d{2})?)')
+APACHE_DATE_REGEX = re.compile(r'(\d{1,2}-[A-Za-z]{3}-\d{4}) (\d{2}:\d{2}(?::\d{2})?)')
+SIZE_REGEX = re.compile(r'(?<![\w.:-])(\d+(?:\.\d+)?)\s*(bytes|B|[KMGT](?:i?B)?)?(?![\w.:-])')
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# File extensions that are never directories, even with a trailing slash
+ROM_EXTENSIONS = ('zip', '7z', 'nes', 'smc', 'md', 'gb', 'gbc', 'gba', 'gen', 'sfc', 'rar')
+
+# Navigation/system directories that won't contain ROMs
+NAVIGATION_PATHS = {
+    'about', 'donate', 'help', 'contact', 'terms', 'privacy',
+    'blog', 'news', 'support', 'login', 'register', 'account',
+    'api', 'admin', 'assets', 'css', 'js', 'images', 'img',
+    'static', 'public', 'common', 'shared', 'lib', 'libraries'
+}
+
+
+def parse_size(text):
+    """Size in bytes of the last size-like token in a listing row"""
+    matches = SIZE_REGEX.findall(text)
+    if not matches:
+        return None
+    number, unit = matches[-1]
+    unit = unit.upper()
+    multiplier = 1 if unit in ('', 'B', 'BYTES') else SIZE_UNITS[unit[0]]
+    return int(float(number) * multiplier)
+
+
+def parse_mtime(text):
+    """Return (epoch seconds, text without the date) for a listing row"""
+    match = ISO_DATE_REGEX.search(text)
+    formats = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M')
+    if not match:
+        match = APACHE_DATE_REGEX.search(text)
+        formats = ('%d-%b-%Y %H:%M:%S', '%d-%b-%Y %H:%M')
+    if not match:
+        return None, text
+    stamp = f"{match.group(1)} {match.group(2)}"
+    remainder = text[:match.start()] + ' ' + text[match.end():]
+    for fmt in formats:
+        try:
+            return calendar.timegm(time.strptime(stamp, fmt)), remainder
+        except ValueError:
+            continue
+    return None, remainder
+
+
+def is_candidate_link(href):
+    """Same navigation filtering the browser applies to listing links"""
+    if not href or href.startswith(('#', 'mailto:', '?')) or 'change.org' in href:
+        return False
+    if href == '/' or href.startswith('../'):
+        return False
+    lower = href.lower()
+    if href.startswith('/') and '.zip' not in lower and '.7z' not in lower and not href.endswith('/'):
+        return False
+    if href.startswith(('http://', 'https://')) and 'archive.org/download' not in href:
+        return False
+    if '/details/' in href or '/search/' in href or '/account/' in href:
+        return False
+    return True
+
+
+def is_directory_link(href):
+    if not href.endswith('/') or href.startswith(('http://', 'https://')):
+        return False
+    clean = href.rstrip('/').lower()
+    if any(clean.endswith('.' + ext) for ext in ROM_EXTENSIONS):
+        return False
+    return href.lower().replace('/', '') not in NAVIGATION_PATHS
+
+
+def parse_listing(document, base_url, extensions):
+    """Extract matching files and subdirectories from a listing page.
+
+    Returns (files, directories) where files are dicts with name, url,
+    size and mtime (size/mtime are None when the listing doesn't show them).
+    """
+    base = base_url.rstrip('/') + '/'
+    rows = ROW_SPLIT_REGEX.split(document) if ROW_SPLIT_REGEX.search(document) else document.splitlines()
+    suffixes = tuple('.' + ext.lower() for ext in extensions)
+
+    files, directories, seen = [], [], set()
+    for row in rows:
+        hrefs = LINK_REGEX.findall(row)
+        if not hrefs:
+            continue
+        # Size and date columns follow the last link in the row
+        tail = html.unescape(TAG_REGEX.sub(' ', row[row.lower().rfind('</a>'):]))
+        mtime, tail = parse_mtime(tail)
+        size = parse_size(tail)
+
+        for href in hrefs:
+            href = html.unescape(href)
+            if not is_candidate_link(href):
+                continue
+            if is_directory_link(href):
+                url = urllib.parse.urljoin(base, href)
+                if url not in seen:
+                    seen.add(url)
+                    directories.append(url)
+                continue
+            clean = href.rstrip('/')
+            if not clean.lower().endswith(suffixes):
+                continue
+            url = urllib.parse.urljoin(base, clean)
+            if url in seen:
+                continue
+            seen.add(url)
+            name = urllib.parse.unquote(clean.split('/')[-1])
+            files.append({'name': name, 'url': url, 'size': size, 'mtime': mtime})
+    return files, directories
+
+
+class RomIndexer:
+    """Crawls archive listings and persists one JSON index per configuration"""
+
+    def __init__(self, fetch_text, directory=DEFAULT_INDEX_DIR, max_workers=4,
+                 max_age=7 * 24 * 3600, max_depth=4):
+        self.fetch_text = fetch_text
+        self.directory = directory
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.crawl_locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def index_path(self, archive_url, extensions, depth):
+        key = '|'.join((normalize_url(archive_url), ','.join(sorted(extensions)), str(depth)))
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, archive_url, extensions, depth):
+        try:
+            with open(self.index_path(archive_url, extensions, depth), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_index(self, archive_url, extensions, depth=2, refresh=False):
+        """Return the stored index, crawling upstream if missing or too old.
+
+        Only complete crawls are stored. If the crawl fails or misses
+        directories, the previous index is returned as long as there is one;
+        otherwise a root failure raises and a partial index comes back with
+        its 'errors' filled in.
+        """
+        extensions = sorted({ext.lower().lstrip('.') for ext in extensions if ext})
+        depth = max(1, min(depth, self.max_depth))
+        path = self.index_path(archive_url, extensions, depth)
+
+        with self.lock:
+            crawl_lock = self.crawl_locks.setdefault(path, threading.Lock())
+
+        # Concurrent requests for the same index share a single crawl
+        with crawl_lock:
+            previous = self.load(archive_url, extensions, depth)
+            if previous and not refresh and time.time() - previous['crawledAt'] < self.max_age:
+                return previous
+            try:
+                index = self.crawl(archive_url, extensions, depth)
+            except Exception as e:
+                if previous is None:
+                    raise
+                print(f"⚠️  Crawl of {archive_url} failed ({e}), serving the index from "
+                      f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(previous['crawledAt']))}")
+                return previous
+            if index['errors']:
+                # An incomplete crawl is never stored; it would hide ROMs for max_age
+                if previous is not None:
+                    print(f"⚠️  {len(index['errors'])} directories of {archive_url} failed, "
+                          f"keeping the previous index")
+                    return previous
+                return index
+            self._save(path, index)
+            return index
+
+    def crawl(self, archive_url, extensions, depth):
+        """Crawl a listing tree; raises if the top listing can't be fetched.
+
+        Subdirectories that fail are recorded in the index's 'errors' (url
+        and message) instead, so callers can tell a partial crawl apart.
+        """
+        start = archive_url.rstrip('/') + '/'
+        print(f"🕷️  Crawling {start} (depth {depth}, {len(extensions)} extensions)")
+        started = time.time()
+
+        # The root listing is fetched here so its failure propagates
+        root_files, root_directories = parse_listing(self.fetch_text(start), start, extensions)
+        entries, seen_files, errors = [], set(), []
+        visited = {start.rstrip('/')}
+        level = [start]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for remaining in range(depth, 0, -1):
+                next_level = []
+                results = [(root_files, root_directories, None)] if remaining == depth else \
+                    executor.map(lambda url: self._crawl_one(url, extensions), level)
+                for url, (files, directories, error) in zip(level, results):
+                    if error:
+                        errors.append({'url': url, 'error': error})
+                        continue
+                    for entry in files:
+                        if entry['url'] not in seen_files:
+                            seen_files.add(entry['url'])
+                            entries.append(entry)
+                    if remaining > 1:
+                        for directory in directories:
+                            if directory.rstrip('/') not in visited:
+                                visited.add(directory.rstrip('/'))
+                                next_level.append(directory)
+                level = next_level
+                if not level:
+                    break
+
+        print(f"✓ Indexed {len(entries)} ROMs from {len(visited)} directories in {time.time() - started:.1f}s"
+              + (f" ({len(errors)} failed)" if errors else ""))
+        return {
+            'url': start,
+            'extensions': extensions,
+            'depth': depth,
+            'crawledAt': int(time.time()),
+            'count': len(entries),
+            'entries': entries,
+            'errors': errors,
+        }
+
+    def _crawl_one(self, url, extensions):
+        try:
+            document = self.fetch_text(url)
+        except Exception as e:
+            print(f"✗ Crawl failed for {url}: {e}")
+            return [], [], str(e)
+        files, directories = parse_listing(document, url, extensions)
+        return files, directories, None
+
+    def _save(self, path, index):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(temp_path, path)
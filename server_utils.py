@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP server helpers for the ROM Downloader services
+"""
+
+import threading
+from http.server import ThreadingHTTPServer
+
+
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    """Thread-per-request HTTP server with a cap on concurrent requests.
+
+    When every slot is busy the accept loop waits, so excess clients queue
+    in the listen backlog instead of spawning unbounded threads.
+    """
+
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, server_address, handler_class, max_concurrency=32,
+                 bind_and_activate=True):
+        self.max_concurrency = max_concurrency
+        self.request_slots = threading.BoundedSemaphore(max_concurrency)
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+    def process_request(self, request, client_address):
+        self.request_slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self.request_slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.request_slots.release()
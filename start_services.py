@@ -2,52 +2,216 @@
 """
 Service Orchestrator for ROM Downloader Web
 Starts all necessary services for the web application
+
+By default the proxy and the transfer service run as child processes. With
+--unified all three services run in this process instead: one asyncio loop
+accepts connections on every port and hands them to the services' request
+handlers on a shared worker pool.
 """
 
 import os
 import sys
 import time
 import signal
+import socket
+import asyncio
+import argparse
 import threading
 import subprocess
 import http.server
-import socketserver
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from server_utils import BoundedThreadingHTTPServer
+from static_assets import StaticAssetStore, brotli, choose_encoding
+
+FRONTEND_PORT = 8000
+PROXY_PORT = 8001
+TRANSFER_PORT = 8002
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class FrontendHandler(http.server.SimpleHTTPRequestHandler):
+    # StaticAssetStore with the app's precompressed files; None serves everything from disk
+    assets = None
+    # Keep-alive saves a handshake per asset over forwarded ports
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive clients give up their request slot after this long
+    timeout = 15
+    
+    def do_GET(self):
+        if not self.send_asset():
+            super().do_GET()
+    
+    def do_HEAD(self):
+        if not self.send_asset(head=True):
+            super().do_HEAD()
+    
+    def send_asset(self, head=False):
+        """Serve a file from the asset store; False if it isn't one of them"""
+        if self.assets is None:
+            return False
+        path = self.translate_path(self.path)
+        if urlsplit(self.path).path.endswith('/'):
+            path = os.path.join(path, 'index.html')
+        asset = self.assets.get(path)
+        if asset is None:
+            return False
+        
+        encoding = choose_encoding(self.headers.get('Accept-Encoding'), asset.variants)
+        body, etag = asset.variants[encoding]
+        if_none_match = self.headers.get('If-None-Match', '')
+        client_tags = {tag[2:] if tag.startswith('W/') else tag
+                       for tag in (tag.strip() for tag in if_none_match.split(','))}
+        if etag in client_tags or '*' in client_tags:
+            self.send_response(304)
+            self.send_validators(etag)
+            self.end_headers()
+            return True
+        
+        self.send_response(200)
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Last-Modified', self.date_time_string(asset.mtime))
+        self.send_validators(etag)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+        return True
+    
+    def send_validators(self, etag):
+        self.send_header('ETag', etag)
+        # Unversioned file names: always revalidate, which costs a 304 when nothing changed
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+    
+    def end_headers(self):
+        # Add CORS headers for development
+        self.send_header('Cross-Origin-Embedder-Policy', 'require-corp')
+        self.send_header('Cross-Origin-Opener-Policy', 'same-origin')
+        super().end_headers()
+        
+    def log_message(self, format, *args):
+        # Suppress verbose logging
+        pass
+
+def wait_for_port(port, process=None, timeout=15, host='127.0.0.1'):
+    """True once something accepts connections on port.
+    
+    Gives up when time runs out or when process (if given) exits.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection((host, port), timeout=0.2):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+class UnifiedRuntime:
+    """Serves several handler classes from one process.
+    
+    A single asyncio loop owns the listening sockets and accepts
+    connections; each connection then runs its service's ordinary request
+    handler on a worker thread, because the handlers and the SSH and HTTP
+    clients under them are blocking code.
+    """
+    
+    def __init__(self, routes, max_workers=64):
+        # routes: [(host, port, handler_class)]
+        self.routes = routes
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='request')
+        self.sockets = []
+        # Connections handed to the executor, so close() can cancel the ones not started yet
+        self.pending = set()
+        self.lock = threading.Lock()
+    
+    def bind(self):
+        """Open every listening socket; raises OSError if a port is taken"""
+        for host, port, _ in self.routes:
+            sock = socket.create_server((host, port), backlog=64)
+            sock.setblocking(False)
+            self.sockets.append(sock)
+    
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(self._accept_loop(loop, sock, handler_class)
+                               for sock, (_, _, handler_class) in zip(self.sockets, self.routes)))
+    
+    async def _accept_loop(self, loop, sock, handler_class):
+        host, port = sock.getsockname()[:2]
+        server = SimpleNamespace(server_address=(host, port), server_name=host, server_port=port)
+        while True:
+            conn, address = await loop.sock_accept(sock)
+            conn.setblocking(True)
+            future = self.executor.submit(self._handle, conn, address, handler_class, server)
+            with self.lock:
+                self.pending.add(future)
+            future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+    
+    def _handle(self, conn, address, handler_class, server):
+        try:
+            handler_class(conn, address, server)
+        except Exception as e:
+            print(f"❌ Error handling request from {address[0]}: {e}")
+        finally:
+            with suppress(OSError):
+                conn.shutdown(socket.SHUT_WR)
+            conn.close()
+    
+    def close(self):
+        for sock in self.sockets:
+            sock.close()
+        # shutdown(cancel_futures=True) needs Python 3.9
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+        self.executor.shutdown(wait=False)
 
 class ServiceOrchestrator:
     def __init__(self):
         self.processes = []
         self.frontend_server = None
+        self.runtime = None
+        self.engine = None
         
+    def load_assets(self):
+        """Precompress the app's static files for the frontend handler"""
+        FrontendHandler.assets = StaticAssetStore(APP_DIR)
+        encodings = 'gzip and brotli' if brotli else 'gzip'
+        print(f"🗜️  Prepared {len(FrontendHandler.assets.assets)} static assets with {encodings} "
+              f"({FrontendHandler.assets.total_bytes() / 1024:.0f} KB in memory)")
+    
     def start_frontend_server(self):
         """Start the frontend HTTP server"""
-        print("🌐 Starting Frontend Server on port 8000...")
+        print(f"🌐 Starting Frontend Server on port {FRONTEND_PORT}...")
+        self.load_assets()
         os.chdir('/workspaces' if os.path.exists('/workspaces') else '.')
         
-        class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-            def end_headers(self):
-                # Add CORS headers for development
-                self.send_header('Cross-Origin-Embedder-Policy', 'require-corp')
-                self.send_header('Cross-Origin-Opener-Policy', 'same-origin')
-                super().end_headers()
-                
-            def log_message(self, format, *args):
-                # Suppress verbose logging
-                pass
-        
         try:
-            self.frontend_server = socketserver.TCPServer(("", 8000), CustomHTTPRequestHandler)
+            self.frontend_server = BoundedThreadingHTTPServer(("", FRONTEND_PORT), FrontendHandler)
             self.frontend_server.serve_forever()
         except Exception as e:
             print(f"❌ Frontend server error: {e}")
     
     def start_proxy_server(self):
         """Start the CORS proxy server"""
-        print("🔧 Starting CORS Proxy Server on port 8001...")
+        print(f"🔧 Starting CORS Proxy Server on port {PROXY_PORT}...")
         try:
-            process = subprocess.Popen([
-                sys.executable, 'proxy_server.py'
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # Output goes straight to this terminal; an undrained pipe would stall the child
+            process = subprocess.Popen([sys.executable, 'proxy_server.py', '--port', str(PROXY_PORT)])
             self.processes.append(process)
             return process
         except Exception as e:
@@ -56,11 +220,9 @@ class ServiceOrchestrator:
     
     def start_transfer_service(self):
         """Start the ROM transfer service"""
-        print("📡 Starting ROM Transfer Service on port 8002...")
+        print(f"📡 Starting ROM Transfer Service on port {TRANSFER_PORT}...")
         try:
-            process = subprocess.Popen([
-                sys.executable, 'transfer_service.py'
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            process = subprocess.Popen([sys.executable, 'transfer_service.py', '--port', str(TRANSFER_PORT)])
             self.processes.append(process)
             return process
         except Exception as e:
@@ -101,9 +263,16 @@ class ServiceOrchestrator:
         
         # Stop frontend server
         if self.frontend_server:
-            self.frontend_server.shutdown()
+            # The signal handler runs on the serve_forever() thread, where
+            # shutdown() would wait on itself; closing the socket is enough
             self.frontend_server.server_close()
         
+        # Stop the in-process services of unified mode
+        if self.runtime:
+            self.runtime.close()
+        if self.engine:
+            self.engine.close()
+        
         # Stop other processes
         for process in self.processes:
             with suppress(Exception):
@@ -122,28 +291,82 @@ class ServiceOrchestrator:
         self.setup_signal_handlers()
         
         # Start background services
+        started = time.monotonic()
         proxy_process = self.start_proxy_server()
         transfer_process = self.start_transfer_service()
         
-        # Wait a moment for services to start
-        time.sleep(2)
-        
-        # Check if services started successfully
+        # Ready means the port accepts connections, not that some time has passed
         services_status = []
-        if proxy_process and proxy_process.poll() is None:
-            services_status.append("✅ CORS Proxy (port 8001)")
+        if proxy_process and wait_for_port(PROXY_PORT, proxy_process):
+            services_status.append(f"✅ CORS Proxy (port {PROXY_PORT})")
         else:
-            services_status.append("❌ CORS Proxy (port 8001)")
+            services_status.append(f"❌ CORS Proxy (port {PROXY_PORT})")
             
-        if transfer_process and transfer_process.poll() is None:
-            services_status.append("✅ Transfer Service (port 8002)")
+        if transfer_process and wait_for_port(TRANSFER_PORT, transfer_process):
+            services_status.append(f"✅ Transfer Service (port {TRANSFER_PORT})")
         else:
-            services_status.append("❌ Transfer Service (port 8002)")
+            services_status.append(f"❌ Transfer Service (port {TRANSFER_PORT})")
         
-        print("\n📊 Service Status:")
+        print(f"\n📊 Service Status (ready in {time.monotonic() - started:.1f}s):")
         for status in services_status:
             print(f"   {status}")
         
+        self.print_banner()
+        
+        # Start frontend server (blocking)
+        try:
+            self.start_frontend_server()
+        except KeyboardInterrupt:
+            self.shutdown()
+    
+    def start_unified(self, max_workers=64):
+        """Run frontend, proxy and transfer service in this process"""
+        print("🚀 ROM Downloader Web - Unified Runtime")
+        print("=" * 60)
+        self.check_dependencies()
+        self.setup_signal_handlers()
+        self.load_assets()
+        os.chdir('/workspaces' if os.path.exists('/workspaces') else '.')
+        
+        import proxy_server
+        import transfer_service
+        from upstream_pool import UpstreamPool
+        
+        started = time.monotonic()
+        proxy_args = proxy_server.build_parser().parse_args([])
+        transfer_args = transfer_service.build_parser().parse_args([])
+        # One keep-alive pool for listings, proxied downloads and transfers alike
+        upstream = UpstreamPool(max_per_host=max(proxy_args.per_host_limit, transfer_args.per_host_limit),
+                                idle_timeout=proxy_args.upstream_idle_timeout)
+        proxy_server.configure(proxy_args, upstream)
+        self.engine = transfer_service.configure(transfer_args, upstream)
+        # The proxy hands out ROMs the transfer service already downloaded
+        proxy_server.CORSProxyHandler.rom_cache = self.engine.rom_cache
+        
+        self.runtime = UnifiedRuntime([
+            ('', FRONTEND_PORT, FrontendHandler),
+            ('', PROXY_PORT, proxy_server.CORSProxyHandler),
+            ('localhost', TRANSFER_PORT, transfer_service.TransferHandler),
+        ], max_workers=max_workers)
+        try:
+            self.runtime.bind()
+        except OSError as e:
+            print(f"❌ Couldn't open service ports: {e}")
+            self.shutdown()
+            sys.exit(1)
+        
+        print(f"\n📊 Service Status (ready in {time.monotonic() - started:.1f}s):")
+        for name, port in (("Frontend", FRONTEND_PORT), ("CORS Proxy", PROXY_PORT),
+                           ("Transfer Service", TRANSFER_PORT)):
+            print(f"   ✅ {name} (port {port})")
+        self.print_banner()
+        
+        try:
+            asyncio.run(self.runtime.serve())
+        except KeyboardInterrupt:
+            self.shutdown()
+    
+    def print_banner(self):
         print(f"\n🌐 Frontend will be available at:")
         print(f"   • Local: http://localhost:8000")
         print(f"   • Codespaces: https://<codespace-name>-8000.github.dev")
@@ -153,17 +376,21 @@ class ServiceOrchestrator:
         print(f"   • You can connect to devices on your local network")
         print(f"   • Use port forwarding for local device access")
         print("\n" + "=" * 60)
-        
-        # Start frontend server (blocking)
-        try:
-            self.start_frontend_server()
-        except KeyboardInterrupt:
-            self.shutdown()
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="Start the ROM Downloader Web services")
+    parser.add_argument('--unified', action='store_true',
+                        help="run frontend, proxy and transfer service in one process")
+    parser.add_argument('--max-workers', type=int, default=64,
+                        help="request threads shared by all services in unified mode")
+    args = parser.parse_args()
+    
     orchestrator = ServiceOrchestrator()
-    orchestrator.start_all_services()
+    if args.unified:
+        orchestrator.start_unified(args.max_workers)
+    else:
+        orchestrator.start_all_services()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+In-memory static assets for the frontend server
+The web app's text assets are read once at startup and compressed with gzip
+(and brotli, when the brotli module is installed) so a request only picks a
+prepared variant. Every variant carries a strong ETag, which lets a reload
+over a slow forwarded port finish with 304s instead of full transfers.
+Files edited on disk are picked up on the next request.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.html', '.js', '.css', '.json', '.svg', '.webmanifest'}
+
+# Bigger files are left to the plain file handler
+MAX_ASSET_BYTES = 8 * 1024 * 1024
+
+# Preferred order when the client accepts several encodings equally
+ENCODINGS = ('br', 'gzip', 'identity')
+
+
+def accepted_encodings(header):
+    """Encodings a client accepts, mapped to their q-values"""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def choose_encoding(header, available):
+    """Best of the available encodings for an Accept-Encoding header"""
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get('*')
+
+    def quality(coding):
+        if coding in accepted:
+            return accepted[coding]
+        if wildcard is not None:
+            return wildcard
+        # identity is acceptable unless refused, but only as a last resort
+        return 0.001 if coding == 'identity' else 0.0
+
+    ranked = [coding for coding in ENCODINGS if coding in available and quality(coding) > 0]
+    if not ranked:
+        return 'identity'
+    return max(ranked, key=quality)
+
+
+class StaticAsset:
+    """One file and its precompressed variants"""
+
+    def __init__(self, path, stat, body):
+        self.path = path
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type in ('application/javascript', 'application/json'):
+            self.content_type += '; charset=utf-8'
+        tag = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {'identity': (body, f'"{tag}"')}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = (compressed, f'"{tag}-gzip"')
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = (compressed, f'"{tag}-br"')
+
+    def is_current(self, stat):
+        return stat.st_mtime == self.mtime and stat.st_size == self.size
+
+
+class StaticAssetStore:
+    """Precompressed copies of the compressible files in a directory"""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.lock = threading.Lock()
+        self.assets = {}    # absolute path -> StaticAsset
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self._load(entry.path)
+
+    def get(self, path):
+        """Current asset for an absolute file path, or None if it isn't managed here"""
+        path = os.path.abspath(path)
+        with self.lock:
+            asset = self.assets.get(path)
+        if asset is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self.lock:
+                self.assets.pop(path, None)
+            return None
+        if asset.is_current(stat):
+            return asset
+        return self._load(path)
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_size > MAX_ASSET_BYTES:
+                    return None
+                body = f.read()
+        except OSError:
+            return None
+        asset = StaticAsset(path, stat, body)
+        with self.lock:
+            self.assets[path] = asset
+        return asset
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(len(body) for asset in self.assets.values() for body, _ in asset.variants.values())
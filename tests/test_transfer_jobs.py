@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for the transfer job scheduler
+Runs JobManager against a stub engine whose uploads can be held open, so
+the test can act while items wait in a device's ready queue.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bandwidth import BandwidthScheduler
+from transfer_jobs import JobManager
+from transfer_progress import ProgressTracker
+
+HOST = {'hostIp': '192.0.2.10'}
+
+
+def roms(count):
+    return [{'romUrl': f'http://archive/rom{i}.nes', 'romName': f'rom{i}.nes', 'platform': 'nes'}
+            for i in range(count)]
+
+
+def ready(jobs):
+    return sum(len(queue.ready) for queue in jobs.pending.values())
+
+
+class StubEngine:
+    """Stands in for TransferEngine; the first upload blocks until release is set"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.bandwidth = BandwidthScheduler(device_concurrency=1, adaptive=False)
+        self.tracker = ProgressTracker()
+        self.release = threading.Event()
+        self.sent = []
+        self.released = []
+
+    def should_extract(self, rom_name, platform, requested=None):
+        return False
+
+    def download_rom(self, rom_url, rom_name, progress):
+        return f"/staged/{rom_name}"
+
+    def release_rom(self, local_file, success):
+        self.released.append(local_file)
+
+    def _upload(self, rom_name):
+        self.sent.append(rom_name)
+        self.release.wait(10)
+        return True, None
+
+    def download_and_transfer(self, rom_url, rom_name, platform, host_config, progress, md5=None, extract=None):
+        return self._upload(rom_name)
+
+    def transfer_to_device(self, local_file, rom_name, platform, host_config, progress, md5=None):
+        return self._upload(rom_name)
+
+
+class JobManagerTest(unittest.TestCase):
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 10
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.01)
+
+    def test_cancel_drops_prepared_items(self):
+        for pipeline in (True, False):
+            with self.subTest(pipeline=pipeline):
+                engine = StubEngine(pipeline)
+                jobs = JobManager(engine, download_workers=4, upload_workers=2, batch_file_size=0)
+                job = jobs.submit(roms(4), HOST, skip_existing=False)
+                # One upload holds the device's only slot; the rest are prepared and waiting
+                self.wait_for(lambda: len(engine.sent) == 1 and ready(jobs) == 3)
+
+                jobs.cancel(job.id)
+                engine.release.set()
+                self.wait_for(lambda: job.finished_at is not None)
+
+                self.assertEqual(len(engine.sent), 1)
+                self.assertEqual({item['romName']: item['status'] for item in job.items},
+                                 {f'rom{i}.nes': 'completed' if engine.sent == [f'rom{i}.nes'] else 'cancelled'
+                                  for i in range(4)})
+                self.assertEqual(job.status, 'cancelled')
+                phases = [transfer['phase'] for transfer in engine.tracker.snapshot()]
+                self.assertEqual(sorted(phases), ['done', 'skipped', 'skipped', 'skipped'])
+                if not pipeline:
+                    self.assertEqual(sorted(engine.released), [f'/staged/rom{i}.nes' for i in range(4)])
+
+    def test_raised_limit_starts_waiting_send(self):
+        engine = StubEngine(pipeline=True)
+        jobs = JobManager(engine, download_workers=4, upload_workers=2, batch_file_size=0)
+        job = jobs.submit(roms(3), HOST, skip_existing=False)
+        self.wait_for(lambda: len(engine.sent) == 1 and ready(jobs) == 2)
+
+        # A saturated measuring window lets the device take a second upload
+        device = engine.bandwidth.device_slot(HOST)
+        device.adaptive, device.window = True, 0.01
+        time.sleep(0.02)
+        device.record(1024)
+        self.assertEqual(device.limit, 2)
+        self.wait_for(lambda: len(engine.sent) == 2)
+
+        engine.release.set()
+        self.wait_for(lambda: job.finished_at is not None)
+        self.assertEqual(job.status, 'completed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Server-side batch transfer jobs
+A job is a list of ROMs plus a device config. It is queued on submission
+and run by a worker pool with separate download and upload concurrency and
+a per-device cap, independently of the browser tab that submitted it.
+
+Small ROMs are downloaded first and then sent to the device in batches,
+one tar stream per batch, instead of paying a round trip per file.
+Queued ROMs can be started smallest or largest first across all jobs;
+sizes the client didn't send are looked up in the background.
+"""
+
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bandwidth import device_key
+
+# Finished jobs are kept this long so clients can still fetch the results
+JOB_RETENTION = 3600
+
+JOB_ORDERS = ('fifo', 'smallest', 'largest')
+
+
+class TransferJob:
+    """A batch of ROM transfers to one device"""
+
+    def __init__(self, roms, host_config, skip_existing=True):
+        self.id = uuid.uuid4().hex[:12]
+        self.host_config = host_config
+        self.skip_existing = skip_existing
+        self.items = [{
+            'romUrl': rom.get('romUrl'),
+            'romName': rom.get('romName'),
+            'platform': (rom.get('platform') or '').lower(),
+            'size': rom.get('size'),
+            'md5': rom.get('md5'),
+            'extract': rom.get('extract'),
+            'status': 'queued',
+            'error': None,
+            'bytes': 0,
+        } for rom in roms]
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+        # Small ROMs waiting to go out in the next tar batch, and how many
+        # items haven't yet been either batched or handled on their own
+        self.batch = []
+        self.unrouted = len(self.items)
+
+    @property
+    def status(self):
+        states = [item['status'] for item in self.items]
+        if any(state in ('queued', 'running') for state in states):
+            return 'running' if any(state != 'queued' for state in states) else 'queued'
+        if self.cancelled:
+            return 'cancelled'
+        return 'failed' if any(state == 'failed' for state in states) else 'completed'
+
+    def update(self, item, **changes):
+        with self.lock:
+            item.update(changes)
+            if self.finished_at is None and self.status not in ('queued', 'running'):
+                self.finished_at = time.time()
+
+    def start_send(self, item):
+        """Mark a prepared item as running; False if the job was cancelled first"""
+        with self.lock:
+            if self.cancelled or item['status'] == 'cancelled':
+                return False
+            item['status'] = 'running'
+            return True
+
+    def snapshot(self, include_items=True):
+        with self.lock:
+            counts = {}
+            for item in self.items:
+                counts[item['status']] = counts.get(item['status'], 0) + 1
+            data = {
+                'jobId': self.id,
+                'status': self.status,
+                'host': self.host_config.get('hostIp'),
+                'total': len(self.items),
+                'counts': counts,
+                'createdAt': self.created_at,
+                'finishedAt': self.finished_at,
+            }
+            if include_items:
+                data['items'] = [dict(item) for item in self.items]
+            return data
+
+
+class DeviceQueue:
+    """Work waiting for one device: items still to prepare and prepared sends"""
+
+    def __init__(self, device):
+        self.device = device    # the device's AdaptiveLimit
+        self.queued = []        # heap of [priority, sequence, job, item]
+        self.ready = []         # heap of [priority, sequence, tiebreak, function, args]
+        self.preparing = 0
+
+
+class JobManager:
+    """Runs transfer jobs on a shared worker pool.
+
+    Downloads and uploads draw from separate slot pools, and each device
+    has its own cap so one slow handheld can't take every upload slot. The
+    per-device caps come from the engine's BandwidthScheduler. Every item
+    is prepared (existence check, local staging) and then queued again to
+    be sent; a send is only handed to a worker once its device has a free
+    slot, so a slow device never ties up the workers.
+    """
+
+    def __init__(self, engine, download_workers=4, upload_workers=2,
+                 batch_file_size=4 * 1024 * 1024, batch_max_files=200, order='fifo'):
+        self.engine = engine
+        # Which queued ROM a free worker picks next (see JOB_ORDERS)
+        self.order = order
+        # ROMs up to batch_file_size bytes are sent in tar batches of up to
+        # batch_max_files (0 disables batching)
+        self.batch_file_size = batch_file_size
+        self.batch_max_files = batch_max_files
+        self.download_slots = threading.BoundedSemaphore(download_workers)
+        self.upload_slots = threading.BoundedSemaphore(upload_workers)
+        self.download_workers = download_workers
+        self.workers = download_workers + upload_workers
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transfer-worker')
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.pending = {}       # (host, port) -> DeviceQueue
+        self.sequence = itertools.count()
+        # Tasks handed to the executor and not finished yet
+        self.dispatched = 0
+        self.preparing = 0
+
+    def submit(self, roms, host_config, skip_existing=True):
+        self._prune()
+        job = TransferJob(roms, host_config, skip_existing)
+        missing = [item for item in job.items if item['size'] is None] if self.order != 'fifo' else []
+        with self.lock:
+            self.jobs[job.id] = job
+            # Items without a size join the queue once _resolve_sizes has one
+            self._enqueue(job, [item for item in job.items if item not in missing])
+        if missing:
+            threading.Thread(target=self._resolve_sizes, args=(job, missing), daemon=True,
+                             name=f"job-{job.id}-sizes").start()
+        print(f"🗃️  Job {job.id}: {len(job.items)} ROMs queued for {host_config.get('hostIp')}")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def queue_depth(self):
+        """Number of ROMs waiting for a worker across all jobs"""
+        return sum(1 for job in self.list() for item in job.items if item['status'] == 'queued')
+
+    def cancel(self, job_id):
+        """Skip every item of a job that hasn't started yet"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancelled = True
+        for item in job.items:
+            if item['status'] == 'queued':
+                job.update(item, status='cancelled')
+        return job
+
+    def _priority(self, item):
+        # Unknown sizes go after the known ones until _resolve_sizes finds them
+        if self.order == 'fifo':
+            return 0
+        if item['size'] is None:
+            return math.inf
+        return item['size'] if self.order == 'smallest' else -item['size']
+
+    def _enqueue(self, job, items):
+        """Queue items behind their device and start whatever can run; call with self.lock held"""
+        queue = self._queue(job)
+        for item in items:
+            heapq.heappush(queue.queued, [self._priority(item), next(self.sequence), job, item])
+        self._dispatch()
+
+    def _queue(self, job):
+        key = device_key(job.host_config)
+        if key not in self.pending:
+            device = self.engine.bandwidth.device_slot(job.host_config)
+            # Slots freed outside _run_task (a raised limit, a single-ROM transfer) start queued sends too
+            device.on_free = self._wake
+            self.pending[key] = DeviceQueue(device)
+        return self.pending[key]
+
+    def _wake(self):
+        with self.lock:
+            self._dispatch()
+
+    def _resolve_sizes(self, job, missing):
+        """Fetch missing sizes, then queue those items in their place"""
+        def resolve(item):
+            if item['status'] != 'queued':
+                return
+            try:
+                item['size'] = self.engine.rom_size(item['romUrl'])
+            except Exception:
+                pass    # Stays at the back of the queue
+
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix='job-sizes') as executor:
+            for start in range(0, len(missing), 32):
+                chunk = missing[start:start + 32]
+                list(executor.map(resolve, chunk))
+                with self.lock:
+                    self._enqueue(job, chunk)
+
+    def _dispatch(self):
+        """Hand runnable tasks to free workers; call with self.lock held"""
+        while self.dispatched < self.workers:
+            task = self._next_task()
+            if task is None:
+                return
+            self.dispatched += 1
+            self.executor.submit(self._run_task, *task)
+
+    def _next_task(self):
+        """The best task that can start now as (queue, device slot or None, function, args)"""
+        # Sends free a staged file and a device slot's worth of work, so they go first
+        for queue in sorted((q for q in self.pending.values() if q.ready), key=lambda q: q.ready[0][:2]):
+            if queue.device.try_acquire():
+                *_, function, args = heapq.heappop(queue.ready)
+                return queue, queue.device, function, args + (queue.device,)
+        if self.preparing >= self.download_workers:
+            return None
+        candidates = []
+        for queue in self.pending.values():
+            # Don't stage more ROMs ahead of a device than the downloads could keep busy
+            if queue.queued and queue.preparing + len(queue.ready) < self.download_workers:
+                candidates.append(queue)
+        if not candidates:
+            return None
+        queue = min(candidates, key=lambda q: q.queued[0][:2])
+        priority, sequence, job, item = heapq.heappop(queue.queued)
+        queue.preparing += 1
+        self.preparing += 1
+        return queue, None, self._prepare, (job, item, (priority, sequence))
+
+    def _run_task(self, queue, device, function, args):
+        try:
+            function(*args)
+        finally:
+            if device:
+                device.release()
+            with self.lock:
+                self.dispatched -= 1
+                if device is None:
+                    queue.preparing -= 1
+                    self.preparing -= 1
+                self._dispatch()
+
+    def _send(self, job, rank, function, *args):
+        """Queue a prepared transfer until its device has a free slot"""
+        with self.lock:
+            # A batch can share its rank with a single ROM; the sequence keeps them apart
+            heapq.heappush(self._queue(job).ready, [*rank, next(self.sequence), function, args])
+
+    def _prepare(self, job, item, rank):
+        """Check one ROM and stage it if needed, then queue its upload or add it to the job's tar batch"""
+        progress = local_file = entry = None
+        try:
+            if item['status'] == 'queued':
+                progress = self.engine.tracker.start(item['romName'], job.host_config.get('hostIp'), job.id)
+                if job.skip_existing and self._skip_present(job, item, progress):
+                    progress = None
+                elif self._stage_locally(item):
+                    local_file = self._download(job, item, progress)
+                    if local_file is None:
+                        progress = None
+                    elif self.batch_file_size and os.path.getsize(local_file) <= self.batch_file_size:
+                        self.engine.tracker.set_phase(progress, 'waiting')
+                        entry, progress = (item, progress, local_file), None
+        except Exception as e:
+            if local_file:
+                self.engine.release_rom(local_file, False)
+            self._finish(job, item, progress, False, str(e))
+            progress = None
+        finally:
+            batch = self._route(job, entry)
+        if batch:
+            self._send(job, rank, self._upload_batch, job, batch)
+        if progress:
+            # Waiting for a device slot shows up as its own phase
+            self.engine.tracker.set_phase(progress, 'waiting')
+            self._send(job, rank, self._transfer_single, job, item, progress, local_file)
+
+    def _skip_present(self, job, item, progress):
+        # The first item per directory lists it on the device; the rest hit the cache
+        self.engine.tracker.set_phase(progress, 'checking')
+        if not self.engine.is_present(item['romName'], item['platform'], job.host_config,
+                                      item['romUrl'], item['size'], item['md5']):
+            return False
+        self.engine.tracker.finish(progress, skipped=True)
+        job.update(item, status='skipped')
+        return True
+
+    def _stage_locally(self, item):
+        """True if the ROM is downloaded before its upload is scheduled.
+
+        Archives to unpack are left to download_and_transfer, which extracts
+        them; otherwise staged mode always downloads first and pipelined
+        mode only does so for ROMs small enough to batch.
+        """
+        if self.engine.should_extract(item['romName'], item['platform'], item['extract']):
+            return False
+        return not self.engine.pipeline or self._batch_candidate(item)
+
+    def _batch_candidate(self, item):
+        """True if the ROM is known to be small enough for a tar batch"""
+        if not self.batch_file_size:
+            return False
+        size = item['size']
+        if size is None:
+            try:
+                size = self.engine.rom_size(item['romUrl'])
+            except Exception:
+                return False  # Unknown sizes are streamed on their own
+        return size is not None and size <= self.batch_file_size
+
+    def _download(self, job, item, progress):
+        with self.download_slots:
+            job.update(item, status='running')
+            local_file = self.engine.download_rom(item['romUrl'], item['romName'], progress)
+        if local_file is None:
+            self._finish(job, item, progress, False, "Failed to download ROM")
+        return local_file
+
+    def _route(self, job, entry=None):
+        """Count one item as routed; returns a batch that is ready to send, if any"""
+        with job.lock:
+            job.unrouted -= 1
+            if entry:
+                job.batch.append(entry)
+            if job.batch and (len(job.batch) >= self.batch_max_files or job.unrouted == 0):
+                batch, job.batch = job.batch, []
+                return batch
+        return None
+
+    def _upload_batch(self, job, batch, device):
+        with self.upload_slots, device.running():
+            batch = [entry for entry in batch if self._claim(job, *entry)]
+            files = [(local_file, item['romName'], item['platform'], progress, item['md5'])
+                     for item, progress, local_file in batch]
+            try:
+                errors = self.engine.transfer_batch(job.host_config, files) if files else []
+            except Exception as e:
+                errors = [str(e)] * len(batch)
+        for (item, progress, local_file), error in zip(batch, errors):
+            self.engine.release_rom(local_file, error is None)
+            self._finish(job, item, progress, error is None, error)
+
+    def _transfer_single(self, job, item, progress, local_file, device):
+        try:
+            if local_file is None:
+                # Streaming (or download + extraction) needs its download and upload slot at once
+                with self.upload_slots, self.download_slots, device.running():
+                    if not self._claim(job, item, progress, None):
+                        return
+                    success, error = self.engine.download_and_transfer(
+                        item['romUrl'], item['romName'], item['platform'], job.host_config, progress,
+                        item['md5'], item['extract'])
+            else:
+                with self.upload_slots, device.running():
+                    if not self._claim(job, item, progress, local_file):
+                        return
+                    success, error = self.engine.transfer_to_device(
+                        local_file, item['romName'], item['platform'], job.host_config, progress,
+                        item['md5'])
+                self.engine.release_rom(local_file, success)
+        except Exception as e:
+            success, error = False, str(e)
+        self._finish(job, item, progress, success, error)
+
+    def _claim(self, job, item, progress, local_file):
+        """Start sending a prepared ROM; drops it instead if its job was cancelled while it waited"""
+        if job.start_send(item):
+            return True
+        if local_file:
+            # Nothing will come back for the staged copy
+            self.engine.release_rom(local_file, True)
+        self.engine.tracker.finish(progress, skipped=True)
+        job.update(item, status='cancelled')
+        return False
+
+    def _finish(self, job, item, progress, success, error):
+        if progress:
+            self.engine.tracker.finish(progress, error if not success else None)
+        job.update(item, status='completed' if success else 'failed', error=error,
+                   bytes=progress.uploaded if progress else 0)
+        if job.finished_at:
+            counts = job.snapshot(include_items=False)['counts']
+            print(f"🏁 Job {job.id} {job.status}: {counts}")
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        with self.lock:
+            for job_id in [j.id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+                del self.jobs[job_id]
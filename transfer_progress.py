@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Byte-level progress for in-flight transfers
+The download and upload loops bump plain counters on a TransferProgress;
+throughput and ETA are derived from those counters whenever someone asks
+for a snapshot, so an idle tracker costs nothing per chunk. Time spent in
+each phase is added up so finished transfers can report where it went.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Throughput is measured over roughly this many recent seconds
+RATE_WINDOW = 5.0
+
+# Finished transfers stay visible this long so watchers see the final state
+FINISHED_RETENTION = 30
+
+
+class CountingReader:
+    """File-like wrapper that reports every chunk read through it"""
+
+    def __init__(self, source, on_read):
+        self.source = source
+        self.on_read = on_read
+
+    def readinto(self, buffer):
+        count = self.source.readinto(buffer)
+        if count:
+            self.on_read(count)
+        return count
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if data:
+            self.on_read(len(data))
+        return data
+
+
+class TransferProgress:
+    """Counters for one ROM moving from the archive to a device"""
+
+    def __init__(self, transfer_id, name, host=None, job_id=None):
+        self.id = transfer_id
+        self.name = name
+        self.host = host
+        self.job_id = job_id
+        self.phase = 'waiting'
+        self.total = None
+        self.downloaded = 0
+        self.uploaded = 0
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        # phase -> seconds spent in it so far (a phase can be entered more than once)
+        self.stage_times = {}
+        self.phase_started = time.monotonic()
+        self.samples = deque()
+        # Segmented downloads bump the counters from several threads
+        self.lock = threading.Lock()
+
+    def add_downloaded(self, count):
+        with self.lock:
+            self.downloaded += count
+
+    def add_uploaded(self, count):
+        with self.lock:
+            self.uploaded += count
+
+    def enter_phase(self, phase):
+        now = time.monotonic()
+        self.stage_times[self.phase] = self.stage_times.get(self.phase, 0.0) + now - self.phase_started
+        self.phase = phase
+        self.phase_started = now
+
+    def set_total(self, length):
+        if length is not None and str(length).isdigit():
+            self.total = int(length)
+
+    def _rates(self, now):
+        """(download, upload) bytes/s over the recent sample window"""
+        if not self.samples or now - self.samples[-1][0] >= 0.25:
+            self.samples.append((now, self.downloaded, self.uploaded))
+        while len(self.samples) > 2 and now - self.samples[1][0] > RATE_WINDOW:
+            self.samples.popleft()
+        then, downloaded, uploaded = self.samples[0]
+        if now - then < 0.5:
+            # Not enough history yet: use the average since the start
+            then, downloaded, uploaded = self.started_at, 0, 0
+        elapsed = max(now - then, 1e-3)
+        return (self.downloaded - downloaded) / elapsed, (self.uploaded - uploaded) / elapsed
+
+    def snapshot(self):
+        now = self.finished_at or time.time()
+        download_rate, upload_rate = self._rates(now) if self.finished_at is None else (0.0, 0.0)
+        if self.phase == 'downloading':
+            done, rate = self.downloaded, download_rate
+        else:
+            done, rate = self.uploaded, upload_rate
+        eta = None
+        if self.total and rate > 0 and self.finished_at is None:
+            eta = round(max(self.total - done, 0) / rate, 1)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'host': self.host,
+            'jobId': self.job_id,
+            'phase': self.phase,
+            'totalBytes': self.total,
+            'downloadedBytes': self.downloaded,
+            'uploadedBytes': self.uploaded,
+            'downloadRate': round(download_rate),
+            'uploadRate': round(upload_rate),
+            'eta': eta,
+            'elapsed': round(now - self.started_at, 1),
+            'error': self.error,
+        }
+
+
+class ProgressTracker:
+    """Registry of in-flight (and recently finished) transfers"""
+
+    def __init__(self, on_finish=None):
+        self.condition = threading.Condition()
+        self.transfers = OrderedDict()
+        self.ids = itertools.count(1)
+        # Called with each TransferProgress once it is done, failed or skipped
+        self.on_finish = on_finish
+
+    def start(self, name, host=None, job_id=None):
+        with self.condition:
+            progress = TransferProgress(next(self.ids), name, host, job_id)
+            self.transfers[progress.id] = progress
+            self.condition.notify_all()
+        return progress
+
+    def set_phase(self, progress, phase):
+        with self.condition:
+            progress.enter_phase(phase)
+            self.condition.notify_all()
+
+    def finish(self, progress, error=None, skipped=False):
+        with self.condition:
+            progress.enter_phase('failed' if error else 'skipped' if skipped else 'done')
+            progress.error = error
+            progress.finished_at = time.time()
+            # Pruned here too so nothing piles up while nobody polls snapshot()
+            self._prune()
+            self.condition.notify_all()
+        if self.on_finish:
+            self.on_finish(progress)
+
+    def active(self):
+        """Number of transfers that haven't finished yet"""
+        with self.condition:
+            return sum(1 for p in self.transfers.values() if p.finished_at is None)
+
+    def snapshot(self, job_id=None):
+        with self.condition:
+            self._prune()
+            transfers = [p for p in self.transfers.values() if job_id is None or p.job_id == job_id]
+            return [p.snapshot() for p in transfers]
+
+    def _prune(self):
+        # Call with self.condition held
+        cutoff = time.time() - FINISHED_RETENTION
+        for transfer_id in [p.id for p in self.transfers.values() if p.finished_at and p.finished_at < cutoff]:
+            del self.transfers[transfer_id]
+
+    def wait(self, timeout):
+        """Block until a transfer starts, changes phase or finishes"""
+        with self.condition:
+            self.condition.wait(timeout)
@@ -5,15 +5,558 @@ Handles SSH/SCP transfers from the web browser to retro gaming devices
 """
 
 import os
-import sys
 import json
+import time
+import hashlib
+import argparse
+import threading
 import subprocess
-import tempfile
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import http.client
+from contextlib import nullcontext
+from http.server import SimpleHTTPRequestHandler
+from urllib.error import HTTPError
 from urllib.parse import urlparse, parse_qs
-import urllib.request
 
-class TransferHandler(SimpleHTTPRequestHandler):
+from bandwidth import BandwidthScheduler, parse_rate
+from device_discovery import DeviceDiscovery, local_network
+from device_inventory import DeviceInventory
+from device_ssh import SSHSessionPool, SSHConnectError
+from downloader import ResumableDownloader, DEFAULT_DOWNLOAD_DIR, expected_length, resume_validator
+from library_index import LibraryIndex, DEFAULT_LIBRARY_DIRS, HASH_ALGORITHMS
+from metrics import Counter, Gauge, Histogram, RequestMetricsMixin, TimingLog
+from rom_cache import RomCache, TeeReader, DEFAULT_ROM_CACHE_DIR
+from rom_extract import ArchiveExtractor, DEFAULT_EXTRACT_PLATFORMS
+from server_utils import BoundedThreadingHTTPServer
+from transfer_jobs import JobManager, JOB_ORDERS
+from transfer_progress import CountingReader, ProgressTracker
+from upstream_pool import UpstreamPool
+
+# Size of the buffer used when piping downloads into the SSH channel
+CHUNK_SIZE = 256 * 1024
+
+# Map platform to directory name
+PLATFORM_DIRS = {
+    'nes': 'nes',
+    'snes': 'snes', 
+    'gb': 'gb',
+    'game boy': 'gb',  # Handle "Game Boy" platform name
+    'gbc': 'gbc',
+    'gba': 'gba',
+    'genesis': 'genesis',
+    'gamegear': 'gamegear',
+    'sms': 'sms',
+    'segacd': 'segacd',
+    'sega32x': 'sega32x',
+    'saturn': 'saturn',
+    'ngp': 'ngp'
+}
+
+TRANSFERS = Counter('romnix_transfers_total', "Finished ROM transfers by result (done, failed, skipped)",
+                    ('result',))
+TRANSFER_STAGE_SECONDS = Histogram('romnix_transfer_stage_seconds',
+                                   "Time finished transfers spent in each phase", ('stage',))
+DEVICE_BYTES = Counter('romnix_device_bytes_total',
+                       "ROM bytes fetched (from the archive or the ROM cache) and uploaded, per device",
+                       ('device', 'direction'))
+ACTIVE_TRANSFERS = Gauge('romnix_transfers_active', "Transfers in progress")
+QUEUE_DEPTH = Gauge('romnix_job_queue_depth', "Batch job ROMs waiting for a worker")
+LIBRARY_FILES = Gauge('romnix_library_files', "Files in the local ROM library index")
+
+def remote_dir_for(platform, host_config):
+    """Remote ROM directory for a platform on the configured device"""
+    base_path = host_config.get('remoteBasePath', '/mnt/mmc/ROMS')
+    return f"{base_path}/{PLATFORM_DIRS.get(platform, platform)}"
+
+def file_md5(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TransferEngine:
+    """Downloads ROMs and uploads them to devices.
+
+    Shared by the request handler and the background job workers.
+    Transfer methods return (success, error_message) and report byte counts
+    to the TransferProgress they are given (see self.tracker).
+    """
+
+    def __init__(self, ssh_pool, upstream=None, pipeline=True, chunk_size=CHUNK_SIZE,
+                 skip_existing=True, inventory_ttl=600, retries=3, retry_delay=2,
+                 download_dir=DEFAULT_DOWNLOAD_DIR, segments=4, segment_min_size=8 * 1024 * 1024,
+                 rom_cache=None, extractor=None, timing_log=None, bandwidth=None):
+        self.ssh_pool = ssh_pool
+        self.upstream = upstream or UpstreamPool()
+        # Rate caps and per-device upload concurrency (unlimited, fixed at 2 if not given)
+        self.bandwidth = bandwidth or BandwidthScheduler(adaptive=False)
+        self.tracker = ProgressTracker(on_finish=self.record_transfer)
+        # TimingLog that gets a record per finished transfer, or None
+        self.timing_log = timing_log
+        self.inventory = DeviceInventory(ssh_pool, ttl=inventory_ttl)
+        self.downloader = ResumableDownloader(self.upstream, download_dir, chunk_size, retries, retry_delay,
+                                              segments, segment_min_size,
+                                              throttle=self.bandwidth.download_meter(None))
+        # Local copy of every ROM fetched, shared by all devices (None disables it)
+        self.rom_cache = rom_cache
+        # Unpacks archives for platforms that need bare ROMs (None disables it)
+        self.extractor = extractor
+        # Stream downloads straight into the device instead of staging a temp file
+        self.pipeline = pipeline
+        self.chunk_size = chunk_size
+        # Don't re-send ROMs that are already on the device
+        self.skip_existing = skip_existing
+        # Interrupted transfers are resumed from where they stopped this many times
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # (device, remote path) -> upstream validator of a partially streamed .part file
+        self.partials = {}
+
+    def record_transfer(self, progress):
+        """Account for a finished transfer in the metrics and the timing log"""
+        device = progress.host or 'unknown'
+        TRANSFERS.inc(result=progress.phase)
+        DEVICE_BYTES.inc(progress.downloaded, device=device, direction='download')
+        DEVICE_BYTES.inc(progress.uploaded, device=device, direction='upload')
+        for stage, seconds in progress.stage_times.items():
+            TRANSFER_STAGE_SECONDS.observe(seconds, stage=stage)
+        if self.timing_log:
+            self.timing_log.write({
+                'type': 'transfer',
+                'service': 'transfer',
+                'transferId': progress.id,
+                'jobId': progress.job_id,
+                'rom': progress.name,
+                'device': device,
+                'result': progress.phase,
+                'error': progress.error,
+                'seconds': round(progress.finished_at - progress.started_at, 4),
+                'downloadedBytes': progress.downloaded,
+                'uploadedBytes': progress.uploaded,
+                'stages': {stage: round(seconds, 4) for stage, seconds in progress.stage_times.items()},
+            })
+
+    def is_present(self, rom_name, platform, host_config, rom_url=None, size=None, md5=None):
+        """True if the device already has this exact ROM.
+
+        The remote directory listing is cached per device, so this costs
+        one SSH command per directory per sync. Without a known size, the
+        upstream size is fetched with a HEAD, but only for names that are
+        already on the device. If md5 is given, the remote checksum must
+        match too.
+        """
+        remote_dir = remote_dir_for(platform, host_config)
+        try:
+            entry = self.inventory.lookup(host_config, remote_dir, rom_name)
+            if entry is None:
+                return False
+            if size is None and rom_url:
+                size = self.rom_size(rom_url)
+            if size is None or entry['size'] != size:
+                return False
+            if md5:
+                return self.inventory.remote_md5(host_config, remote_dir, rom_name) == md5.lower()
+            return True
+        except Exception as e:
+            print(f"⚠️  Couldn't check {rom_name} on {host_config.get('hostIp')}: {e}")
+            return False
+
+    def rom_size(self, rom_url):
+        """Size of a ROM from the ROM cache, or upstream if it isn't cached"""
+        cached = self.rom_cache.lookup(rom_url) if self.rom_cache else None
+        if cached and self.rom_cache.is_fresh(cached):
+            return cached['size']
+        return self.remote_size(rom_url)
+
+    def remote_size(self, rom_url):
+        """Exact size of a ROM upstream, or None if the host doesn't say"""
+        with self.upstream.request(rom_url, headers={'Accept': '*/*'}, method='HEAD') as response:
+            response.read()
+            length = response.headers.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+
+    def cached_copy(self, rom_url, progress=None):
+        """Pinned path of the ROM in the local ROM cache, or None on a miss.
+
+        Entries older than the cache TTL are revalidated with a conditional
+        HEAD first; if the archive can't be reached the cached copy is used
+        anyway. Hand the path to release_rom() once the upload is done.
+        """
+        meta = self.rom_cache.lookup(rom_url) if self.rom_cache else None
+        if meta is None:
+            return None
+        if not self.rom_cache.is_fresh(meta):
+            headers = {'Accept': '*/*', **self.rom_cache.conditional_headers(meta)}
+            try:
+                with self.upstream.request(rom_url, headers=headers, method='HEAD') as response:
+                    response.read()
+                    unchanged = response.status == 304 or self.rom_cache.matches(meta, response.headers)
+            except HTTPError:
+                unchanged = False
+            except (OSError, http.client.HTTPException) as e:
+                print(f"⚠️  Couldn't revalidate cached {rom_url} ({e}), using the cached copy")
+                unchanged = True
+            if not unchanged:
+                print(f"♻️  {rom_url} changed upstream, dropping the cached copy")
+                self.rom_cache.forget(rom_url)
+                return None
+            self.rom_cache.refresh(meta)
+
+        local_file = self.rom_cache.pin(meta)
+        if local_file and progress:
+            progress.set_total(meta['size'])
+            progress.downloaded = meta['size']
+        return local_file
+
+    def fill_lock(self, rom_url):
+        """Held while fetching a ROM so concurrent misses download it only once"""
+        return self.rom_cache.fill_lock(rom_url) if self.rom_cache else nullcontext()
+
+    def release_rom(self, local_file, success):
+        """Done with a file from download_rom() or cached_copy()"""
+        if self.rom_cache and self.rom_cache.release(local_file):
+            return
+        if success:
+            # On failure the download is kept so a retry only redoes the upload
+            os.unlink(local_file)
+
+    def should_extract(self, rom_name, platform, requested=None):
+        """True if the archive rom_name is unpacked here before upload"""
+        return self.extractor is not None and self.extractor.wants(rom_name, platform, requested)
+
+    def download_and_transfer(self, rom_url, rom_name, platform, host_config, progress, md5=None,
+                              extract=None):
+        if self.should_extract(rom_name, platform, extract):
+            # Archives to unpack have to be on local disk first
+            print(f"📦 Downloading {rom_name} for extraction...")
+            local_file = self.download_rom(rom_url, rom_name, progress)
+            if not local_file:
+                return False, "Failed to download ROM"
+            success, error = self.transfer_extracted(local_file, rom_name, platform, host_config, progress)
+            self.release_rom(local_file, success)
+            return success, error
+
+        if self.pipeline:
+            local_file = self.cached_copy(rom_url, progress)
+            if local_file is None:
+                with self.fill_lock(rom_url):
+                    # Another transfer may have cached it while we waited
+                    local_file = self.cached_copy(rom_url, progress)
+                    if local_file is None:
+                        # Download and upload overlap; a copy is kept in the ROM cache
+                        print(f"📡 Streaming {rom_name} to {host_config.get('hostIp')}...")
+                        return self.stream_to_device(rom_url, rom_name, platform, host_config, progress, md5)
+            print(f"💾 {rom_name} is in the ROM cache")
+        else:
+            # Download ROM to the staging directory (or find it in the ROM cache)
+            print(f"📦 Downloading {rom_name}...")
+            local_file = self.download_rom(rom_url, rom_name, progress)
+            if not local_file:
+                return False, "Failed to download ROM"
+
+        # Transfer to device
+        print(f"🚀 Transferring to {host_config.get('hostIp')}...")
+        success, error = self.transfer_to_device(local_file, rom_name, platform, host_config, progress, md5)
+        self.release_rom(local_file, success)
+        return success, error
+
+    def download_rom(self, rom_url, rom_name, progress):
+        """Download ROM file to local disk, resuming partial downloads.
+
+        Served from the ROM cache when possible; fresh downloads are moved
+        into it. Pass the returned path to release_rom() after uploading.
+        """
+        try:
+            local_file = self.cached_copy(rom_url, progress)
+            if local_file:
+                print(f"💾 {rom_name} is in the ROM cache")
+                return local_file
+
+            _, ext = os.path.splitext(rom_name)
+            with self.fill_lock(rom_url):
+                local_file = self.cached_copy(rom_url, progress)
+                if local_file:
+                    return local_file
+                self.tracker.set_phase(progress, 'downloading')
+                staged_file, validators = self.downloader.download(rom_url, ext, progress)
+                print(f"✅ Downloaded to {staged_file}")
+                if self.rom_cache:
+                    # Too big for the cache: keep using the staged file
+                    return self.rom_cache.adopt(rom_url, staged_file, validators) or staged_file
+                return staged_file
+            
+        except Exception as e:
+            print(f"❌ Download failed: {e}")
+            return None
+    
+    def stream_to_device(self, rom_url, rom_name, platform, host_config, progress, md5=None):
+        """Pipe the HTTP body straight into the device over SSH.
+        
+        The download is relayed chunk by chunk into `cat` on the device, so
+        download and upload overlap and the file is never held in RAM or on
+        local disk - except for the copy teed into the ROM cache, if enabled.
+        If the stream breaks, the next attempt asks upstream for the rest of
+        the file (Range + If-Range) and appends it to the device's .part file.
+        """
+        host_ip = host_config.get('hostIp')
+        username = host_config.get('username', 'root')
+        remote_path = remote_dir_for(platform, host_config)
+        part_key = (SSHSessionPool.key_for(host_config), f"{remote_path}/{rom_name}")
+        print(f"🔧 Transfer config - IP: {host_ip}, User: {username}, Platform: {platform}")
+        
+        error = None
+        for attempt in range(1, self.retries + 2):
+            try:
+                self.tracker.set_phase(progress, 'connecting')
+                with self.ssh_pool.session(host_config) as session:
+                    validator = self.partials.get(part_key)
+                    offset = (session.remote_size(f"{part_key[1]}.part") or 0) if validator else 0
+                    headers = {'Accept': '*/*'}
+                    if offset:
+                        headers['Range'] = f"bytes={offset}-"
+                        headers['If-Range'] = validator
+                    
+                    with self.upstream.request(rom_url, headers=headers) as response:
+                        if response.status != 206:
+                            offset = 0     # Full body: the .part file is rewritten
+                        total = expected_length(response, offset)
+                        validator = resume_validator(response.headers)
+                        if validator:
+                            self.partials[part_key] = validator
+                        
+                        print(f"📤 Streaming {rom_name} to {host_ip}:{remote_path}/" +
+                              (f" (resuming at {offset} bytes)" if offset else ""))
+                        progress.set_total(total)
+                        progress.downloaded = progress.uploaded = offset
+                        self.tracker.set_phase(progress, 'streaming')
+                        # Only a complete body can be cached, not a resumed tail
+                        writer = self.rom_cache.writer(rom_url, response) if self.rom_cache and not offset else None
+                        source = CountingReader(TeeReader(response, writer) if writer else response,
+                                                self.bandwidth.download_meter(progress.add_downloaded))
+                        try:
+                            success, sent, error = session.upload_stream(
+                                source, remote_path, rom_name, self.chunk_size,
+                                self.bandwidth.upload_meter(host_config, progress.add_uploaded),
+                                offset=offset, expected_size=total, md5=md5)
+                            if success and writer:
+                                writer.commit(total)
+                        finally:
+                            if writer:
+                                writer.abort()
+                
+                if success:
+                    print(f"✅ Streamed {sent} bytes to {host_ip}")
+                    self.partials.pop(part_key, None)
+                    self.inventory.record(host_config, remote_path, rom_name, offset + sent)
+                    return True, None
+                print(f"❌ Remote write failed: {error}")
+                
+            except SSHConnectError as e:
+                print(f"❌ {e}")
+                return False, str(e)
+            except HTTPError as e:
+                if e.code != 416 and e.code < 500:
+                    print(f"❌ Streaming transfer error: {e}")
+                    return False, str(e)
+                # 416: the partial doesn't fit upstream any more, start over
+                self.partials.pop(part_key, None)
+                error = str(e)
+            except Exception as e:
+                print(f"❌ Streaming transfer error: {e}")
+                error = str(e)
+            
+            if attempt <= self.retries:
+                self.retry_pause(progress, attempt, rom_name)
+        return False, error
+    
+    def transfer_to_device(self, local_file, rom_name, platform, host_config, progress, md5=None):
+        """Transfer ROM file to retro gaming device over a pooled SSH session.
+        
+        A .part file left on the device by an interrupted upload is resumed
+        rather than resent. Because that splices two uploads together, a
+        resumed file is checked against the local file's MD5 before it is
+        renamed into place.
+        """
+        host_ip = host_config.get('hostIp')
+        username = host_config.get('username', 'root')
+        remote_path = remote_dir_for(platform, host_config)
+        size = os.path.getsize(local_file)
+        print(f"🔧 Transfer config - IP: {host_ip}, User: {username}, Platform: {platform}")
+        
+        error = None
+        for attempt in range(1, self.retries + 2):
+            try:
+                self.tracker.set_phase(progress, 'connecting')
+                with self.ssh_pool.session(host_config) as session:
+                    offset = session.remote_size(f"{remote_path}/{rom_name}.part") or 0
+                    if offset > size:
+                        offset = 0
+                    checksum = md5 or (file_md5(local_file, self.chunk_size) if offset else None)
+                    
+                    print(f"📤 Transferring {rom_name} to {host_ip}:{remote_path}/" +
+                          (f" (resuming at {offset} bytes)" if offset else ""))
+                    progress.set_total(size)
+                    progress.uploaded = offset
+                    self.tracker.set_phase(progress, 'uploading')
+                    with open(local_file, 'rb') as source:
+                        source.seek(offset)
+                        success, sent, error = session.upload_stream(
+                            source, remote_path, rom_name, self.chunk_size,
+                            self.bandwidth.upload_meter(host_config, progress.add_uploaded),
+                            offset=offset, expected_size=size, md5=checksum)
+                
+                if success:
+                    print(f"✅ Transfer successful!")
+                    self.inventory.record(host_config, remote_path, rom_name, size)
+                    return True, None
+                print(f"❌ Transfer failed: {error}")
+                
+            except SSHConnectError as e:
+                print(f"❌ {e}")
+                return False, str(e)
+            except Exception as e:
+                print(f"❌ Transfer error: {e}")
+                error = str(e)
+            
+            if attempt <= self.retries:
+                self.retry_pause(progress, attempt, rom_name)
+        return False, error
+    
+    def transfer_extracted(self, archive, rom_name, platform, host_config, progress):
+        """Unpack an archive on this machine and upload its contents.
+        
+        Extraction runs in the extractor's process pool; all members then go
+        to the platform directory in one tar stream, keeping any folders
+        inside the archive.
+        """
+        host_ip = host_config.get('hostIp')
+        base_path = host_config.get('remoteBasePath', '/mnt/mmc/ROMS')
+        platform_dir = PLATFORM_DIRS.get(platform, platform)
+        self.tracker.set_phase(progress, 'extracting')
+        started = time.monotonic()
+        try:
+            extract_dir, members = self.extractor.extract(archive)
+        except Exception as e:
+            print(f"❌ Couldn't extract {rom_name}: {e}")
+            return False, f"Couldn't extract {rom_name}: {e}"
+        print(f"🗜️  Extracted {len(members)} file(s) from {rom_name} in {time.monotonic() - started:.1f}s")
+        
+        try:
+            error = None
+            for attempt in range(1, self.retries + 2):
+                sources = []
+                try:
+                    progress.set_total(sum(size for _, size in members))
+                    progress.uploaded = 0
+                    self.tracker.set_phase(progress, 'uploading')
+                    tar_members = []
+                    for relative_path, size in members:
+                        source = open(os.path.join(extract_dir, relative_path), 'rb')
+                        sources.append(source)
+                        tar_members.append((f"{platform_dir}/{relative_path}",
+                                            CountingReader(source, self.bandwidth.upload_meter(
+                                                host_config, progress.add_uploaded)), size, None))
+                    print(f"📤 Transferring contents of {rom_name} to {host_ip}:{base_path}/{platform_dir}/")
+                    with self.ssh_pool.session(host_config) as session:
+                        errors = session.upload_tar(tar_members, base_path, self.chunk_size)
+                except SSHConnectError as e:
+                    print(f"❌ {e}")
+                    return False, str(e)
+                except Exception as e:
+                    errors = [str(e)]
+                finally:
+                    for source in sources:
+                        source.close()
+                
+                error = next((message for message in errors if message), None)
+                if error is None:
+                    print(f"✅ Transfer successful!")
+                    remote_path = remote_dir_for(platform, host_config)
+                    for relative_path, size in members:
+                        if os.sep not in relative_path:
+                            self.inventory.record(host_config, remote_path, relative_path, size)
+                    return True, None
+                print(f"❌ Transfer failed: {error}")
+                if attempt <= self.retries:
+                    self.retry_pause(progress, attempt, rom_name)
+            return False, error
+        finally:
+            self.extractor.cleanup(extract_dir)
+    
+    def transfer_batch(self, host_config, files):
+        """Upload many small local files to one device as a single tar stream.
+        
+        files is a list of (local_file, rom_name, platform, progress, md5);
+        each file is unpacked into its platform directory. Files the batch
+        couldn't deliver are retried one by one with transfer_to_device.
+        Returns an error message, or None on success, for each file.
+        """
+        host_ip = host_config.get('hostIp')
+        base_path = host_config.get('remoteBasePath', '/mnt/mmc/ROMS')
+        started = time.monotonic()
+        sources = []
+        try:
+            members = []
+            for local_file, rom_name, platform, progress, md5 in files:
+                source = open(local_file, 'rb')
+                sources.append(source)
+                size = os.path.getsize(local_file)
+                progress.set_total(size)
+                progress.uploaded = 0
+                self.tracker.set_phase(progress, 'uploading')
+                members.append((f"{PLATFORM_DIRS.get(platform, platform)}/{rom_name}",
+                                CountingReader(source, self.bandwidth.upload_meter(
+                                    host_config, progress.add_uploaded)), size, md5))
+            
+            print(f"📦 Sending {len(files)} ROMs to {host_ip}:{base_path}/ as one tar stream "
+                  f"({sum(member[2] for member in members)} bytes)")
+            with self.ssh_pool.session(host_config) as session:
+                errors = session.upload_tar(members, base_path, self.chunk_size)
+        except SSHConnectError as e:
+            print(f"❌ {e}")
+            return [str(e)] * len(files)
+        except Exception as e:
+            print(f"❌ Batch transfer error: {e}")
+            errors = [str(e)] * len(files)
+        finally:
+            for source in sources:
+                source.close()
+        
+        delivered = errors.count(None)
+        print(f"✅ Batch delivered {delivered} of {len(files)} ROMs to {host_ip} "
+              f"in {time.monotonic() - started:.1f}s")
+        for index, (local_file, rom_name, platform, progress, md5) in enumerate(files):
+            if errors[index] is None:
+                self.inventory.record(host_config, remote_dir_for(platform, host_config), rom_name,
+                                      os.path.getsize(local_file))
+            else:
+                print(f"🔁 {rom_name} failed in the batch ({errors[index]}), sending it on its own")
+                success, error = self.transfer_to_device(local_file, rom_name, platform, host_config,
+                                                         progress, md5)
+                errors[index] = None if success else error
+        return errors
+    
+    def close(self):
+        """Close device sessions and stop the extraction workers"""
+        self.ssh_pool.close_all()
+        if self.extractor:
+            self.extractor.shutdown()
+        if self.timing_log:
+            self.timing_log.close()
+    
+    def retry_pause(self, progress, attempt, rom_name):
+        self.tracker.set_phase(progress, 'retrying')
+        delay = self.retry_delay * attempt
+        print(f"🔁 Retrying {rom_name} in {delay}s (attempt {attempt + 1} of {self.retries + 1})")
+        time.sleep(delay)
+
+class TransferHandler(RequestMetricsMixin, SimpleHTTPRequestHandler):
+    service = 'transfer'
+    engine = None
+    jobs = None
+    discovery = None
+    library = None
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
     
@@ -25,19 +568,39 @@ class TransferHandler(SimpleHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
     
+    def do_GET(self):
+        """Job status, progress and discovery endpoints; anything else is served as a static file"""
+        parsed = urlparse(self.path)
+        if parsed.path == '/jobs' or parsed.path.startswith('/jobs/'):
+            self.handle_job_status(parsed.path)
+        elif parsed.path == '/progress':
+            self.handle_progress_stream(parse_qs(parsed.query))
+        elif parsed.path == '/discover':
+            self.handle_discover(parse_qs(parsed.query))
+        elif parsed.path == '/metrics':
+            self.send_metrics()
+        else:
+            super().do_GET()
+    
     def do_POST(self):
         """Handle ROM transfer requests"""
         try:
             # Parse request
-            content_length = int(self.headers['Content-Length'])
+            content_length = int(self.headers.get('Content-Length') or 0)
             request_body = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(request_body)
+            data = json.loads(request_body) if request_body else {}
             
             # Handle different endpoints
             if self.path == '/check-file':
                 self.handle_check_file(data)
+            elif self.path == '/check-files':
+                self.handle_check_files(data)
             elif self.path == '/transfer':
                 self.handle_transfer_local(data)
+            elif self.path == '/jobs':
+                self.handle_submit_job(data)
+            elif self.path.startswith('/jobs/') and self.path.endswith('/cancel'):
+                self.handle_cancel_job(self.path[len('/jobs/'):-len('/cancel')])
             else:
                 # Default: download + transfer
                 self.handle_download_and_transfer(data)
@@ -47,44 +610,106 @@ class TransferHandler(SimpleHTTPRequestHandler):
             self.send_error_response(500, str(e))
     
     def handle_check_file(self, data):
-        """Check if a file exists in Downloads folder"""
+        """Check if exactly this file is in the local ROM library (no archive/extracted variants)"""
         file_name = data.get('fileName')
         if not file_name:
             self.send_error_response(400, "Missing fileName")
             return
-            
-        # Check common download locations
-        downloads_path = os.path.expanduser("~/Downloads")
-        file_path = os.path.join(downloads_path, file_name)
         
-        if os.path.exists(file_path):
-            self.send_success_response({"exists": True, "filePath": file_path})
+        match = self.library.lookup([file_name], variants=False)[0]
+        if match:
+            self.send_success_response({"exists": True, "filePath": match['path'], "size": match['size']})
         else:
             self.send_success_response({"exists": False, "filePath": None})
     
+    def handle_check_files(self, data):
+        """Look up a whole list of ROMs in the local library with one request.
+        
+        Takes {"fileNames": [...], "hash": "md5", "variants": false} (hash
+        and variants are optional) and returns one result per name, in
+        order. Unless variants is false, a file with the same stem and
+        another extension is returned with match "variant"; it is not the
+        named file and must not be uploaded under that name.
+        """
+        file_names = data.get('fileNames')
+        algorithm = data.get('hash')
+        if not isinstance(file_names, list):
+            self.send_error_response(400, "Missing fileNames list")
+            return
+        if algorithm and algorithm not in HASH_ALGORITHMS:
+            self.send_error_response(400, f"Unsupported hash: {algorithm} (use {', '.join(HASH_ALGORITHMS)})")
+            return
+        
+        results = []
+        matches = self.library.lookup(file_names, algorithm, variants=data.get('variants', True) is not False)
+        for file_name, match in zip(file_names, matches):
+            result = {'fileName': file_name, 'exists': match is not None, 'filePath': None}
+            if match:
+                result.update(filePath=match.pop('path'), **match)
+            results.append(result)
+        self.timing_details['files'] = len(file_names)
+        self.send_success_response({
+            'results': results,
+            'found': sum(result['exists'] for result in results),
+        })
+    
     def handle_transfer_local(self, data):
-        """Transfer a local file to device"""
+        """Transfer a local file to device.
+        
+        Instead of localFilePath, romUrl may name a ROM that is already in
+        the ROM cache (fetched earlier for any device).
+        """
         local_file_path = data.get('localFilePath')
+        rom_url = data.get('romUrl')
         rom_name = data.get('romName')
         platform = data.get('platform', '').lower()
         host_config = data.get('hostConfig', {})
         
-        if not local_file_path or not rom_name or not host_config:
+        if not (local_file_path or rom_url) or not rom_name or not host_config:
             self.send_error_response(400, "Missing required parameters")
             return
-            
-        if not os.path.exists(local_file_path):
+        
+        cached = not local_file_path
+        if cached:
+            local_file_path = self.engine.cached_copy(rom_url)
+            if local_file_path is None:
+                self.send_error_response(404, f"Not in the ROM cache: {rom_url}")
+                return
+        elif not os.path.exists(local_file_path):
             self.send_error_response(404, f"Local file not found: {local_file_path}")
             return
         
+        try:
+            self.transfer_local_file(local_file_path, rom_name, platform, host_config, data)
+        finally:
+            if cached:
+                self.engine.release_rom(local_file_path, True)
+    
+    def transfer_local_file(self, local_file_path, rom_name, platform, host_config, data):
+        md5 = data.get('md5') or (file_md5(local_file_path) if data.get('verify') == 'md5' else None)
+        if data.get('skipExisting', self.engine.skip_existing):
+            if self.engine.is_present(rom_name, platform, host_config,
+                                      size=os.path.getsize(local_file_path), md5=md5):
+                print(f"⏭️  {rom_name} is already on {host_config.get('hostIp')}")
+                self.send_success_response({'message': f"{rom_name} is already on the device", 'skipped': True})
+                return
+        
         # Transfer to device
         print(f"🚀 Transferring local file to {host_config.get('hostIp')}...")
-        success = self.transfer_to_device(local_file_path, rom_name, platform, host_config)
+        progress = self.engine.tracker.start(rom_name, host_config.get('hostIp'))
+        if self.engine.should_extract(rom_name, platform, data.get('extract')):
+            success, error = self.engine.transfer_extracted(local_file_path, rom_name, platform, host_config,
+                                                            progress)
+        else:
+            success, error = self.engine.transfer_to_device(local_file_path, rom_name, platform, host_config,
+                                                            progress, md5)
+        self.engine.tracker.finish(progress, error)
+        self.record_stages(progress)
         
         if success:
             self.send_success_response(f"Successfully transferred {rom_name}")
         else:
-            self.send_error_response(500, "Transfer failed")
+            self.send_error_response(500, f"Transfer failed: {error}")
     
     def handle_download_and_transfer(self, data):
         """Download ROM and transfer to device (combo action)"""
@@ -97,155 +722,156 @@ class TransferHandler(SimpleHTTPRequestHandler):
             self.send_error_response(400, "Missing required parameters")
             return
         
-        # Download ROM to temp file
-        print(f"📦 Downloading {rom_name}...")
-        temp_file = self.download_rom(rom_url, rom_name)
-        
-        if not temp_file:
-            self.send_error_response(500, "Failed to download ROM")
+        if data.get('skipExisting', self.engine.skip_existing) and self.engine.is_present(
+                rom_name, platform, host_config, rom_url, data.get('size'), data.get('md5')):
+            print(f"⏭️  {rom_name} is already on {host_config.get('hostIp')}")
+            self.send_success_response({'message': f"{rom_name} is already on the device", 'skipped': True})
             return
         
-        # Transfer to device
-        print(f"🚀 Transferring to {host_config.get('hostIp')}...")
-        success = self.transfer_to_device(temp_file, rom_name, platform, host_config)
-        
-        # Cleanup
-        try:
-            os.unlink(temp_file)
-        except:
-            pass
-        
+        progress = self.engine.tracker.start(rom_name, host_config.get('hostIp'))
+        success, error = self.engine.download_and_transfer(rom_url, rom_name, platform, host_config, progress,
+                                                           data.get('md5'), data.get('extract'))
+        self.engine.tracker.finish(progress, error)
+        self.record_stages(progress)
         if success:
             self.send_success_response(f"Successfully transferred {rom_name}")
         else:
-            self.send_error_response(500, "Transfer failed")
+            self.send_error_response(500, f"Transfer failed: {error}")
+    
+    def record_stages(self, progress):
+        """Put a transfer's phase timings into this request's timing log record"""
+        self.timings.update(progress.stage_times)
+        self.timing_details.update(rom=progress.name, device=progress.host, transferId=progress.id)
+    
+    def handle_submit_job(self, data):
+        """Queue a batch of ROMs for one device and return immediately"""
+        roms = data.get('roms') or []
+        host_config = data.get('hostConfig', {})
+        
+        if not roms or not host_config:
+            self.send_error_response(400, "Missing required parameters")
+            return
+        if any(not rom.get('romUrl') or not rom.get('romName') for rom in roms):
+            self.send_error_response(400, "Every ROM needs romUrl and romName")
+            return
+        
+        job = self.jobs.submit(roms, host_config, data.get('skipExisting', self.engine.skip_existing))
+        self.send_success_response(job.snapshot())
+    
+    def handle_job_status(self, path):
+        """GET /jobs lists all jobs, GET /jobs/<id> returns one with its items"""
+        job_id = path[len('/jobs/'):].strip('/') if path.startswith('/jobs/') else ''
+        if not job_id:
+            jobs = [job.snapshot(include_items=False) for job in self.jobs.list()]
+            self.send_success_response({'jobs': jobs})
+            return
+        
+        job = self.jobs.get(job_id)
+        if job is None:
+            self.send_error_response(404, f"Unknown job: {job_id}")
+        else:
+            self.send_success_response(job.snapshot())
+    
+    def handle_cancel_job(self, job_id):
+        job = self.jobs.cancel(job_id)
+        if job is None:
+            self.send_error_response(404, f"Unknown job: {job_id}")
+        else:
+            self.send_success_response(job.snapshot())
+    
+    def progress_payload(self, job_id=None):
+        """Per-transfer counters plus per-job totals"""
+        transfers = self.engine.tracker.snapshot(job_id)
+        jobs = [self.jobs.get(job_id)] if job_id else self.jobs.list()
+        job_data = []
+        for job in jobs:
+            data = job.snapshot(include_items=False)
+            active = [t for t in transfers if t['jobId'] == job.id]
+            data['uploadedBytes'] = sum(t['uploadedBytes'] for t in active)
+            data['uploadRate'] = sum(t['uploadRate'] for t in active)
+            job_data.append(data)
+        return {'transfers': transfers, 'jobs': job_data}
     
-    def download_rom(self, rom_url, rom_name):
-        """Download ROM file to temporary location"""
+    def handle_progress_stream(self, query):
+        """Server-Sent Events feed of transfer progress.
+        
+        Sends a snapshot every `interval` seconds (sooner when a transfer
+        starts or finishes). With ?job=<id> only that job is reported and
+        the stream ends once the job is done.
+        """
+        job_id = query.get('job', [None])[0]
         try:
-            # Create temp file with proper extension
-            _, ext = os.path.splitext(rom_name)
-            temp_fd, temp_file = tempfile.mkstemp(suffix=ext, prefix="rom_")
-            
-            # Download with user agent
-            req = urllib.request.Request(rom_url)
-            req.add_header('User-Agent', 'Mozilla/5.0 (ROM Downloader)')
-            
-            with urllib.request.urlopen(req) as response:
-                with os.fdopen(temp_fd, 'wb') as f:
-                    f.write(response.read())
-            
-            print(f"✅ Downloaded to {temp_file}")
-            return temp_file
-            
-        except Exception as e:
-            print(f"❌ Download failed: {e}")
-            return None
+            interval = min(max(float(query.get('interval', ['1'])[0]), 0.2), 30)
+        except ValueError:
+            interval = 1.0
+        if job_id and self.jobs.get(job_id) is None:
+            self.send_error_response(404, f"Unknown job: {job_id}")
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.close_connection = True
+        
+        try:
+            while True:
+                payload = self.progress_payload(job_id)
+                self.wfile.write(f"event: progress\ndata: {json.dumps(payload)}\n\n".encode('utf-8'))
+                if job_id and payload['jobs'][0]['status'] not in ('queued', 'running'):
+                    self.wfile.write(b"event: done\ndata: {}\n\n")
+                    break
+                self.engine.tracker.wait(interval)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Browser closed the EventSource
     
-    def transfer_to_device(self, local_file, rom_name, platform, host_config):
-        """Transfer ROM file to retro gaming device via SSH/SCP"""
+    def handle_discover(self, query):
+        """Server-Sent Events feed of SSH devices found on the LAN.
+        
+        ?cidr= picks the network (default: this machine's /24), ?port= the
+        SSH port and ?refresh=1 ignores cached results. Each device is sent
+        as a "host" event as soon as it answers; a final "done" event
+        carries the totals.
+        """
         try:
-            host_ip = host_config.get('hostIp')
-            username = host_config.get('username', 'root')
-            password = host_config.get('password', 'muos')
-            base_path = host_config.get('remoteBasePath', '/mnt/mmc/ROMS')
-            
-            print(f"🔧 Transfer config - IP: {host_ip}, User: {username}, Platform: {platform}")
-            print(f"🔧 Host config received: {host_config}")
-            
-            # Map platform to directory name
-            platform_dirs = {
-                'nes': 'nes',
-                'snes': 'snes', 
-                'gb': 'gb',
-                'game boy': 'gb',  # Handle "Game Boy" platform name
-                'gbc': 'gbc',
-                'gba': 'gba',
-                'genesis': 'genesis',
-                'gamegear': 'gamegear',
-                'sms': 'sms',
-                'segacd': 'segacd',
-                'sega32x': 'sega32x',
-                'saturn': 'saturn',
-                'ngp': 'ngp'
-            }
-            
-            platform_dir = platform_dirs.get(platform, platform)
-            remote_path = f"{base_path}/{platform_dir}"
-            
-            # Create remote directory if needed
-            mkdir_cmd = [
-                'sshpass', '-p', password,
-                'ssh', '-o', 'StrictHostKeyChecking=no',
-                '-o', 'UserKnownHostsFile=/dev/null',
-                '-o', 'ConnectTimeout=10',
-                f"{username}@{host_ip}",
-                f"mkdir -p '{remote_path}'"
-            ]
-            
-            print(f"📁 Creating directory: {remote_path}")
-            subprocess.run(mkdir_cmd, check=False, capture_output=True)
-            
-            # Transfer file
-            scp_cmd = [
-                'sshpass', '-p', password,
-                'scp', '-o', 'StrictHostKeyChecking=no',
-                '-o', 'UserKnownHostsFile=/dev/null',
-                '-o', 'ConnectTimeout=30',
-                local_file,
-                f"{username}@{host_ip}:{remote_path}/{rom_name}"
-            ]
-            
-            print(f"📤 Transferring {rom_name} to {host_ip}:{remote_path}/")
-            result = subprocess.run(scp_cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print(f"✅ Transfer successful!")
-                return True
-            else:
-                print(f"❌ Transfer failed with password '{password}': {result.stderr}")
-                
-                # Try alternative muOS passwords
-                alt_passwords = ['root', '', 'admin']
-                for alt_password in alt_passwords:
-                    if alt_password == password:
-                        continue
-                        
-                    print(f"🔄 Trying alternative password: '{alt_password}'")
-                    
-                    # Try mkdir with alternative password
-                    alt_mkdir_cmd = [
-                        'sshpass', '-p', alt_password,
-                        'ssh', '-o', 'StrictHostKeyChecking=no',
-                        '-o', 'UserKnownHostsFile=/dev/null',
-                        '-o', 'ConnectTimeout=10',
-                        f"{username}@{host_ip}",
-                        f"mkdir -p '{remote_path}'"
-                    ]
-                    subprocess.run(alt_mkdir_cmd, check=False, capture_output=True)
-                    
-                    # Try SCP with alternative password
-                    alt_scp_cmd = [
-                        'sshpass', '-p', alt_password,
-                        'scp', '-o', 'StrictHostKeyChecking=no',
-                        '-o', 'UserKnownHostsFile=/dev/null',
-                        '-o', 'ConnectTimeout=30',
-                        local_file,
-                        f"{username}@{host_ip}:{remote_path}/{rom_name}"
-                    ]
-                    
-                    alt_result = subprocess.run(alt_scp_cmd, capture_output=True, text=True)
-                    if alt_result.returncode == 0:
-                        print(f"✅ Transfer successful with password '{alt_password}'!")
-                        return True
-                    else:
-                        print(f"❌ Transfer failed with password '{alt_password}': {alt_result.stderr}")
-                
-                return False
-                
-        except Exception as e:
-            print(f"❌ Transfer error: {e}")
-            return False
+            cidr = query.get('cidr', [None])[0] or local_network()
+            port = int(query.get('port', ['22'])[0])
+            self.discovery.addresses(cidr)
+        except (ValueError, OSError) as e:
+            self.send_error_response(400, f"Can't scan: {e}")
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.close_connection = True
+        
+        def send_host(host):
+            self.wfile.write(f"event: host\ndata: {json.dumps(host)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        
+        started = time.monotonic()
+        print(f"🔎 Scanning {cidr} for SSH on port {port}...")
+        try:
+            found = self.discovery.scan(cidr, port, send_host, refresh=query.get('refresh', ['0'])[0] == '1')
+            elapsed = time.monotonic() - started
+            print(f"🔎 Found {len(found)} device(s) on {cidr} in {elapsed:.1f}s")
+            summary = {'cidr': cidr, 'found': len(found), 'elapsed': round(elapsed, 2)}
+            self.wfile.write(f"event: done\ndata: {json.dumps(summary)}\n\n".encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Browser closed the EventSource
+    
+    def route_name(self):
+        path = urlparse(self.path).path
+        if path.startswith('/jobs/'):
+            return 'jobs/cancel' if path.endswith('/cancel') else 'jobs/id'
+        if path in ('/check-file', '/check-files', '/transfer', '/jobs', '/progress', '/discover', '/metrics'):
+            return path[1:]
+        # Any other POST is a download-and-transfer request
+        return 'download-and-transfer' if self.command == 'POST' else 'static'
     
     def send_success_response(self, message_or_data):
         """Send successful response"""
@@ -271,12 +897,137 @@ class TransferHandler(SimpleHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json_data)
 
+def build_parser():
+    parser = argparse.ArgumentParser(description="ROM transfer service for muOS/Rocknix devices")
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--staged', action='store_true',
+                        help="download to a temp file before uploading instead of streaming")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="pipe buffer size in bytes when streaming")
+    parser.add_argument('--ssh-idle-timeout', type=float, default=300,
+                        help="seconds an idle device SSH session is kept open")
+    parser.add_argument('--ssh-connect-timeout', type=float, default=10,
+                        help="seconds to wait for a device to answer before giving up on it")
+    parser.add_argument('--auth-cache-ttl', type=float, default=3600,
+                        help="seconds the password that worked for a device is tried first")
+    parser.add_argument('--auth-failure-ttl', type=float, default=30,
+                        help="seconds a failed device connection is reported without retrying")
+    parser.add_argument('--no-skip-existing', action='store_true',
+                        help="upload ROMs even if the device already has a file of the same size")
+    parser.add_argument('--inventory-ttl', type=float, default=600,
+                        help="seconds a device directory listing is reused before relisting")
+    parser.add_argument('--retries', type=int, default=3,
+                        help="times an interrupted transfer is resumed before giving up")
+    parser.add_argument('--segments', type=int, default=4,
+                        help="parallel range requests per staged download (1 disables segmenting)")
+    parser.add_argument('--segment-min-size', type=int, default=8 * 1024 * 1024,
+                        help="minimum bytes per segment; smaller files download as one stream")
+    parser.add_argument('--rom-cache-dir', default=DEFAULT_ROM_CACHE_DIR,
+                        help="directory of the local ROM cache shared by all devices")
+    parser.add_argument('--rom-cache-size', type=float, default=20,
+                        help="ROM cache budget in GB; least recently used ROMs are evicted")
+    parser.add_argument('--rom-cache-ttl', type=float, default=7 * 24 * 3600,
+                        help="seconds a cached ROM is used without revalidating it upstream")
+    parser.add_argument('--no-rom-cache', action='store_true',
+                        help="don't keep downloaded ROMs for other devices")
+    parser.add_argument('--extract-platforms', default=','.join(sorted(DEFAULT_EXTRACT_PLATFORMS)),
+                        help="comma-separated platforms whose .zip/.7z ROMs are unpacked before upload "
+                             "('all' or 'none' also work)")
+    parser.add_argument('--extract-workers', type=int, default=2,
+                        help="processes used for archive extraction")
+    parser.add_argument('--discovery-ttl', type=float, default=300,
+                        help="seconds a network scan result is reused before the address is probed again")
+    parser.add_argument('--per-host-limit', type=int, default=8,
+                        help="maximum simultaneous connections to one archive host")
+    parser.add_argument('--max-concurrency', type=int, default=16,
+                        help="maximum number of requests handled at once")
+    parser.add_argument('--download-workers', type=int, default=4,
+                        help="parallel ROM downloads for batch jobs")
+    parser.add_argument('--upload-workers', type=int, default=6,
+                        help="parallel device uploads for batch jobs, across all devices")
+    parser.add_argument('--per-device-limit', type=int, default=2,
+                        help="parallel uploads to any single device to start with")
+    parser.add_argument('--max-per-device-limit', type=int, default=6,
+                        help="most parallel uploads to one device the adaptive limit may reach")
+    parser.add_argument('--fixed-device-concurrency', action='store_true',
+                        help="keep --per-device-limit instead of adapting it to each device's write speed")
+    parser.add_argument('--upload-limit', type=parse_rate, default=0, metavar='RATE',
+                        help="cap on all device uploads together in bytes/s, e.g. 20M (0 = unlimited)")
+    parser.add_argument('--device-upload-limit', type=parse_rate, default=0, metavar='RATE',
+                        help="cap on uploads to each device in bytes/s, e.g. 5M (0 = unlimited)")
+    parser.add_argument('--download-limit', type=parse_rate, default=0, metavar='RATE',
+                        help="cap on ROM downloads from archives in bytes/s, e.g. 10M (0 = unlimited)")
+    parser.add_argument('--job-order', choices=JOB_ORDERS, default='smallest',
+                        help="which queued batch job ROMs start first: smallest (quick wins), "
+                             "largest, or fifo (submission order)")
+    parser.add_argument('--batch-file-size', type=int, default=4 * 1024 * 1024,
+                        help="batch jobs send ROMs up to this many bytes as tar streams (0 disables)")
+    parser.add_argument('--batch-max-files', type=int, default=200,
+                        help="maximum ROMs per tar stream")
+    parser.add_argument('--library-dir', action='append', metavar='DIR',
+                        help="local ROM library directory searched by /check-file(s), subfolders included "
+                             "(repeatable; default: ~/Downloads)")
+    parser.add_argument('--library-rescan-interval', type=float, default=5,
+                        help="seconds between checks of the library directories for changes")
+    parser.add_argument('--timing-log', metavar='PATH',
+                        help="append a JSON line with stage timings for every request and transfer to PATH")
+    return parser
+
+def configure(args, upstream=None):
+    """Set up TransferHandler from parsed arguments; returns the engine.
+
+    Pass upstream to share an UpstreamPool with another service. Call
+    engine.close() on shutdown.
+    """
+    ssh_pool = SSHSessionPool(idle_timeout=args.ssh_idle_timeout, connect_timeout=args.ssh_connect_timeout,
+                              auth_ttl=args.auth_cache_ttl, failure_ttl=args.auth_failure_ttl)
+    upstream = upstream or UpstreamPool(max_per_host=args.per_host_limit)
+    rom_cache = None
+    if not args.no_rom_cache:
+        rom_cache = RomCache(args.rom_cache_dir, max_bytes=int(args.rom_cache_size * 1024 ** 3),
+                             ttl=args.rom_cache_ttl)
+    extractor = None
+    if args.extract_platforms.strip().lower() != 'none':
+        platforms = None if args.extract_platforms.strip().lower() == 'all' else \
+            {name.strip().lower() for name in args.extract_platforms.split(',') if name.strip()}
+        extractor = ArchiveExtractor(platforms, workers=args.extract_workers)
+    timing_log = TimingLog(args.timing_log) if args.timing_log else None
+    bandwidth = BandwidthScheduler(upload_rate=args.upload_limit, device_upload_rate=args.device_upload_limit,
+                                   download_rate=args.download_limit, device_concurrency=args.per_device_limit,
+                                   max_device_concurrency=args.max_per_device_limit,
+                                   adaptive=not args.fixed_device_concurrency)
+    engine = TransferEngine(ssh_pool, upstream, pipeline=not args.staged, chunk_size=args.chunk_size,
+                            skip_existing=not args.no_skip_existing, inventory_ttl=args.inventory_ttl,
+                            retries=args.retries, segments=args.segments,
+                            segment_min_size=args.segment_min_size, rom_cache=rom_cache,
+                            extractor=extractor, timing_log=timing_log, bandwidth=bandwidth)
+    TransferHandler.engine = engine
+    TransferHandler.timing_log = timing_log
+    TransferHandler.discovery = DeviceDiscovery(ttl=args.discovery_ttl)
+    TransferHandler.library = LibraryIndex(args.library_dir or DEFAULT_LIBRARY_DIRS,
+                                           rescan_interval=args.library_rescan_interval)
+    # Build the index in the background so a large library doesn't hold up startup
+    threading.Thread(target=TransferHandler.library.refresh, daemon=True, name='library-index').start()
+    TransferHandler.jobs = JobManager(engine, download_workers=args.download_workers,
+                                      upload_workers=args.upload_workers,
+                                      batch_file_size=args.batch_file_size,
+                                      batch_max_files=args.batch_max_files,
+                                      order=args.job_order)
+    ACTIVE_TRANSFERS.set_function(engine.tracker.active)
+    QUEUE_DEPTH.set_function(TransferHandler.jobs.queue_depth)
+    LIBRARY_FILES.set_function(TransferHandler.library.file_count)
+    return engine
+
 def main():
-    port = 8002
+    args = build_parser().parse_args()
+    port = args.port
+    engine = configure(args)
     
     print("🚀 Starting ROM Transfer Service...")
     print(f"📡 Listening on http://localhost:{port}")
     print("📝 This service handles ROM transfers to muOS/Rocknix devices")
+    print(f"📈 Metrics: http://localhost:{port}/metrics")
+    print(f"📚 Local ROM library: {', '.join(TransferHandler.library.roots)}")
     print("⚠️  Make sure 'sshpass' is installed: brew install hudochenkov/sshpass/sshpass")
     print("🔄 Keep this running alongside your main server and proxy")
     print("=" * 60)
@@ -286,11 +1037,12 @@ def main():
         subprocess.run(['sshpass', '-V'], capture_output=True, check=True)
         print("✅ sshpass is available")
     except (subprocess.CalledProcessError, FileNotFoundError):
-        print("❌ sshpass not found! Install with: brew install hudochenkov/sshpass/sshpass")
-        sys.exit(1)
+        print("⚠️  sshpass not found! Install with: brew install hudochenkov/sshpass/sshpass")
+        print("   Only devices configured with an identityFile can be reached without it")
     
     try:
-        httpd = HTTPServer(('localhost', port), TransferHandler)
+        httpd = BoundedThreadingHTTPServer(('localhost', port), TransferHandler,
+                                           max_concurrency=args.max_concurrency)
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 Transfer service stopped")
@@ -299,6 +1051,8 @@ def main():
             print(f"❌ Port {port} is already in use. Try a different port or stop the existing service.")
         else:
             print(f"❌ Error starting server: {e}")
+    finally:
+        engine.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Keep-alive connection pool for upstream archive hosts
+Reuses HTTP(S) connections per host instead of paying a new TCP+TLS
+handshake for every request, and caps in-flight requests per host so
+parallel directory crawls don't get us rate-limited.
+"""
+
+import http.client
+import ssl
+import threading
+import time
+import urllib.parse
+from urllib.error import URLError, HTTPError
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9'
+}
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# Errors that mean a reused keep-alive connection was closed by the host
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class PooledResponse:
+    """Upstream response that hands its connection back to the pool on close"""
+
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.closed = False
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        reusable = self.response.isclosed() and not self.response.will_close
+        self.response.close()
+        self.pool.release(self.key, self.conn, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class UpstreamPool:
+    """Per-host pool of keep-alive connections with a per-host request cap"""
+
+    def __init__(self, max_per_host=4, idle_timeout=60, timeout=30, max_redirects=5):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.ssl_context = ssl.create_default_context()
+        self.lock = threading.Lock()
+        self.idle = {}     # key -> [(connection, last_used)]
+        self.slots = {}    # key -> BoundedSemaphore limiting in-flight requests
+
+    def request(self, url, headers=None, method='GET'):
+        """Send a request and return a PooledResponse, following redirects.
+
+        Mirrors urllib.request.urlopen: HTTP error statuses raise HTTPError
+        and connection problems raise URLError. 304 and 206 are returned.
+        """
+        request_headers = dict(DEFAULT_HEADERS)
+        request_headers.update(headers or {})
+
+        for _ in range(self.max_redirects + 1):
+            response = self._send(url, request_headers, method)
+            if response.status in REDIRECT_CODES and response.headers.get('Location'):
+                location = urllib.parse.urljoin(url, response.headers['Location'])
+                response.read()
+                response.close()
+                if response.status == 303:
+                    method = 'GET'
+                url = location
+                continue
+            if response.status >= 400:
+                status, reason, response_headers = response.status, response.reason, response.headers
+                response.read()
+                response.close()
+                raise HTTPError(url, status, reason, response_headers, None)
+            return response
+        raise URLError(f"Too many redirects for {url}")
+
+    def _send(self, url, headers, method):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise URLError(f"Unsupported URL: {url}")
+
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname.lower(), port)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        self._slot(key).acquire()
+        try:
+            conn, reused = self._checkout(key)
+            try:
+                conn.request(method, target, headers=headers)
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                # The host dropped an idle keep-alive connection; retry once fresh
+                conn = self._connect(key)
+                conn.request(method, target, headers=headers)
+                response = conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            self._slot(key).release()
+            raise URLError(e)
+        except BaseException:
+            self._slot(key).release()
+            raise
+
+        return PooledResponse(self, key, conn, response, url)
+
+    def _slot(self, key):
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_per_host)
+                self.slots[key] = slot
+            return slot
+
+    def _checkout(self, key):
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._connect(key), False
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout,
+                                               context=self.ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def release(self, key, conn, reusable):
+        """Return a connection after its response was closed"""
+        if reusable:
+            with self.lock:
+                self.idle.setdefault(key, []).append((conn, time.monotonic()))
+        else:
+            conn.close()
+        self._slot(key).release()
+
+    def close(self):
+        """Close every idle connection"""
+        with self.lock:
+            for connections in self.idle.values():
+                for conn, _ in connections:
+                    conn.close()
+            self.idle.clear()